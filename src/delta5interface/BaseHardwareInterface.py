@@ -1,20 +1,47 @@
-from datetime import datetime
-from datetime import timedelta
-import time
+import base64
+import struct
+
+from Delta5Clock import monotonic
+from Delta5Metrics import get_metrics
+from Delta5Trace import TraceStore
+from Delta5Replay import PassReplay
+
+HEARTBEAT_BINARY_VERSION = 1
+HEARTBEAT_BINARY_HEADER = '>BB' # Version, node count
+HEARTBEAT_BINARY_NODE = 'HI' # Current rssi, loop time
+
+heartbeat_structs = {} # Packers by node count
 
 class BaseHardwareInterface(object):
     def __init__(self):
         self.calibration_threshold = 20
         self.calibration_offset = 10
         self.trigger_threshold = 20
-        self.start_time = datetime.now()
+        self.start_time = monotonic()
         self.filter_ratio = 50
+        self.metrics = get_metrics() # Shared with the server, served on /metrics
+        self.metrics.define('delta5_passes_total', 'counter', 'Passes reported by the nodes')
+        self.metrics.define('delta5_pass_to_emit_ms', 'histogram',
+            'Milliseconds from reading a pass to the pass record callback returning')
+        self.traces = TraceStore() # Spans of recent passes, for finding slow stages
 
-    # returns the elapsed milliseconds since the start of the program
+    # returns the elapsed milliseconds since the start of the program, wall clock changes
+    # from NTP on the pi don't affect it
     def milliseconds(self):
-       dt = datetime.now() - self.start_time
-       ms = round((dt.days * 24 * 60 * 60 + dt.seconds) * 1000 + dt.microseconds / 1000.0)
-       return ms
+       return (monotonic() - self.start_time) * 1000.0
+
+    def start_pass_trace(self, node, lap_id, source='node'):
+        '''Starts the trace of a new pass, handlers add spans through node.trace.'''
+        node.trace = self.traces.start_trace(node.index, lap_id, self.milliseconds, source)
+        return node.trace
+
+    def replay_passes(self, passes, speed=1.0):
+        '''Feeds (ms from start, node index) passes to the pass record callback at the
+        given multiple of real time, REPLAY_MAX_SPEED for no waits. Returns the replay
+        with its latencies once all passes are sent.'''
+        replay = PassReplay(self, passes, speed)
+        replay.run()
+        return replay
 
     #
     # Get Json Node Data Functions
@@ -35,6 +62,31 @@ class BaseHardwareInterface(object):
             'loop_time': [node.loop_time for node in self.nodes]
         }
 
+    def get_rssi_history_json(self, starts=None, decimation=1):
+        '''Rssi samples of each node from the given sample numbers on, with the next
+        numbers to ask for. All held samples are returned when starts is None.'''
+        if starts is None:
+            starts = [0] * len(self.nodes)
+        return {
+            'nodes': [node.history.get_json(start, decimation) \
+                for node, start in zip(self.nodes, starts)]
+        }
+
+    def get_heartbeat_binary(self):
+        '''Packs the heartbeat json values, 6 bytes a node after a 2 byte header, big endian.
+        Returned as base64 text: python-socketio sends python 2 events as json, where raw
+        bytes from 0x80 up don't encode.'''
+        count = len(self.nodes)
+        packer = heartbeat_structs.get(count)
+        if packer is None:
+            packer = struct.Struct(HEARTBEAT_BINARY_HEADER + HEARTBEAT_BINARY_NODE * count)
+            heartbeat_structs[count] = packer
+        values = [HEARTBEAT_BINARY_VERSION, count]
+        for node in self.nodes:
+            values.append(node.current_rssi)
+            values.append(node.loop_time & 0xFFFFFFFF)
+        return base64.b64encode(packer.pack(*values))
+
     def get_calibration_threshold_json(self):
         return {
             'calibration_threshold': self.calibration_threshold
@@ -0,0 +1,81 @@
+'''Monotonic clock for the server and clock estimates for each node.'''
+
+import ctypes
+import ctypes.util
+import os
+import time
+
+CLOCK_MONOTONIC = 1 # Linux clock id, unaffected by NTP or manual time changes
+
+CLOCK_DRIFT_MIN_INTERVAL = 1000 # Minimum milliseconds between samples used for drift
+CLOCK_DRIFT_SMOOTHING = 0.1 # Weight of the newest drift measurement in the average
+CLOCK_DRIFT_LIMIT = 0.01 # Node clock rates further than 1% from the server are rejected
+
+class timespec(ctypes.Structure):
+    _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+def get_monotonic():
+    '''Returns the best monotonic seconds function available, python 2 has none built in.'''
+    if hasattr(time, 'monotonic'):
+        return time.monotonic
+    try:
+        librt = ctypes.CDLL(ctypes.util.find_library('rt') or 'librt.so.1', use_errno=True)
+        clock_gettime = librt.clock_gettime
+        clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(timespec)]
+    except (OSError, AttributeError):
+        return time.time # No clock_gettime, fall back to the wall clock
+    def monotonic():
+        spec = timespec()
+        if clock_gettime(CLOCK_MONOTONIC, ctypes.byref(spec)) != 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        return spec.tv_sec + spec.tv_nsec * 1e-9
+    return monotonic
+
+monotonic = get_monotonic()
+
+
+class NodeClock():
+    '''Estimates when passes happened in server time from a node's lap stats.
+
+    READ_LAP_STATS reports the node millis() since the last pass. Samples of
+    the same lap show how fast the node clock runs against the server clock,
+    and the read instant of each sample turns the node time back into server
+    time. The read instant is the middle of the i2c transaction, so the
+    estimate is only as uncertain as half the transaction time.'''
+    def __init__(self):
+        self.rate = 1.0 # Node milliseconds per server millisecond
+        self.lap_id = -1
+        self.reference_time = 0 # First sample of the current lap
+        self.reference_ms_since_lap = 0
+        self.pass_timestamp = 0 # Best estimate of the last pass, server milliseconds
+        self.pass_error = 0 # Uncertainty of the pass estimate, milliseconds
+
+    def add_sample(self, lap_id, read_start, read_end, ms_since_lap):
+        '''Adds a lap stats read, times are server milliseconds around the transaction.
+        Returns the estimated server time of the last pass.'''
+        read_time = (read_start + read_end) / 2.0
+        error = (read_end - read_start) / 2.0
+        if lap_id != self.lap_id:
+            self.lap_id = lap_id
+            self.reference_time = read_time
+            self.reference_ms_since_lap = ms_since_lap
+            self.pass_error = None
+        else:
+            elapsed = read_time - self.reference_time
+            if elapsed >= CLOCK_DRIFT_MIN_INTERVAL:
+                rate = (ms_since_lap - self.reference_ms_since_lap) / float(elapsed)
+                if abs(rate - 1.0) < CLOCK_DRIFT_LIMIT:
+                    self.rate = self.rate + CLOCK_DRIFT_SMOOTHING * (rate - self.rate)
+
+        # Keep the estimate from the tightest read of this lap
+        if self.pass_error is None or error < self.pass_error:
+            self.pass_timestamp = read_time - ms_since_lap / self.rate
+            self.pass_error = error
+        return self.pass_timestamp
+
+    def get_json(self):
+        return {
+            'drift_ppm': (self.rate - 1.0) * 1000000,
+            'pass_error': self.pass_error
+        }
@@ -1,8 +1,10 @@
 '''Delta 5 hardware interface layer.'''
 
-import smbus # For i2c comms
+import json
+import os
+
 import gevent # For threads and timing
-from gevent.lock import BoundedSemaphore # To limit i2c calls
+from gevent.lock import BoundedSemaphore, Semaphore # To limit i2c calls
 
 from Node import Node
 from BaseHardwareInterface import BaseHardwareInterface
@@ -23,11 +25,32 @@ WRITE_CALIBRATION_OFFSET = 0x67
 WRITE_TRIGGER_THRESHOLD = 0x68
 WRITE_FILTER_RATIO = 0x69
 
-UPDATE_SLEEP = 0.1 # Main update loop delay
+UPDATE_PERIOD = 0.05 # Main update loop target time between poll cycle starts
+
+I2C_ADDRS = [8, 10, 12, 14, 16, 18, 20, 22] # Software limited to 8 nodes
+# Last known nodes and settings, for starting without a scan
+NODE_MAP_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'node_map.json')
+NODE_RESCAN_PERIOD = 5.0 # Seconds between checks for lost, rebooted and new nodes
+NODE_OFFLINE_FAILURES = 3 # Failed poll reads before a node is left to the rescans
+NODE_MAP_SETTINGS = ['frequency', 'calibration_threshold', 'calibration_offset',
+    'trigger_threshold', 'filter_ratio']
 
-I2C_CHILL_TIME = 0.075 # Delay after i2c read/write
+I2C_CHILL_TIME = 0.075 # Maximum delay between i2c read/writes to the same node
+I2C_CHILL_TIME_MIN = 0.002 # Minimum delay between i2c read/writes to the same node
+I2C_CHILL_FACTOR = 2.0 # Node delay as a multiple of its measured transaction time
+I2C_TURNAROUND_SMOOTHING = 0.2 # Weight of the newest transaction time in the average
 I2C_RETRY_COUNT = 5 # Limit of i2c retries
 
+# Node settings pushed by push_config, node attribute: (write command, read command, bytes)
+CONFIG_REGISTERS = {
+    'frequency': (WRITE_FREQUENCY, READ_FREQUENCY, 2),
+    'calibration_threshold': (WRITE_CALIBRATION_THRESHOLD, READ_CALIBRATION_THRESHOLD, 2),
+    'calibration_mode': (WRITE_CALIBRATION_MODE, READ_CALIBRATION_MODE, 1),
+    'calibration_offset': (WRITE_CALIBRATION_OFFSET, READ_CALIBRATION_OFFSET, 2),
+    'trigger_threshold': (WRITE_TRIGGER_THRESHOLD, READ_TRIGGER_THRESHOLD, 2),
+    'filter_ratio': (WRITE_FILTER_RATIO, READ_FILTER_RATIO, 1)
+}
+
 def unpack_8(data):
     return data[0]
 
@@ -62,48 +85,253 @@ def validate_checksum(data):
     return checksum == data[-1]
 
 
-class Delta5Interface(BaseHardwareInterface):
+class I2CPacing():
+    '''Adaptive delay between i2c transactions to one node address.
+
+    Each node needs time to service a request, but other addresses on the bus
+    can be used in the meantime. The delay follows the measured transaction
+    time of the node and backs off towards I2C_CHILL_TIME after failures.'''
+    def __init__(self):
+        self.timestamp = -1 # End of the last transaction, milliseconds
+        self.read_start = 0 # Start and end of the last successful transaction
+        self.read_end = 0
+        self.turnaround = I2C_CHILL_TIME_MIN * 1000 # Smoothed transaction time
+        self.backoff = 0 # Extra delay after failed transactions
+
+    def chill_time(self):
+        '''Returns the delay in milliseconds needed since the last transaction.'''
+        chill = max(I2C_CHILL_TIME_MIN * 1000, self.turnaround * I2C_CHILL_FACTOR)
+        return min(I2C_CHILL_TIME * 1000, chill + self.backoff)
+
+    def success(self, timestamp, duration):
+        self.timestamp = timestamp
+        self.read_start = timestamp - duration
+        self.read_end = timestamp
+        self.turnaround = self.turnaround + \
+            I2C_TURNAROUND_SMOOTHING * (duration - self.turnaround)
+        self.backoff = self.backoff / 2
+
+    def failure(self, timestamp):
+        self.timestamp = timestamp
+        self.backoff = min(I2C_CHILL_TIME * 1000,
+            max(I2C_CHILL_TIME_MIN * 1000, self.backoff * 2))
+
+
+class PollStats():
+    '''Duration statistics of full node poll cycles.'''
     def __init__(self):
+        self.cycles = 0
+        self.last = 0
+        self.minimum = 0
+        self.maximum = 0
+        self.total = 0
+
+    def add(self, duration):
+        if self.cycles == 0 or duration < self.minimum:
+            self.minimum = duration
+        if duration > self.maximum:
+            self.maximum = duration
+        self.cycles = self.cycles + 1
+        self.last = duration
+        self.total = self.total + duration
+
+    def get_json(self):
+        return {
+            'cycles': self.cycles,
+            'last': self.last,
+            'min': self.minimum,
+            'max': self.maximum,
+            'average': self.total / float(self.cycles) if self.cycles else 0
+        }
+
+
+class Delta5Interface(BaseHardwareInterface):
+    def __init__(self, i2c=None, node_map_path=NODE_MAP_FILE):
         BaseHardwareInterface.__init__(self)
         self.update_thread = None # Thread for running the main update loop
         self.pass_record_callback = None # Function added in server.py
         self.hardware_log_callback = None # Function added in server.py
 
-        self.i2c = smbus.SMBus(1) # Start i2c bus
+        if i2c is None:
+            import smbus # For i2c comms
+            i2c = smbus.SMBus(1) # Start i2c bus
+        self.i2c = i2c # Any object with the smbus block read/write functions
         self.semaphore = BoundedSemaphore(1) # Limits i2c to 1 read/write at a time
-        self.i2c_timestamp = -1
-
-        # Scans all i2c_addrs to populate nodes array
+        self.i2c_pacing = {} # Adaptive delay for each i2c address
+        self.poll_stats = PollStats() # Full poll cycle durations
+        self.metrics.define('delta5_i2c_transaction_ms', 'histogram',
+            'Milliseconds each i2c transaction held the bus')
+        self.metrics.define('delta5_i2c_retries_total', 'counter',
+            'I2c transactions retried after an io error or a bad checksum')
+        self.metrics.define('delta5_i2c_failures_total', 'counter',
+            'I2c reads and writes that failed every retry')
+        self.metrics.define('delta5_poll_cycle_ms', 'histogram',
+            'Milliseconds to poll every node once')
+        self.node_map_path = node_map_path # None to always scan and never save
+        self.new_addrs = [] # Addresses found by the rescans, saved in the map for the next start
+        self.config_lock = Semaphore(1) # Node settings pushes and restores, one at a time
+
+        # Nodes come from the saved node map when there is one, checked in the background
         self.nodes = [] # Array to hold each node object
-        i2c_addrs = [8, 10, 12, 14, 16, 18, 20, 22] # Software limited to 8 nodes
-        for index, addr in enumerate(i2c_addrs):
-            try:
-                self.i2c.read_i2c_block_data(addr, READ_ADDRESS, 1)
+        verify = self.load_node_map()
+        if not verify:
+            self.scan_nodes()
+        self.discovery_thread = gevent.spawn(self.discovery_loop, verify)
+
+    #
+    # Node discovery
+    #
+
+    def scan_nodes(self):
+        '''Probes every address and reads the settings of the nodes found.'''
+        for index, addr in enumerate(I2C_ADDRS):
+            if self.probe(addr):
                 print "Node FOUND at address {0}".format(addr)
-                gevent.sleep(I2C_CHILL_TIME)
                 node = Node() # New node instance
                 node.i2c_addr = addr # Set current loop i2c_addr
                 node.index = index
                 self.nodes.append(node) # Add new node to Delta5Interface
-            except IOError as err:
+            else:
                 print "No node at address {0}".format(addr)
-            gevent.sleep(I2C_CHILL_TIME)
 
         for node in self.nodes:
-            node.frequency = self.get_value_16(node, READ_FREQUENCY)
-            if node.index == 0:
-                self.calibration_threshold = self.get_value_16(node,
-                    READ_CALIBRATION_THRESHOLD)
-                self.calibration_offset = self.get_value_16(node,
-                    READ_CALIBRATION_OFFSET)
-                self.trigger_threshold = self.get_value_16(node,
-                    READ_TRIGGER_THRESHOLD)
-                self.filter_ratio = self.get_value_8(node,
-                    READ_FILTER_RATIO)
+            self.read_node_config(node)
+        if self.nodes:
+            first = self.nodes[0]
+            self.calibration_threshold = first.calibration_threshold
+            self.calibration_offset = first.calibration_offset
+            self.trigger_threshold = first.trigger_threshold
+            self.filter_ratio = first.filter_ratio
+        # The first node's tuning is copied to the others
+        self.push_config([(node, {
+            'calibration_threshold': self.calibration_threshold,
+            'calibration_offset': self.calibration_offset,
+            'trigger_threshold': self.trigger_threshold
+        }) for node in self.nodes[1:]])
+
+    def probe(self, addr):
+        '''Returns True if a node acknowledges the address, one try without pacing.'''
+        try:
+            with self.semaphore:
+                self.i2c.read_i2c_block_data(addr, READ_ADDRESS, 1)
+            return True
+        except IOError:
+            return False
+
+    def read_node_config(self, node):
+        '''Reads the node settings into its shadow registers.'''
+        for attribute in NODE_MAP_SETTINGS:
+            write_command, read_command, size = CONFIG_REGISTERS[attribute]
+            if size == 1:
+                value = self.get_value_8(node, read_command)
+            else:
+                value = self.get_value_16(node, read_command)
+            if value is not None:
+                setattr(node, attribute, value)
+
+    def restore_node(self, node):
+        '''Writes back any settings a node lost, after a reboot or a changed node map.
+        Holds the config lock so a push in progress, like the server's startup profile,
+        finishes first and its values are the ones restored.'''
+        with self.config_lock:
+            expected = dict((attribute, getattr(node, attribute)) \
+                for attribute in NODE_MAP_SETTINGS if getattr(node, attribute) is not None)
+            self.read_node_config(node)
+            self.push_node_config(node, expected)
+        node.last_lap_id = -1 # The lap counter restarts, the next read is not a pass
+
+    def discovery_loop(self, verify):
+        '''Checks a loaded node map, then periodically rescans for node changes.'''
+        if verify:
+            self.verify_nodes()
+        while True:
+            gevent.sleep(NODE_RESCAN_PERIOD)
+            self.rescan_nodes()
+
+    def verify_nodes(self):
+        '''Checks the nodes loaded from the node map are there with their settings.'''
+        for node in self.nodes:
+            if self.probe(node.i2c_addr):
+                self.restore_node(node)
             else:
-                self.set_calibration_threshold(node.index, self.calibration_threshold)
-                self.set_calibration_offset(node.index, self.calibration_offset)
-                self.set_trigger_threshold(node.index, self.trigger_threshold)
+                node.online = False
+                self.log('Node {0} at address {1} not found'.format(node.index,
+                    node.i2c_addr))
+        self.save_node_map()
+
+    def rescan_nodes(self):
+        '''Brings back lost nodes, restores rebooted ones and reports new addresses.
+        Each check is a single transaction shared with the poll loop through the semaphore.'''
+        for node in self.nodes:
+            if not node.online:
+                if self.probe(node.i2c_addr):
+                    self.restore_node(node)
+                    node.read_failures = 0
+                    node.online = True
+                    self.log('Node {0} at address {1} back online'.format(node.index,
+                        node.i2c_addr))
+            elif node.frequency is not None and \
+                self.get_value_16(node, READ_FREQUENCY) not in (None, node.frequency):
+                self.log('Node {0} at address {1} reset, restoring settings'.format( \
+                    node.index, node.i2c_addr))
+                self.restore_node(node)
+        known_addrs = [node.i2c_addr for node in self.nodes]
+        for addr in I2C_ADDRS:
+            if addr not in known_addrs and addr not in self.new_addrs and self.probe(addr):
+                self.new_addrs.append(addr)
+                self.log('New node at address {0}, restart the server to use it'.format(addr))
+                self.save_node_map()
+
+    def load_node_map(self):
+        '''Creates the nodes from the saved node map, returns False if there isn't one.'''
+        if self.node_map_path is None or not os.path.exists(self.node_map_path):
+            return False
+        try:
+            with open(self.node_map_path) as node_map_file:
+                node_map = json.load(node_map_file)
+            for node_json in node_map['nodes']:
+                node = Node()
+                node.i2c_addr = node_json['addr']
+                node.index = node_json['index']
+                for attribute in NODE_MAP_SETTINGS:
+                    if node_json.get(attribute) is not None: # None for new addresses
+                        setattr(node, attribute, node_json[attribute])
+                self.nodes.append(node)
+        except (IOError, ValueError, KeyError, TypeError) as err:
+            print 'Node map not loaded: {0}'.format(err)
+            self.nodes = []
+            return False
+        # Global tuning from the first node with saved settings, a new address has none
+        for attribute in ['calibration_threshold', 'calibration_offset', 'trigger_threshold',
+            'filter_ratio']:
+            values = [getattr(node, attribute) for node in self.nodes \
+                if getattr(node, attribute) is not None]
+            if values:
+                setattr(self, attribute, values[0])
+        print 'Nodes loaded from {0}: {1}'.format(self.node_map_path,
+            [node.i2c_addr for node in self.nodes])
+        return True
+
+    def save_node_map(self):
+        '''Saves the nodes and their settings, new addresses are added for the next start.'''
+        if self.node_map_path is None:
+            return
+        nodes = []
+        for node in self.nodes:
+            node_json = {'addr': node.i2c_addr, 'index': node.index}
+            for attribute in NODE_MAP_SETTINGS:
+                node_json[attribute] = getattr(node, attribute)
+            nodes.append(node_json)
+        for addr in self.new_addrs:
+            nodes.append({'addr': addr, 'index': I2C_ADDRS.index(addr)})
+        nodes.sort(key=lambda node_json: node_json['index'])
+        temp_path = self.node_map_path + '.tmp'
+        try:
+            with open(temp_path, 'w') as node_map_file:
+                json.dump({'nodes': nodes}, node_map_file)
+            os.rename(temp_path, self.node_map_path) # Never leaves a partly written map
+        except (IOError, OSError) as err:
+            self.log('Node map not saved: {0}'.format(err))
 
 
     #
@@ -127,13 +355,27 @@ class Delta5Interface(BaseHardwareInterface):
 
     def update_loop(self):
         while True:
+            cycle_start = self.milliseconds()
             self.update()
-            gevent.sleep(UPDATE_SLEEP)
+            duration = self.milliseconds() - cycle_start
+            self.poll_stats.add(duration)
+            self.metrics.observe('delta5_poll_cycle_ms', duration)
+            # Sleep for what is left of the period, always yield to other greenlets
+            gevent.sleep(max(0, UPDATE_PERIOD - duration / 1000.0))
 
     def update(self):
         for node in self.nodes:
+            if not node.online:
+                continue # Left to the rescans instead of retrying every cycle
             data = self.read_block(node.i2c_addr, READ_LAP_STATS, 17)
-            if data != None:
+            if data is None:
+                node.read_failures = node.read_failures + 1
+                if node.read_failures >= NODE_OFFLINE_FAILURES:
+                    node.online = False
+                    self.log('Node {0} at address {1} lost'.format(node.index,
+                        node.i2c_addr))
+            else:
+                node.read_failures = 0
                 lap_id = data[0]
                 ms_since_lap = unpack_32(data[1:])
                 node.current_rssi = unpack_16(data[5:])
@@ -141,21 +383,40 @@ class Delta5Interface(BaseHardwareInterface):
                 node.peak_rssi_raw = unpack_16(data[9:])
                 node.peak_rssi = unpack_16(data[11:])
                 node.loop_time = unpack_32(data[13:])
+                # Pass time from the instant this block was read, not when it is processed
+                pacing = self.get_pacing(node.i2c_addr)
+                node.history.add((pacing.read_start + pacing.read_end) / 2, node.current_rssi)
+                node.pass_timestamp = node.clock.add_sample(lap_id,
+                    pacing.read_start, pacing.read_end, ms_since_lap)
 
                 if lap_id != node.last_lap_id:
                     if node.last_lap_id != -1 and callable(self.pass_record_callback):
+                        trace = self.start_pass_trace(node, lap_id)
+                        trace.add_span('i2c_read', pacing.read_start, pacing.read_end)
                         self.pass_record_callback(node, ms_since_lap)
+                        trace.add_span('pass_record_callback', trace.start,
+                            self.milliseconds())
+                        self.metrics.count('delta5_passes_total', node=node.index)
+                        self.metrics.observe('delta5_pass_to_emit_ms',
+                            self.milliseconds() - pacing.read_end, source='node')
                     node.last_lap_id = lap_id
 
     #
     # I2C Common Functions
     #
 
-    def i2c_sleep(self):
-        if self.i2c_timestamp == -1:
+    def get_pacing(self, addr):
+        pacing = self.i2c_pacing.get(addr)
+        if pacing is None:
+            pacing = self.i2c_pacing[addr] = I2CPacing()
+        return pacing
+
+    def i2c_sleep(self, pacing):
+        '''Waits until the node at this address is ready for another transaction.'''
+        if pacing.timestamp == -1:
             return
-        time_passed = self.milliseconds() - self.i2c_timestamp
-        time_remaining = (I2C_CHILL_TIME * 1000) - time_passed
+        time_passed = self.milliseconds() - pacing.timestamp
+        time_remaining = pacing.chill_time() - time_passed
         if (time_remaining > 0):
             # print("i2c sleep {0}".format(time_remaining))
             gevent.sleep(time_remaining / 1000.0)
@@ -165,22 +426,34 @@ class Delta5Interface(BaseHardwareInterface):
         success = False
         retry_count = 0
         data = None
+        pacing = self.get_pacing(addr)
         while success is False and retry_count < I2C_RETRY_COUNT:
+            # Waiting on the node is done outside the semaphore so other nodes can be read
+            self.i2c_sleep(pacing)
             try:
                 with self.semaphore: # Wait if i2c comms is already in progress
-                    self.i2c_sleep()
+                    start_time = self.milliseconds()
                     data = self.i2c.read_i2c_block_data(addr, offset, size + 1)
-                    self.i2c_timestamp = self.milliseconds()
+                    end_time = self.milliseconds()
+                    self.metrics.observe('delta5_i2c_transaction_ms', end_time - start_time,
+                        addr=addr, operation='read')
                     if validate_checksum(data):
                         success = True
                         data = data[:-1]
+                        pacing.success(end_time, end_time - start_time)
                     else:
                         # self.log('Invalid Checksum ({0}): {1}'.format(retry_count, data))
+                        self.metrics.count('delta5_i2c_retries_total', addr=addr,
+                            reason='checksum')
+                        pacing.failure(end_time)
                         retry_count = retry_count + 1
             except IOError as err:
                 self.log(err)
-                self.i2c_timestamp = self.milliseconds()
+                self.metrics.count('delta5_i2c_retries_total', addr=addr, reason='io_error')
+                pacing.failure(self.milliseconds())
                 retry_count = retry_count + 1
+        if not success:
+            self.metrics.count('delta5_i2c_failures_total', addr=addr, operation='read')
         return data
 
     def write_block(self, addr, offset, data):
@@ -190,19 +463,34 @@ class Delta5Interface(BaseHardwareInterface):
         data_with_checksum = data
         data_with_checksum.append(offset)
         data_with_checksum.append(sum(data_with_checksum) & 0xFF)
+        pacing = self.get_pacing(addr)
         while success is False and retry_count < I2C_RETRY_COUNT:
+            self.i2c_sleep(pacing)
             try:
                 with self.semaphore: # Wait if i2c comms is already in progress
-                    self.i2c_sleep()
+                    start_time = self.milliseconds()
                     self.i2c.write_i2c_block_data(addr, offset, data_with_checksum)
-                    self.i2c_timestamp = self.milliseconds()
+                    end_time = self.milliseconds()
+                    self.metrics.observe('delta5_i2c_transaction_ms', end_time - start_time,
+                        addr=addr, operation='write')
+                    pacing.success(end_time, end_time - start_time)
                     success = True
             except IOError as err:
                 self.log(err)
-                self.i2c_timestamp = self.milliseconds()
+                self.metrics.count('delta5_i2c_retries_total', addr=addr, reason='io_error')
+                pacing.failure(self.milliseconds())
                 retry_count = retry_count + 1
+        if not success:
+            self.metrics.count('delta5_i2c_failures_total', addr=addr, operation='write')
         return success
 
+    def get_poll_stats_json(self):
+        '''Returns poll cycle durations and the current delay for each node.'''
+        stats = self.poll_stats.get_json()
+        stats['chill_time'] = [self.get_pacing(node.i2c_addr).chill_time() \
+            for node in self.nodes]
+        return stats
+
     #
     # Internal helper fucntions for setting single values
     #
@@ -255,78 +543,97 @@ class Delta5Interface(BaseHardwareInterface):
             out_value = in_value
         return out_value
 
+    #
+    # Node settings, pushed to all nodes at once
+    #
+
+    def push_config(self, node_values, force=False):
+        '''Sets node registers, node_values is a list of (node, {attribute: value}).
+
+        The node attributes are a shadow copy of the registers and values that
+        already match are skipped unless forced. Each node is pushed on its own
+        greenlet so transactions to different addresses interleave while each
+        node waits out its pacing delay. A node gets all its writes and then one
+        readback pass, only mismatched values are written again.'''
+        with self.config_lock:
+            pushes = [gevent.spawn(self.push_node_config, node, values, force) \
+                for node, values in node_values]
+            gevent.joinall(pushes)
+        self.save_node_map()
+
+    def push_node_config(self, node, values, force=False):
+        pending = dict((attribute, value) for attribute, value in values.items() \
+            if force or getattr(node, attribute) != value)
+        retry_count = 0
+        while pending and retry_count < I2C_RETRY_COUNT:
+            for attribute, value in pending.items():
+                write_command, read_command, size = CONFIG_REGISTERS[attribute]
+                self.write_block(node.i2c_addr, write_command,
+                    pack_8(value) if size == 1 else pack_16(value))
+            for attribute, value in list(pending.items()):
+                write_command, read_command, size = CONFIG_REGISTERS[attribute]
+                if size == 1:
+                    out_value = self.get_value_8(node, read_command)
+                else:
+                    out_value = self.get_value_16(node, read_command)
+                if out_value is not None:
+                    setattr(node, attribute, out_value) # Shadow follows the node
+                if out_value == value:
+                    del pending[attribute]
+            if pending:
+                retry_count = retry_count + 1
+                self.log('Value Not Set ({0}): Node {1} {2}'.format(retry_count,
+                    node.index, ', '.join(sorted(pending))))
+        for attribute, value in pending.items():
+            setattr(node, attribute, value) # Kept as requested, as the node is meant to be
+
+    def set_config_global(self, values):
+        '''Sets the same node settings on every node, {attribute: value}.'''
+        for attribute, value in values.items():
+            if attribute != 'frequency':
+                setattr(self, attribute, value)
+        self.push_config([(node, values) for node in self.nodes])
+
     #
     # External functions for setting data
     #
 
     def set_frequency(self, node_index, frequency):
-        node = self.nodes[node_index]
-        node.frequency = self.set_and_validate_value_16(node,
-            WRITE_FREQUENCY,
-            READ_FREQUENCY,
-            frequency)
+        self.push_config([(self.nodes[node_index], {'frequency': frequency})])
 
     def set_calibration_threshold(self, node_index, threshold):
-        node = self.nodes[node_index]
-        node.calibration_threshold = self.set_and_validate_value_16(node,
-            WRITE_CALIBRATION_THRESHOLD,
-            READ_CALIBRATION_THRESHOLD,
-            threshold)
+        self.push_config([(self.nodes[node_index], {'calibration_threshold': threshold})])
 
     def set_calibration_threshold_global(self, threshold):
-        self.calibration_threshold = threshold
-        for node in self.nodes:
-            self.set_calibration_threshold(node.index, threshold)
+        self.set_config_global({'calibration_threshold': threshold})
         return self.calibration_threshold
 
     def set_calibration_mode(self, node_index, calibration_mode):
-        node = self.nodes[node_index]
-        self.set_and_validate_value_8(node,
-            WRITE_CALIBRATION_MODE,
-            READ_CALIBRATION_MODE,
-            calibration_mode)
+        self.push_config([(self.nodes[node_index], {'calibration_mode': int(calibration_mode)})],
+            force=True) # A write restarts calibration even if the mode is already set
 
     def enable_calibration_mode(self):
-        for node in self.nodes:
-            self.set_calibration_mode(node.index, True);
+        self.push_config([(node, {'calibration_mode': 1}) for node in self.nodes], force=True)
 
     def set_calibration_offset(self, node_index, offset):
-        node = self.nodes[node_index]
-        node.calibration_offset = self.set_and_validate_value_16(node,
-            WRITE_CALIBRATION_OFFSET,
-            READ_CALIBRATION_OFFSET,
-            offset)
+        self.push_config([(self.nodes[node_index], {'calibration_offset': offset})])
 
     def set_calibration_offset_global(self, offset):
-        self.calibration_offset = offset
-        for node in self.nodes:
-            self.set_calibration_offset(node.index, offset)
+        self.set_config_global({'calibration_offset': offset})
         return self.calibration_offset
 
     def set_trigger_threshold(self, node_index, threshold):
-        node = self.nodes[node_index]
-        node.trigger_threshold = self.set_and_validate_value_16(node,
-            WRITE_TRIGGER_THRESHOLD,
-            READ_TRIGGER_THRESHOLD,
-            threshold)
+        self.push_config([(self.nodes[node_index], {'trigger_threshold': threshold})])
 
     def set_trigger_threshold_global(self, threshold):
-        self.trigger_threshold = threshold
-        for node in self.nodes:
-            self.set_trigger_threshold(node.index, threshold)
+        self.set_config_global({'trigger_threshold': threshold})
         return self.trigger_threshold
 
-    def set_filter_ratio(self, node_index, filter_ration):
-        node = self.nodes[node_index]
-        node.filter_ration = self.set_and_validate_value_8(node,
-            WRITE_FILTER_RATIO,
-            READ_FILTER_RATIO,
-            filter_ration)
+    def set_filter_ratio(self, node_index, filter_ratio):
+        self.push_config([(self.nodes[node_index], {'filter_ratio': filter_ratio})])
 
     def set_filter_ratio_global(self, filter_ratio):
-        self.filter_ratio = filter_ratio
-        for node in self.nodes:
-            self.set_filter_ratio(node.index, filter_ratio)
+        self.set_config_global({'filter_ratio': filter_ratio})
         return self.filter_ratio
 
     def intf_simulate_lap(self, node_index):
@@ -336,8 +643,10 @@ class Delta5Interface(BaseHardwareInterface):
         node.peak_rssi_raw = 33
         node.peak_rssi = 44
         node.loop_time = 55
+        node.pass_timestamp = self.milliseconds() - 100
+        self.start_pass_trace(node, None, 'simulated')
         self.pass_record_callback(node, 100)
 
-def get_hardware_interface():
-    '''Returns the delta 5 interface object.'''
-    return Delta5Interface()
+def get_hardware_interface(i2c=None, node_map_path=NODE_MAP_FILE):
+    '''Returns the delta 5 interface object, on the pi i2c bus unless another bus is given.'''
+    return Delta5Interface(i2c, node_map_path)
@@ -0,0 +1,178 @@
+'''LED strip effects rendered on their own greenlet.
+
+Effects are compiled once into a list of frames, each an array of pixel
+colors with the milliseconds to wait before the next frame. Compiled
+effects are cached by effect, arguments and pixel count, and compiled on
+the gevent thread pool so a large effect doesn't hold the event loop on its
+first play. Long effects can be compiled ahead with precompile(). The renderer plays
+them one at a time so socket handlers and the pass callback only queue an
+effect and return straight away.'''
+
+import time
+from array import array
+from collections import OrderedDict
+
+import gevent
+from gevent.event import Event
+from neopixel import Color
+
+LED_MAX_PENDING = 2 # Effects waiting to play, the oldest are dropped first
+LED_CACHE_FRAMES = 4096 # Compiled frames kept, least recently used effects are evicted
+
+def blank_frame(num_pixels):
+    return array('I', [0]) * num_pixels
+
+def show_frame(strip, frame):
+    '''Copies a whole frame to the strip and shows it.'''
+    for i, color in enumerate(frame):
+        strip.setPixelColor(i, color)
+    strip.show()
+
+#
+# Effects, each returns a list of (frame, wait_ms), a frame of None only waits
+#
+
+def onoff(num_pixels, color, delay_ms=0):
+    '''LED one color ON/OFF, after an optional delay.'''
+    frames = []
+    if delay_ms > 0:
+        frames.append((None, delay_ms))
+    frames.append((array('I', [color]) * num_pixels, 0))
+    return frames
+
+def theaterChase(num_pixels, color, wait_ms=50, iterations=5):
+    """Movie theater light style chaser animation."""
+    frames = []
+    for q in range(3):
+        frame = blank_frame(num_pixels)
+        for i in range(q, num_pixels, 3):
+            frame[i] = color
+        frames.append((frame, wait_ms))
+    return frames * iterations # Frames are shared between iterations, not copied
+
+def wheel(pos):
+    """Generate rainbow colors across 0-255 positions."""
+    if pos < 85:
+        return Color(pos * 3, 255 - pos * 3, 0)
+    elif pos < 170:
+        pos -= 85
+        return Color(255 - pos * 3, 0, pos * 3)
+    else:
+        pos -= 170
+        return Color(0, pos * 3, 255 - pos * 3)
+
+WHEEL = [wheel(pos) for pos in range(256)]
+
+def rainbow(num_pixels, wait_ms=2, iterations=1):
+    """Draw rainbow that fades across all pixels at once."""
+    frames = []
+    for j in range(256):
+        frames.append((array('I', [WHEEL[(i+j) & 255] for i in range(num_pixels)]), wait_ms))
+    return frames * iterations
+
+def rainbowCycle(num_pixels, wait_ms=2, iterations=1):
+    """Draw rainbow that uniformly distributes itself across all pixels."""
+    positions = [int(i * 256 / num_pixels) for i in range(num_pixels)]
+    frames = []
+    for j in range(256):
+        frames.append((array('I', [WHEEL[(pos + j) & 255] for pos in positions]), wait_ms))
+    return frames * iterations
+
+def theaterChaseRainbow(num_pixels, wait_ms=25):
+    """Rainbow movie theater light style chaser animation."""
+    frames = []
+    for j in range(256):
+        for q in range(3):
+            frame = blank_frame(num_pixels)
+            for i in range(0, num_pixels - q, 3):
+                frame[i+q] = WHEEL[(i+j) % 255]
+            frames.append((frame, wait_ms))
+    return frames
+
+class FrameCache():
+    '''Compiled effects by (effect, arguments, pixel count), least recently used are evicted.'''
+    def __init__(self, max_frames=LED_CACHE_FRAMES):
+        self.max_frames = max_frames
+        self.effects = OrderedDict() # Least recently used first
+        self.frame_count = 0
+
+    def get(self, effect, args, num_pixels):
+        key = (effect.__name__, args, num_pixels)
+        frames = self.effects.pop(key, None)
+        if frames is None:
+            frames = gevent.get_hub().threadpool.apply(effect, (num_pixels,) + tuple(args))
+            compiled = self.effects.pop(key, None) # Compiled meanwhile by another greenlet
+            if compiled is not None:
+                frames = compiled
+            else:
+                self.frame_count = self.frame_count + len(frames)
+        self.effects[key] = frames
+        while self.frame_count > self.max_frames and len(self.effects) > 1:
+            evicted_key, evicted = self.effects.popitem(last=False)
+            self.frame_count = self.frame_count - len(evicted)
+        return frames
+
+#
+# Renderer
+#
+
+class LEDRenderer():
+    '''Plays queued LED effects frame by frame on a background greenlet.'''
+    def __init__(self, strip):
+        self.strip = strip
+        self.render_thread = None
+        self.pending = [] # (key, effect, args) waiting to play
+        self.pending_event = Event() # Set while effects are pending
+        self.preempted = False # Stops the playing effect at its next frame
+        self.cache = FrameCache()
+
+    def start(self):
+        if self.render_thread is None:
+            self.render_thread = gevent.spawn(self.render_loop)
+
+    def play(self, effect, args=(), key=None, preempt=True):
+        '''Queues an effect. A pending effect with the same key is replaced,
+        and by default the playing effect is cut short for the new one.'''
+        if key is not None:
+            self.pending = [item for item in self.pending if item[0] != key]
+        self.pending.append((key, effect, args))
+        if len(self.pending) > LED_MAX_PENDING:
+            del self.pending[0]
+        if preempt:
+            self.preempted = True
+        self.pending_event.set()
+        self.start()
+
+    def precompile(self, effects):
+        '''Compiles [(effect, args)] into the cache in the background, for effects
+        long enough that their first play would start late.'''
+        def compile_effects():
+            for effect, args in effects:
+                self.cache.get(effect, args, self.strip.numPixels())
+        gevent.spawn(compile_effects)
+
+    def render_loop(self):
+        while True:
+            self.pending_event.wait()
+            key, effect, args = self.pending.pop(0)
+            if not self.pending:
+                self.pending_event.clear()
+            self.preempted = False
+            try:
+                self.render(self.cache.get(effect, args, self.strip.numPixels()))
+            except Exception as err: # A failed effect or strip write must not stop the LEDs
+                self.log('{0} failed: {1}'.format(effect.__name__, err))
+
+    def log(self, message):
+        print('LEDRenderer: {0}'.format(message))
+
+    def render(self, frames):
+        '''Shows frames on their schedule, frame drawing time counts toward the wait.'''
+        next_frame = time.time()
+        for frame, wait_ms in frames:
+            if self.preempted:
+                return
+            if frame is not None:
+                show_frame(self.strip, frame)
+            next_frame = next_frame + wait_ms / 1000.0
+            gevent.sleep(max(0, next_frame - time.time()))
@@ -0,0 +1,121 @@
+'''Counters, gauges and latency histograms, as text for scrapers and json for the pages.'''
+
+import bisect
+
+LATENCY_BUCKETS = [0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000] # Milliseconds
+
+def format_labels(labels, extra=None):
+    '''Returns the {name="value",...} part of a series in the prometheus text format.'''
+    items = list(labels) if extra is None else list(labels) + [extra]
+    if not items:
+        return ''
+    return '{' + ','.join('{0}="{1}"'.format(name, value) for name, value in items) + '}'
+
+class Histogram():
+    '''Observations counted in fixed buckets, memory stays the same however many there are.'''
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1) # The last counts values above every bound
+        self.count = 0
+        self.sum = 0.0
+        self.maximum = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count = self.count + 1
+        self.sum = self.sum + value
+        self.maximum = max(self.maximum, value)
+
+    def quantile(self, percent):
+        '''Returns the bucket bound under which the given percent of values fall, no more
+        than the largest value seen.'''
+        rank = self.count * percent / 100.0
+        total = 0
+        for index, count in enumerate(self.counts):
+            total = total + count
+            if total >= rank and count:
+                return min(self.buckets[index], self.maximum) \
+                    if index < len(self.buckets) else self.maximum
+        return 0
+
+    def get_json(self):
+        return {
+            'count': self.count,
+            'mean': self.sum / self.count if self.count else 0,
+            'p50': self.quantile(50),
+            'p90': self.quantile(90),
+            'p99': self.quantile(99),
+            'max': self.maximum
+        }
+
+class Delta5Metrics():
+    '''Named metrics, each with a series for every set of label values used.
+
+    Metrics are defined once with their type and help text, then updated
+    by name with labels as keyword arguments.'''
+    def __init__(self):
+        self.metrics = {} # Name to (type, help, series by label items)
+        self.order = [] # Names in definition order
+
+    def define(self, name, metric_type, help_text):
+        if name not in self.metrics:
+            self.metrics[name] = (metric_type, help_text, {})
+            self.order.append(name)
+
+    def series(self, name, labels):
+        return self.metrics[name][2], tuple(sorted(labels.items()))
+
+    def count(self, name, amount=1, **labels):
+        series, key = self.series(name, labels)
+        series[key] = series.get(key, 0) + amount
+
+    def set_gauge(self, name, value, **labels):
+        series, key = self.series(name, labels)
+        series[key] = value
+
+    def observe(self, name, value, **labels):
+        series, key = self.series(name, labels)
+        histogram = series.get(key)
+        if histogram is None:
+            histogram = series[key] = Histogram()
+        histogram.observe(value)
+
+    def get_text(self):
+        '''Returns every series in the prometheus text exposition format.'''
+        lines = []
+        for name in self.order:
+            metric_type, help_text, series = self.metrics[name]
+            lines.append('# HELP {0} {1}'.format(name, help_text))
+            lines.append('# TYPE {0} {1}'.format(name, metric_type))
+            for labels in sorted(series):
+                value = series[labels]
+                if metric_type != 'histogram':
+                    lines.append('{0}{1} {2}'.format(name, format_labels(labels), value))
+                    continue
+                cumulative = 0
+                for bound, count in zip(value.buckets + ['+Inf'], value.counts):
+                    cumulative = cumulative + count
+                    lines.append('{0}_bucket{1} {2}'.format(name,
+                        format_labels(labels, ('le', bound)), cumulative))
+                lines.append('{0}_sum{1} {2}'.format(name, format_labels(labels), value.sum))
+                lines.append('{0}_count{1} {2}'.format(name, format_labels(labels),
+                    value.count))
+        return '\n'.join(lines) + '\n'
+
+    def get_json(self):
+        '''Returns [{name, labels, value or histogram summary}] for the settings page.'''
+        rows = []
+        for name in self.order:
+            metric_type, help_text, series = self.metrics[name]
+            for labels in sorted(series):
+                value = series[labels]
+                rows.append({
+                    'name': name,
+                    'labels': ' '.join('{0}={1}'.format(key, item) for key, item in labels),
+                    'value': value.get_json() if metric_type == 'histogram' else value
+                })
+        return {'metrics': rows}
+
+def get_metrics():
+    '''Returns the delta 5 metrics object.'''
+    return Delta5Metrics()
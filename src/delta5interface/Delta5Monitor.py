@@ -0,0 +1,175 @@
+'''Event loop block detector and sampling profiler of the gevent hub.
+
+Every greenlet runs on the main thread, so one of them holding it stalls
+the node polling and every client. A ticker greenlet marks each turn of
+the loop; a real thread, not patched by gevent, watches the mark and
+takes the main thread stack when the mark is late, which is the code
+holding the loop. The ticker logs the block with its length when the loop
+comes back, emits are never made from the watching thread.
+
+The profiler samples the main thread stack from the same thread while it
+is running. Each sample counts against the outermost frame of the server
+or interface code, the handler or loop the greenlet was started with, and
+the innermost one, the function the time went in. Samples with none of
+our code on the stack are the hub waiting for work.'''
+
+import atexit
+import os
+import sys
+import time
+import traceback
+from collections import deque
+
+import gevent
+from gevent.monkey import get_original
+
+from Delta5Clock import monotonic
+
+start_new_thread, get_ident = get_original('thread', ['start_new_thread', 'get_ident'])
+thread_sleep = get_original('time', 'sleep')
+
+BLOCK_THRESHOLD = 0.1 # Seconds the loop may be held before it is logged, two poll periods
+TICK_INTERVAL = 0.02 # Seconds between loop marks
+CHECK_INTERVAL = 0.02 # Seconds between checks of the mark
+PROFILE_INTERVAL = 0.005 # Seconds between profiler samples
+BLOCK_STORE_SIZE = 50 # Recent blocks kept
+STACK_LIMIT = 20 # Innermost frames kept of each block stack
+REPORT_ROWS = 10 # Handlers and functions in the profile report
+
+class Delta5Monitor():
+    '''Watches the gevent hub from a thread of its own.'''
+    def __init__(self, metrics=None, code_paths=None, threshold=BLOCK_THRESHOLD):
+        self.metrics = metrics
+        self.threshold = threshold
+        self.log_callback = None
+        # Frames from files under these directories are our code, the rest are libraries
+        self.code_paths = code_paths or [
+            os.path.dirname(os.path.abspath(sys.argv[0])),
+            os.path.dirname(os.path.abspath(__file__))
+        ]
+        self.hub_thread = get_ident() # Created on the main thread, where the hub runs
+        self.started = False
+        self.stopped = False
+        self.tick = monotonic()
+        self.blocked_tick = None # Mark the current block was found at
+        self.blocked_stack = None
+        self.blocks = deque(maxlen=BLOCK_STORE_SIZE)
+        self.profiling = False
+        self.profile_start = 0
+        self.samples = 0
+        self.handlers = {}
+        self.functions = {}
+        self.code_files = {} # File name to whether it is our code
+        if metrics is not None:
+            metrics.define('delta5_loop_block_ms', 'histogram',
+                'Milliseconds the event loop was held past the block threshold')
+
+    def start(self):
+        if not self.started:
+            self.started = True
+            atexit.register(self.stop)
+            self.tick = monotonic()
+            gevent.spawn(self.tick_loop)
+            start_new_thread(self.watch_loop, ())
+
+    def tick_loop(self):
+        while True:
+            self.tick = monotonic()
+            gevent.sleep(TICK_INTERVAL)
+            if self.blocked_tick == self.tick and self.blocked_stack is not None:
+                self.record_block(monotonic() - self.tick - TICK_INTERVAL)
+
+    def watch_loop(self):
+        '''Runs on the real thread, reads the hub state only.'''
+        while not self.stopped:
+            thread_sleep(PROFILE_INTERVAL if self.profiling else CHECK_INTERVAL)
+            self.check()
+
+    def stop(self):
+        # Before exit clears the module globals the thread uses
+        self.stopped = True
+        thread_sleep(CHECK_INTERVAL * 2)
+
+    def check(self):
+        frame = sys._current_frames().get(self.hub_thread)
+        if frame is None:
+            return
+        if self.profiling:
+            self.sample(frame)
+        tick = self.tick
+        if monotonic() - tick > self.threshold and self.blocked_tick != tick:
+            self.blocked_stack = traceback.format_stack(frame, STACK_LIMIT)
+            self.blocked_tick = tick
+
+    def record_block(self, duration):
+        '''Logs a block once the loop is running again.'''
+        block = {
+            'time': time.time(),
+            'duration': duration * 1000,
+            'stack': self.blocked_stack
+        }
+        self.blocked_stack = None
+        self.blocks.append(block)
+        if self.metrics is not None:
+            self.metrics.observe('delta5_loop_block_ms', block['duration'])
+        if callable(self.log_callback):
+            self.log_callback('Event loop blocked {0:.0f} ms in:\n{1}'.format(
+                block['duration'], ''.join(block['stack'][-4:]).rstrip()))
+
+    def is_code_file(self, filename):
+        code = self.code_files.get(filename)
+        if code is None:
+            path = os.path.abspath(filename)
+            code = self.code_files[filename] = any(path.startswith(code_path + os.sep) \
+                for code_path in self.code_paths) and not path.endswith('Delta5Monitor.py')
+        return code
+
+    def sample(self, frame):
+        handler = function = None
+        while frame is not None:
+            code = frame.f_code
+            if self.is_code_file(code.co_filename):
+                name = '{0}:{1}'.format(os.path.basename(code.co_filename), code.co_name)
+                function = function or name
+                handler = name # Outermost so far
+            frame = frame.f_back
+        handler = handler or 'idle'
+        self.samples = self.samples + 1
+        self.handlers[handler] = self.handlers.get(handler, 0) + 1
+        if function is not None:
+            self.functions[function] = self.functions.get(function, 0) + 1
+
+    def start_profiler(self):
+        self.samples = 0
+        self.handlers = {}
+        self.functions = {}
+        self.profile_start = monotonic()
+        self.profiling = True
+        self.start()
+
+    def stop_profiler(self):
+        '''Stops sampling and returns the report lines.'''
+        self.profiling = False
+        return self.get_profile_report()
+
+    def get_profile_report(self):
+        duration = monotonic() - self.profile_start
+        samples = float(max(self.samples, 1))
+        lines = ['Profile of {0} samples over {1:.1f} s, hub idle {2:.1f}%'.format(
+            self.samples, duration, self.handlers.get('idle', 0) * 100 / samples)]
+        for title, counts in [('handler', self.handlers), ('function', self.functions)]:
+            rows = sorted((count, name) for name, count in counts.items() if name != 'idle')
+            for count, name in reversed(rows[-REPORT_ROWS:]):
+                lines.append('  {0} {1}: {2:.1f}%'.format(title, name, count * 100 / samples))
+        return lines
+
+    def get_json(self):
+        return {
+            'threshold': self.threshold * 1000,
+            'blocks': list(self.blocks),
+            'profiling': self.profiling
+        }
+
+def get_monitor(metrics=None, code_paths=None, threshold=BLOCK_THRESHOLD):
+    '''Returns the event loop monitor, started with start().'''
+    return Delta5Monitor(metrics, code_paths, threshold)
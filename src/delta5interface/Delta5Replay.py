@@ -0,0 +1,75 @@
+'''Replays recorded or synthetic passes through the interface pass record callback.'''
+
+import random
+
+import gevent
+
+from Delta5Clock import monotonic
+from Delta5Stats import percentile
+
+REPLAY_MAX_SPEED = 0 # Passes dispatched back to back without waiting
+REPLAY_READ_DELAY = 25 # ms since lap reported with each pass, half a poll period
+
+def get_synthetic_passes(num_nodes, laps=5, lap_time=20000, variance=300, spread=50,
+                         seed=None):
+    '''Returns a synthetic race as sorted (ms from race start, node index) passes.
+    spread is the largest gap between pilots at the first gate pass, a small spread and
+    variance keeps the pilots crossing together on every lap.'''
+    rand = random.Random(seed)
+    passes = []
+    for node_index in range(num_nodes):
+        pass_ms = 3000 + rand.uniform(0, spread) # Launch pad to the first gate pass
+        passes.append((int(pass_ms), node_index))
+        for lap in range(laps):
+            pass_ms = pass_ms + max(1000, rand.gauss(lap_time, variance))
+            passes.append((int(pass_ms), node_index))
+    passes.sort()
+    return passes
+
+class PassReplay():
+    '''Feeds passes to the pass record callback at a multiple of real time.
+
+    The node pass timestamps follow the recorded times whatever the speed,
+    so lap times come out as recorded. Pass to emit latency is measured
+    from the instant a pass is due to the callback returning, after the
+    server has emitted the lap, so it includes any time the hub was busy.'''
+    def __init__(self, interface, passes, speed=1.0):
+        self.interface = interface
+        self.passes = passes
+        self.speed = speed
+        self.latencies = [] # Seconds from each pass being due to its callback returning
+        self.lateness = [] # Seconds from each pass being due to its callback starting
+
+    def run(self):
+        nodes = self.interface.nodes
+        start = monotonic()
+        start_ms = self.interface.milliseconds()
+        for pass_ms, node_index in self.passes:
+            if node_index >= len(nodes):
+                continue
+            if self.speed == REPLAY_MAX_SPEED:
+                gevent.sleep(0) # Lets emits and the poll loop run between passes
+                due = monotonic()
+            else:
+                due = start + pass_ms / 1000.0 / self.speed
+                delay = due - monotonic()
+                if delay > 0:
+                    gevent.sleep(delay)
+            dispatch = monotonic()
+            node = nodes[node_index]
+            node.pass_timestamp = start_ms + pass_ms
+            if callable(self.interface.pass_record_callback):
+                self.interface.start_pass_trace(node, None, 'replay')
+                self.interface.pass_record_callback(node, REPLAY_READ_DELAY)
+            self.latencies.append(monotonic() - due)
+            self.interface.metrics.observe('delta5_pass_to_emit_ms',
+                self.latencies[-1] * 1000, source='replay')
+            self.lateness.append(dispatch - due)
+
+    def get_report(self):
+        speed = 'max speed' if self.speed == REPLAY_MAX_SPEED else '{0}x'.format(self.speed)
+        return 'Replay of {0} passes at {1}: pass to emit p50 {2:.2f} ms, p90 {3:.2f} ms, ' \
+            'p99 {4:.2f} ms, max {5:.2f} ms, late start p99 {6:.2f} ms'.format(
+            len(self.latencies), speed, percentile(self.latencies, 50) * 1000,
+            percentile(self.latencies, 90) * 1000, percentile(self.latencies, 99) * 1000,
+            max(self.latencies or [0]) * 1000, percentile(self.lateness, 99) * 1000)
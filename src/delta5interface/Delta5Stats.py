@@ -0,0 +1,20 @@
+'''Percentiles and the benchmark report line, without the interface or gevent imports.'''
+
+def percentile(values, percent):
+    '''Returns the given percentile of a list of values.'''
+    if not values:
+        return 0
+    values = sorted(values)
+    index = int(round((len(values) - 1) * percent / 100.0))
+    return values[index]
+
+def report(name, durations, transactions=None):
+    '''Prints duration percentiles in milliseconds and bus transactions per second.'''
+    line = '{0}: {1} runs, p50 {2:.2f} ms, p90 {3:.2f} ms, p99 {4:.2f} ms, max {5:.2f} ms' \
+        .format(name, len(durations), percentile(durations, 50) * 1000,
+        percentile(durations, 90) * 1000, percentile(durations, 99) * 1000,
+        max(durations) * 1000)
+    total = sum(durations)
+    if transactions is not None and total > 0:
+        line = line + ', {0:.0f} transactions/sec'.format(transactions / total)
+    print line
@@ -0,0 +1,74 @@
+'''Timestamped spans of each pass from the i2c read to the last client emit.'''
+
+from collections import deque
+
+from Delta5Stats import percentile
+
+TRACE_STORE_SIZE = 200 # Recent passes kept for download
+
+class PassTrace():
+    '''Spans of one pass, in interface milliseconds.
+
+    Spans are added with their start and end, or as checkpoints: a
+    checkpoint closes a span from the previous checkpoint, so a handler
+    marks the end of each stage without wrapping the code in blocks.'''
+    def __init__(self, trace_id, node_index, lap_id, clock, source='node'):
+        self.trace_id = trace_id
+        self.node_index = node_index
+        self.lap_id = lap_id
+        self.source = source
+        self.clock = clock # Function returning interface milliseconds
+        self.start = clock()
+        self.last_checkpoint = self.start
+        self.spans = []
+
+    def add_span(self, name, start, end):
+        self.spans.append((name, start, end))
+
+    def checkpoint(self, name):
+        now = self.clock()
+        self.spans.append((name, self.last_checkpoint, now))
+        self.last_checkpoint = now
+
+    def get_json(self):
+        start = min([self.start] + [span[1] for span in self.spans])
+        return {
+            'trace_id': self.trace_id,
+            'node': self.node_index,
+            'lap_id': self.lap_id,
+            'source': self.source,
+            'start': start,
+            'spans': [{
+                'name': name,
+                'start': span_start - start, # Milliseconds into the trace
+                'duration': span_end - span_start
+            } for name, span_start, span_end in self.spans]
+        }
+
+class TraceStore():
+    '''The most recent pass traces, older ones are dropped.'''
+    def __init__(self, size=TRACE_STORE_SIZE):
+        self.traces = deque(maxlen=size)
+        self.next_id = 0
+
+    def start_trace(self, node_index, lap_id, clock, source='node'):
+        trace = PassTrace(self.next_id, node_index, lap_id, clock, source)
+        self.next_id = self.next_id + 1
+        self.traces.append(trace)
+        return trace
+
+    def get_json(self):
+        '''Returns the traces and the duration percentiles of each span name.'''
+        traces = [trace.get_json() for trace in self.traces]
+        durations = {}
+        for trace in traces:
+            for span in trace['spans']:
+                durations.setdefault(span['name'], []).append(span['duration'])
+        summary = dict((name, {
+            'count': len(values),
+            'p50': percentile(values, 50),
+            'p90': percentile(values, 90),
+            'p99': percentile(values, 99),
+            'max': max(values)
+        }) for name, values in durations.items())
+        return {'summary': summary, 'traces': traces}
@@ -1,14 +1,38 @@
 '''Node class for the delta 5 interface.'''
 
-class Node:
+from Delta5Clock import NodeClock
+from RssiHistory import RssiHistory
+
+class Node(object):
     '''Node class represents the arduino/rx pair.'''
+    # Fixed attributes, no per instance dict, read on every poll and heartbeat
+    __slots__ = ['index', 'i2c_addr', 'frequency', 'current_rssi', 'trigger_rssi',
+        'peak_rssi', 'peak_rssi_raw', 'last_lap_id', 'loop_time', 'calibration_threshold',
+        'calibration_mode', 'calibration_offset', 'trigger_threshold', 'filter_ratio', 'clock',
+        'pass_timestamp', 'history', 'online', 'read_failures', 'trace']
+
     def __init__(self):
+        self.index = 0
+        self.i2c_addr = 0
         self.frequency = 0
         self.current_rssi = 0
         self.trigger_rssi = 0
         self.peak_rssi = 0
+        self.peak_rssi_raw = 0
         self.last_lap_id = -1
         self.loop_time = 10
+        # Shadow copies of the node settings, None until read or written
+        self.calibration_threshold = None
+        self.calibration_mode = None
+        self.calibration_offset = None
+        self.trigger_threshold = None
+        self.filter_ratio = None
+        self.clock = NodeClock() # Turns node lap stats into server time
+        self.pass_timestamp = 0 # Server milliseconds of the last pass
+        self.history = RssiHistory() # Rssi at every poll, for graphing pass shapes
+        self.online = True # False while the node doesn't answer, until a rescan finds it
+        self.read_failures = 0 # Consecutive failed polls
+        self.trace = None # Spans of the last pass, see Delta5Trace.py
 
     def get_settings_json(self):
         return {
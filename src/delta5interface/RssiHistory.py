@@ -0,0 +1,58 @@
+'''Fixed size rssi history for a node, kept in flat arrays.'''
+
+from array import array
+
+RSSI_HISTORY_SIZE = 36000 # Samples kept per node, 30 minutes at the 50 ms poll rate
+
+class RssiHistory():
+    '''Ring buffer of (timestamp, rssi) samples.
+
+    Samples are numbered from the start of the program. Readers keep the
+    number of the next sample they want, anything older than the buffer
+    has been overwritten and is skipped. Memory stays fixed however long
+    the event runs: 6 bytes a sample.'''
+    def __init__(self, size=RSSI_HISTORY_SIZE):
+        self.size = size
+        self.timestamps = array('I', [0]) * size # Interface milliseconds
+        self.rssi = array('H', [0]) * size
+        self.count = 0 # Samples ever added, the number of the next sample
+
+    def add(self, timestamp, rssi):
+        index = self.count % self.size
+        self.timestamps[index] = int(timestamp) & 0xFFFFFFFF
+        self.rssi[index] = rssi & 0xFFFF
+        self.count = self.count + 1
+
+    def oldest(self):
+        '''Returns the number of the oldest sample still held.'''
+        return max(0, self.count - self.size)
+
+    def get_samples(self, start, decimation=1):
+        '''Returns (timestamps, rssi) arrays of the samples from number start on.
+        Decimated samples keep the peak rssi of each group and its first timestamp,
+        a trailing partial group is left for the next read.'''
+        start = max(start, self.oldest())
+        end = start + (self.count - start) // decimation * decimation
+        timestamps = self.slice(self.timestamps, start, end)
+        rssi = self.slice(self.rssi, start, end)
+        if decimation > 1:
+            timestamps = timestamps[::decimation]
+            rssi = array('H', [max(rssi[i:i + decimation])
+                for i in range(0, len(rssi), decimation)])
+        return end, timestamps, rssi
+
+    def slice(self, values, start, end):
+        '''Copies the samples numbered start to end out of the ring.'''
+        first = start % self.size
+        last = first + end - start
+        if last <= self.size:
+            return values[first:last]
+        return values[first:] + values[:last - self.size]
+
+    def get_json(self, start, decimation=1):
+        end, timestamps, rssi = self.get_samples(start, decimation)
+        return {
+            'next': end,
+            'timestamps': timestamps.tolist(),
+            'rssi': rssi.tolist()
+        }
@@ -0,0 +1,208 @@
+'''Simulated i2c bus for running the delta 5 interface without a raspberry pi.
+
+Each simulated node answers the register map of delta5node.ino, including
+the checksums, so the real Delta5Interface polling and write/readback code
+can be measured. Bus latency, NACKs and checksum corruption are configurable.
+Nodes pass at a fixed interval, or follow the pilots of a SimulatedRace.'''
+
+import random
+import time
+
+from Delta5Clock import monotonic
+from Delta5Interface import READ_ADDRESS, READ_FREQUENCY, READ_LAP_STATS, \
+    READ_CALIBRATION_THRESHOLD, READ_CALIBRATION_MODE, READ_CALIBRATION_OFFSET, \
+    READ_TRIGGER_THRESHOLD, READ_FILTER_RATIO, WRITE_FREQUENCY, \
+    WRITE_CALIBRATION_THRESHOLD, WRITE_CALIBRATION_MODE, WRITE_CALIBRATION_OFFSET, \
+    WRITE_TRIGGER_THRESHOLD, WRITE_FILTER_RATIO
+
+EREMOTEIO = 121 # Error number raised by smbus when a slave does not acknowledge
+
+def write_8(buf, data):
+    buf.append(data & 0xFF)
+
+def write_16(buf, data):
+    buf.append((data >> 8) & 0xFF)
+    buf.append(data & 0xFF)
+
+def write_32(buf, data):
+    buf.append((data >> 24) & 0xFF)
+    buf.append((data >> 16) & 0xFF)
+    buf.append((data >> 8) & 0xFF)
+    buf.append(data & 0xFF)
+
+
+class SimulatedNode():
+    '''Register state of one node running the delta 5 firmware.'''
+    def __init__(self, addr, lap_interval=None, rand=None, pilot=None):
+        self.addr = addr
+        self.pilot = pilot # SimulatedRace pilot giving the rssi and passes
+        self.rand = rand if rand is not None else random.Random()
+        self.start_time = monotonic() # Same clock as the interface, NTP steps don't move it
+        # Settings, defaults from the firmware
+        self.frequency = 5800
+        self.calibration_threshold = 95
+        self.calibration_mode = 0
+        self.calibration_offset = 8
+        self.trigger_threshold = 40
+        self.filter_ratio = 10
+        # State
+        self.rssi = 50
+        self.rssi_trigger = 0
+        self.loop_time = 1000
+        self.lap = 0
+        self.pass_millis = 0
+        self.peak_rssi_raw = 0
+        self.peak_rssi = 0
+        # Pass generation, seconds between gate passes or None for no passes
+        self.lap_interval = lap_interval
+        self.next_pass = None
+        self.pass_times = {} # Time of each simulated pass by lap number
+        if lap_interval is not None:
+            self.next_pass = self.start_time + self.rand.uniform(0, lap_interval)
+
+    def millis(self, now):
+        return int((now - self.start_time) * 1000) & 0xFFFFFFFF
+
+    def update(self, now):
+        '''Advances the node to the given time, recording any gate passes.'''
+        if self.pilot is not None:
+            self.rssi = self.pilot.rssi
+            if self.pilot.lap != self.lap:
+                self.lap = self.pilot.lap
+                self.pass_millis = self.millis(self.pilot.pass_time)
+                self.peak_rssi_raw = self.pilot.peak_rssi
+                self.peak_rssi = self.pilot.peak_rssi
+                self.pass_times[self.lap] = self.pilot.pass_time
+            return
+        self.rssi = 50 + self.rand.randint(0, 5)
+        while self.next_pass is not None and now >= self.next_pass:
+            self.lap = (self.lap + 1) & 0xFF
+            self.pass_millis = self.millis(self.next_pass)
+            self.peak_rssi_raw = 200 + self.rand.randint(0, 20)
+            self.peak_rssi = self.peak_rssi_raw - 5
+            self.pass_times[self.lap] = self.next_pass
+            self.next_pass = self.next_pass + \
+                self.lap_interval * self.rand.uniform(0.9, 1.1)
+
+    def read(self, command, now):
+        '''Returns the bytes the firmware transmits for a read command.'''
+        buf = []
+        if command == READ_ADDRESS:
+            write_8(buf, self.addr)
+        elif command == READ_FREQUENCY:
+            write_16(buf, self.frequency)
+        elif command == READ_LAP_STATS:
+            write_8(buf, self.lap)
+            write_32(buf, self.millis(now) - self.pass_millis)
+            write_16(buf, self.rssi)
+            write_16(buf, self.rssi_trigger)
+            write_16(buf, self.peak_rssi_raw)
+            write_16(buf, self.peak_rssi)
+            write_32(buf, self.loop_time)
+        elif command == READ_CALIBRATION_THRESHOLD:
+            write_16(buf, self.calibration_threshold)
+        elif command == READ_CALIBRATION_MODE:
+            write_8(buf, self.calibration_mode)
+        elif command == READ_CALIBRATION_OFFSET:
+            write_16(buf, self.calibration_offset)
+        elif command == READ_TRIGGER_THRESHOLD:
+            write_16(buf, self.trigger_threshold)
+        elif command == READ_FILTER_RATIO:
+            write_8(buf, self.filter_ratio)
+        else: # Invalid command, the firmware writes nothing back
+            return buf
+        buf.append(sum(buf) & 0xFF)
+        return buf
+
+    def write(self, command, data):
+        '''Applies a write command, data is the payload, command and checksum.'''
+        sizes = {
+            WRITE_FREQUENCY: 2,
+            WRITE_CALIBRATION_THRESHOLD: 2,
+            WRITE_CALIBRATION_MODE: 1,
+            WRITE_CALIBRATION_OFFSET: 2,
+            WRITE_TRIGGER_THRESHOLD: 2,
+            WRITE_FILTER_RATIO: 1
+        }
+        size = sizes.get(command)
+        if size is None or len(data) != size + 2:
+            return False
+        if (sum(data[:-1]) & 0xFF) != data[-1] or data[-2] != command:
+            return False
+        value = data[0] if size == 1 else (data[0] << 8) | data[1]
+        if command == WRITE_FREQUENCY:
+            self.frequency = value
+            if self.pilot is not None:
+                self.pilot.frequency = value
+        elif command == WRITE_CALIBRATION_THRESHOLD:
+            self.calibration_threshold = value
+        elif command == WRITE_CALIBRATION_MODE:
+            self.calibration_mode = value
+            self.rssi_trigger = max(0, self.rssi - self.calibration_offset)
+            self.peak_rssi_raw = 0
+            self.peak_rssi = 0
+        elif command == WRITE_CALIBRATION_OFFSET:
+            self.calibration_offset = value
+        elif command == WRITE_TRIGGER_THRESHOLD:
+            self.trigger_threshold = value
+        elif command == WRITE_FILTER_RATIO:
+            self.filter_ratio = value
+        return True
+
+
+class SimulatedI2CBus():
+    '''Drop in replacement for smbus.SMBus talking to simulated nodes.
+
+    latency is the time each transaction holds the bus in seconds, nack_rate
+    and corruption_rate are the chances of a transaction raising an IOError
+    or returning a corrupted byte. With a race, node n follows pilot n.'''
+    def __init__(self, addrs=None, latency=0.001, nack_rate=0.0, corruption_rate=0.0,
+                 lap_interval=None, seed=None, race=None):
+        if addrs is None:
+            addrs = [8, 10, 12, 14, 16, 18, 20, 22]
+        self.rand = random.Random(seed)
+        self.latency = latency
+        self.nack_rate = nack_rate
+        self.corruption_rate = corruption_rate
+        self.race = race
+        self.nodes = {}
+        for index, addr in enumerate(addrs):
+            pilot = race.pilots[index] if race is not None else None
+            self.nodes[addr] = SimulatedNode(addr, lap_interval,
+                random.Random(self.rand.random()), pilot)
+        # Counters
+        self.transactions = 0
+        self.nacks = 0
+        self.corruptions = 0
+
+    def transaction(self, addr):
+        '''Holds the bus for the configured latency, returns the addressed node.'''
+        self.transactions = self.transactions + 1
+        if self.latency > 0:
+            time.sleep(self.latency) # Blocks like the real smbus calls
+        node = self.nodes.get(addr)
+        if node is None or self.rand.random() < self.nack_rate:
+            self.nacks = self.nacks + 1
+            raise IOError(EREMOTEIO, 'Remote I/O error')
+        if self.race is not None:
+            self.race.update(monotonic())
+        node.update(monotonic())
+        return node
+
+    def read_i2c_block_data(self, addr, cmd, length=32):
+        node = self.transaction(addr)
+        data = node.read(cmd, monotonic())
+        data = data[:length] + [0xFF] * (length - len(data)) # Unsent bytes read as 0xFF
+        if self.rand.random() < self.corruption_rate:
+            self.corruptions = self.corruptions + 1
+            index = self.rand.randint(0, length - 1)
+            data[index] = data[index] ^ (1 << self.rand.randint(0, 7))
+        return data
+
+    def write_i2c_block_data(self, addr, cmd, vals):
+        node = self.transaction(addr)
+        node.write(cmd, list(vals))
+
+    def get_pass_time(self, addr, lap):
+        '''Returns the monotonic time a simulated pass happened.'''
+        return self.nodes[addr].pass_times.get(lap)
@@ -0,0 +1,161 @@
+'''Simulated pilots flying laps through the gate, rssi and passes without any hardware.
+
+Each pilot flies laps that end at the gate. The rssi its node sees rises
+as the pilot closes on the gate and falls away after, peaking at the
+crossing. Lap times vary, pilots crash and either rejoin or are out, and
+nodes of the same timer see some of the signal of pilots on neighbouring
+frequencies, so pilots crossing together disturb each other like at a real
+gate. Nodes find passes like delta5node.ino: the rssi peak while above the
+trigger level is the pass, recorded once the rssi falls back by the
+trigger threshold.'''
+
+import random
+
+SIMULATION_STEP = 0.01 # Seconds between rssi samples
+RSSI_NOISE_FLOOR = 50 # Rssi with no pilot near the gate
+RSSI_NOISE = 2.0 # Standard deviation of the rssi noise
+RSSI_PEAK_MIN = 150 # Rssi above the floor at the gate, varies with each pilot's vtx
+RSSI_PEAK_MAX = 220
+TRIGGER_LEVEL = 60 # Rssi above the floor where a node starts looking for a pass
+TRIGGER_THRESHOLD = 40 # Rssi fall from the peak that ends a pass
+GATE_WIDTH = 0.3 # Seconds from the gate where the rssi is half its peak
+LAUNCH_TIME = 3000 # Milliseconds from the start to the first gate pass
+CHANNEL_LEAK = 0.5 # Share of another pilot's rssi seen on the same frequency
+CHANNEL_LEAK_WIDTH = 40 # MHz apart where the leak stops
+TIMER_NODES = 8 # Nodes in one timer, leaks stay inside a timer
+RACEBAND = [5658, 5695, 5732, 5769, 5806, 5843, 5880, 5917]
+
+SCENARIOS = { # Lap times and spreads in milliseconds, crash rate a chance per lap
+    'practice': {'lap_time': 25000, 'variance': 2500, 'spread': 5000, 'crash_rate': 0.02},
+    'race': {'lap_time': 20000, 'variance': 800, 'spread': 800, 'crash_rate': 0.05},
+    'close_finish': {'lap_time': 20000, 'variance': 20, 'spread': 30, 'crash_rate': 0.0},
+    'crashes': {'lap_time': 22000, 'variance': 1500, 'spread': 1000, 'crash_rate': 0.3}
+}
+
+class SimulatedPilot():
+    '''One pilot and the pass detection of their node.'''
+    def __init__(self, index, frequency, rand):
+        self.index = index
+        self.frequency = frequency
+        self.rand = rand
+        self.peak = rand.randint(RSSI_PEAK_MIN, RSSI_PEAK_MAX)
+        # Flight, seconds on the simulation clock
+        self.last_crossing = None
+        self.next_crossing = None
+        self.crash_start = None
+        self.crash_end = None
+        self.crossings = [] # Every true gate crossing
+        # Node
+        self.rssi = RSSI_NOISE_FLOOR
+        self.trigger_rssi = RSSI_NOISE_FLOOR + TRIGGER_LEVEL
+        self.lap = 0 # Passes found, wraps like the node lap id
+        self.pass_time = 0 # Time of the rssi peak of the last pass
+        self.peak_rssi = 0
+        self.crossing = False
+        self.armed = True # Set again once the rssi falls the trigger threshold under the trigger
+        self.crossing_peak = 0
+        self.crossing_peak_time = 0
+
+    def signal(self, now):
+        '''Rssi above the floor from this pilot's vtx at the gate.'''
+        if self.crash_start is not None and self.crash_start <= now and \
+            (self.crash_end is None or now < self.crash_end):
+            return self.peak * 0.02 # On the ground somewhere on the course
+        distance = None
+        for crossing in (self.last_crossing, self.next_crossing):
+            if crossing is not None and (distance is None or abs(now - crossing) < distance):
+                distance = abs(now - crossing)
+        if distance is None:
+            return 0.0
+        return self.peak / (1.0 + (distance / GATE_WIDTH) ** 2)
+
+    def detect(self, now, rssi, trigger_threshold):
+        '''Node pass detection on one rssi sample, returns True on a new pass.'''
+        self.rssi = int(rssi)
+        if not self.armed:
+            self.armed = rssi < self.trigger_rssi - trigger_threshold
+        elif not self.crossing:
+            if rssi >= self.trigger_rssi:
+                self.crossing = True
+                self.crossing_peak = rssi
+                self.crossing_peak_time = now
+        elif rssi > self.crossing_peak:
+            self.crossing_peak = rssi
+            self.crossing_peak_time = now
+        elif rssi < self.crossing_peak - trigger_threshold:
+            self.crossing = False
+            self.armed = False
+            self.lap = (self.lap + 1) & 0xFF
+            self.pass_time = self.crossing_peak_time
+            self.peak_rssi = int(self.crossing_peak)
+            return True
+        return False
+
+class SimulatedRace():
+    '''Pilots on every node flying a scenario, advanced to any time by update().'''
+    def __init__(self, num_nodes, scenario='race', seed=None, frequencies=None):
+        self.rand = random.Random(seed)
+        self.settings = SCENARIOS[scenario]
+        if frequencies is None:
+            frequencies = [RACEBAND[index % TIMER_NODES] for index in range(num_nodes)]
+        self.pilots = [SimulatedPilot(index, frequencies[index],
+            random.Random(self.rand.random())) for index in range(num_nodes)]
+        self.trigger_threshold = TRIGGER_THRESHOLD
+        self.time = None # Simulation clock, seconds
+
+    def start(self, now):
+        '''Puts the pilots on the pads and launches them towards the first gate pass.'''
+        self.time = now
+        for pilot in self.pilots:
+            pilot.last_crossing = None
+            pilot.crash_start = pilot.crash_end = None
+            pilot.crossings = []
+            pilot.next_crossing = now + (LAUNCH_TIME +
+                pilot.rand.uniform(0, self.settings['spread'])) / 1000.0
+
+    def plan_lap(self, pilot):
+        '''Sets the next gate crossing of a pilot who just crossed, with any crash.'''
+        lap_time = max(self.settings['lap_time'] / 2.0,
+            pilot.rand.gauss(self.settings['lap_time'], self.settings['variance'])) / 1000.0
+        pilot.crash_start = pilot.crash_end = None
+        if pilot.rand.random() < self.settings['crash_rate']:
+            pilot.crash_start = pilot.last_crossing + lap_time * pilot.rand.uniform(0.2, 0.8)
+            if pilot.rand.random() < 0.5:
+                pilot.next_crossing = None # Out of the race
+                return
+            pilot.crash_end = pilot.crash_start + pilot.rand.uniform(5, 15)
+            lap_time = lap_time + pilot.crash_end - pilot.crash_start
+        pilot.next_crossing = pilot.last_crossing + lap_time
+
+    def update(self, now):
+        '''Advances the race to the given time in simulation steps, returns the pilots
+        with new passes.'''
+        if self.time is None:
+            self.start(now)
+        passed = []
+        while self.time + SIMULATION_STEP <= now:
+            self.time = self.time + SIMULATION_STEP
+            signals = []
+            for pilot in self.pilots:
+                while pilot.next_crossing is not None and pilot.next_crossing <= self.time:
+                    pilot.last_crossing = pilot.next_crossing
+                    pilot.crossings.append(pilot.last_crossing)
+                    self.plan_lap(pilot)
+                signals.append(pilot.signal(self.time))
+            loud = [pilot for pilot, signal in zip(self.pilots, signals) if signal > 1.0]
+            for pilot, signal in zip(self.pilots, signals):
+                for other in loud:
+                    if other is not pilot and other.index // TIMER_NODES == \
+                        pilot.index // TIMER_NODES:
+                        apart = abs(other.frequency - pilot.frequency)
+                        if apart < CHANNEL_LEAK_WIDTH:
+                            signal = signal + signals[other.index] * CHANNEL_LEAK * \
+                                (1.0 - apart / float(CHANNEL_LEAK_WIDTH))
+                rssi = RSSI_NOISE_FLOOR + signal + pilot.rand.gauss(0, RSSI_NOISE)
+                if pilot.detect(self.time, max(0, rssi), self.trigger_threshold):
+                    passed.append(pilot)
+        return passed
+
+def get_simulated_race(num_nodes, scenario='race', seed=None):
+    '''Returns a simulated race, the same seed flies the same race.'''
+    return SimulatedRace(num_nodes, scenario, seed)
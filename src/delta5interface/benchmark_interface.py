@@ -0,0 +1,208 @@
+'''Throughput benchmark of the delta 5 interface against a simulated i2c bus.
+
+Run from this directory:
+    python benchmark_interface.py --latency 0.001 --nack-rate 0.01
+'''
+
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import gevent
+
+from Delta5Interface import Delta5Interface, WRITE_CALIBRATION_THRESHOLD, \
+    READ_CALIBRATION_THRESHOLD, WRITE_CALIBRATION_OFFSET, READ_CALIBRATION_OFFSET, \
+    WRITE_TRIGGER_THRESHOLD, READ_TRIGGER_THRESHOLD
+from Delta5Clock import monotonic
+from Delta5Replay import get_synthetic_passes, REPLAY_MAX_SPEED
+from Delta5Stats import report
+from SimulatedI2CBus import SimulatedI2CBus
+from SimulatedRace import get_simulated_race
+
+def benchmark_startup(args):
+    bus = SimulatedI2CBus(latency=args.latency, nack_rate=args.nack_rate,
+        corruption_rate=args.corruption_rate, seed=args.seed)
+    start = time.time()
+    interface = Delta5Interface(bus, None)
+    report('startup scan', [time.time() - start], bus.transactions)
+
+    # Second start from the node map the first one saved
+    node_map_path = os.path.join(tempfile.gettempdir(), 'benchmark_node_map.json')
+    interface.node_map_path = node_map_path
+    interface.save_node_map()
+    bus.transactions = 0
+    start = time.time()
+    mapped = Delta5Interface(bus, node_map_path)
+    report('startup from node map', [time.time() - start], bus.transactions)
+    mapped.discovery_thread.kill()
+    bus.transactions = 0
+    start = time.time()
+    mapped.verify_nodes() # Runs in the background on the server
+    report('node map check', [time.time() - start], bus.transactions)
+    bus.transactions = 0
+    start = time.time()
+    mapped.rescan_nodes()
+    report('hot plug rescan', [time.time() - start], bus.transactions)
+    os.remove(node_map_path)
+    return interface
+
+def benchmark_update(args):
+    bus = SimulatedI2CBus(latency=args.latency, nack_rate=args.nack_rate,
+        corruption_rate=args.corruption_rate, seed=args.seed)
+    interface = Delta5Interface(bus, None)
+    durations = []
+    bus.transactions = 0
+    for cycle in range(args.cycles):
+        start = time.time()
+        interface.update()
+        durations.append(time.time() - start)
+    report('update ({0} nodes)'.format(len(interface.nodes)), durations, bus.transactions)
+
+def benchmark_set_value(args):
+    bus = SimulatedI2CBus(latency=args.latency, nack_rate=args.nack_rate,
+        corruption_rate=args.corruption_rate, seed=args.seed)
+    interface = Delta5Interface(bus, None)
+    durations = []
+    bus.transactions = 0
+    for cycle in range(args.cycles):
+        node = interface.nodes[cycle % len(interface.nodes)]
+        start = time.time()
+        interface.set_and_validate_value_16(node, WRITE_CALIBRATION_THRESHOLD,
+            READ_CALIBRATION_THRESHOLD, 80 + cycle % 20)
+        durations.append(time.time() - start)
+    report('set_and_validate_value_16', durations, bus.transactions)
+
+def benchmark_config_push(args):
+    '''A three value tuning profile on every node, one validated write at a time
+    against the shadow register push, changed and unchanged.'''
+    bus = SimulatedI2CBus(latency=args.latency, nack_rate=args.nack_rate,
+        corruption_rate=args.corruption_rate, seed=args.seed)
+    interface = Delta5Interface(bus, None)
+    registers = [(WRITE_CALIBRATION_THRESHOLD, READ_CALIBRATION_THRESHOLD),
+        (WRITE_CALIBRATION_OFFSET, READ_CALIBRATION_OFFSET),
+        (WRITE_TRIGGER_THRESHOLD, READ_TRIGGER_THRESHOLD)]
+    sequential = []
+    pushed = []
+    unchanged = []
+    for cycle in range(args.profiles):
+        values = [90 + cycle % 10, 8 + cycle % 4, 40 + cycle % 6]
+        start = time.time()
+        for node in interface.nodes:
+            for (write_command, read_command), value in zip(registers, values):
+                interface.set_and_validate_value_16(node, write_command, read_command,
+                    value + 1)
+        sequential.append(time.time() - start)
+        profile = {
+            'calibration_threshold': values[0],
+            'calibration_offset': values[1],
+            'trigger_threshold': values[2]
+        }
+        for node in interface.nodes: # The sequential writes bypass the shadow registers
+            node.calibration_threshold = None
+            node.calibration_offset = None
+            node.trigger_threshold = None
+        start = time.time()
+        interface.set_config_global(profile)
+        pushed.append(time.time() - start)
+        start = time.time()
+        interface.set_config_global(profile)
+        unchanged.append(time.time() - start)
+    report('profile, sequential set and validate', sequential)
+    report('profile, shadow register push', pushed)
+    report('profile, shadow register push unchanged', unchanged)
+
+def benchmark_heartbeat(args, clients=20):
+    '''Building and encoding one heartbeat payload of each kind, with the bytes a tick
+    sends to a number of clients.'''
+    bus = SimulatedI2CBus(latency=0, seed=args.seed)
+    interface = Delta5Interface(bus, None)
+    interface.update()
+    json_durations = []
+    binary_durations = []
+    for cycle in range(args.cycles):
+        start = time.time()
+        json_payload = json.dumps(interface.get_heartbeat_json())
+        json_durations.append(time.time() - start)
+        start = time.time()
+        binary_payload = interface.get_heartbeat_binary()
+        binary_durations.append(time.time() - start)
+    report('json heartbeat ({0} bytes, {1} bytes a tick to {2} clients)'.format(
+        len(json_payload), len(json_payload) * clients, clients), json_durations)
+    report('binary heartbeat ({0} bytes, {1} bytes a tick to {2} clients)'.format(
+        len(binary_payload), len(binary_payload) * clients, clients), binary_durations)
+
+def benchmark_pass_latency(args):
+    race = None
+    if args.scenario is not None:
+        race = get_simulated_race(8, args.scenario, args.seed)
+    bus = SimulatedI2CBus(latency=args.latency, nack_rate=args.nack_rate,
+        corruption_rate=args.corruption_rate, lap_interval=args.lap_interval,
+        seed=args.seed, race=race)
+    interface = Delta5Interface(bus, None)
+    latencies = []
+    timestamp_errors = []
+    # The interface and the simulated bus share the monotonic clock
+    interface_start = interface.start_time
+
+    def pass_record_callback(node, ms_since_lap):
+        pass_time = bus.get_pass_time(node.i2c_addr, (node.last_lap_id + 1) & 0xFF)
+        if pass_time is not None:
+            latencies.append(monotonic() - pass_time)
+            pass_timestamp = interface_start + node.pass_timestamp / 1000.0
+            timestamp_errors.append(abs(pass_timestamp - pass_time))
+
+    interface.pass_record_callback = pass_record_callback
+    interface.hardware_log_callback = None
+    interface.start()
+    gevent.sleep(args.duration)
+    interface.update_thread.kill()
+    if latencies:
+        report('pass detection latency', latencies)
+        report('pass timestamp error', timestamp_errors)
+    print 'poll cycles: {0}'.format(interface.get_poll_stats_json())
+
+def benchmark_replay(args):
+    '''Close finish passes of 8 pilots through a callback that only spends the time.'''
+    bus = SimulatedI2CBus(latency=args.latency, seed=args.seed)
+    interface = Delta5Interface(bus, None)
+    interface.pass_record_callback = lambda node, ms_since_lap: time.sleep(args.callback_time)
+    passes = get_synthetic_passes(len(interface.nodes), laps=3, lap_time=2000, seed=args.seed)
+    for speed in [1.0, 10.0, REPLAY_MAX_SPEED]:
+        print interface.replay_passes(passes, speed).get_report()
+
+def main():
+    parser = argparse.ArgumentParser(description='Delta 5 interface benchmark')
+    parser.add_argument('--latency', type=float, default=0.001,
+        help='seconds each bus transaction takes')
+    parser.add_argument('--nack-rate', type=float, default=0.0,
+        help='chance of a transaction not being acknowledged')
+    parser.add_argument('--corruption-rate', type=float, default=0.0,
+        help='chance of a read returning a corrupted byte')
+    parser.add_argument('--cycles', type=int, default=200,
+        help='number of update or set value runs')
+    parser.add_argument('--profiles', type=int, default=10,
+        help='number of tuning profile pushes')
+    parser.add_argument('--lap-interval', type=float, default=1.0,
+        help='seconds between simulated passes on each node')
+    parser.add_argument('--scenario', default=None,
+        help='simulated race for the pass latency benchmark instead of fixed lap intervals')
+    parser.add_argument('--duration', type=float, default=10.0,
+        help='seconds to run the pass latency benchmark')
+    parser.add_argument('--seed', type=int, default=None,
+        help='random seed for repeatable runs')
+    parser.add_argument('--callback-time', type=float, default=0.002,
+        help='seconds the replayed pass callback takes, the server emits and logs')
+    args = parser.parse_args()
+
+    benchmark_startup(args)
+    benchmark_update(args)
+    benchmark_set_value(args)
+    benchmark_config_push(args)
+    benchmark_heartbeat(args)
+    benchmark_pass_latency(args)
+    benchmark_replay(args)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+'''Append only journal of the race in progress, replayed after a crash or restart.'''
+
+import mmap
+import os
+import struct
+import zlib
+
+import gevent
+
+JOURNAL_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'race_journal.bin')
+JOURNAL_FSYNC_INTERVAL = 0.1 # Seconds between fsyncs, passes in between share one fsync
+
+RECORD_START = 1 # Race started: heat id, wall clock seconds, race start milliseconds
+RECORD_PASS = 2 # Raw pass: node, lap id, ms since lap, pass and read milliseconds, peaks
+RECORD_DELETE = 3 # Lap deleted: node, lap id
+RECORD_STOP = 4 # Race stopped
+
+# type, node, lap id or heat id, ms since lap, two times, peak rssi, peak rssi raw, crc32
+RECORD = struct.Struct('<BBHIddHHI')
+RECORD_DATA_SIZE = RECORD.size - 4 # Bytes covered by the crc
+
+class JournalRecord():
+    '''One journal entry, fields not used by a record type are zero.'''
+    def __init__(self, record_type, node_index=0, lap_id=0, ms_since_lap=0,
+                 time_a=0.0, time_b=0.0, peak_rssi=0, peak_rssi_raw=0):
+        self.record_type = record_type
+        self.node_index = node_index
+        self.lap_id = lap_id
+        self.ms_since_lap = ms_since_lap
+        self.time_a = time_a
+        self.time_b = time_b
+        self.peak_rssi = peak_rssi
+        self.peak_rssi_raw = peak_rssi_raw
+
+class Delta5Journal():
+    '''Fixed size, crc checked records appended to a file.
+
+    Appends go straight to the file descriptor so a crashed server loses
+    nothing the kernel has, and fsyncs are batched on the gevent thread
+    pool so a slow SD card never holds up the poll loop. The journal only
+    covers the race in progress, it is truncated when the laps are saved
+    or cleared. A record torn by a power cut fails its crc and ends the
+    replay.'''
+    def __init__(self, path=JOURNAL_FILE):
+        self.path = path
+        self.fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0644)
+        self.dirty = False
+        self.flush_thread = gevent.spawn(self.flush_loop)
+
+    def append(self, record):
+        data = RECORD.pack(record.record_type, record.node_index, record.lap_id,
+            record.ms_since_lap, record.time_a, record.time_b, record.peak_rssi,
+            record.peak_rssi_raw, 0)[:RECORD_DATA_SIZE]
+        os.write(self.fd, data + struct.pack('<I', zlib.crc32(data) & 0xFFFFFFFF))
+        self.dirty = True
+
+    def race_start(self, heat_id, wall_time, race_start_ms):
+        self.truncate() # Nothing before a race start is replayed
+        self.append(JournalRecord(RECORD_START, lap_id=heat_id, time_a=wall_time,
+            time_b=race_start_ms))
+
+    def race_pass(self, node, ms_since_lap, read_ms):
+        self.append(JournalRecord(RECORD_PASS, node.index, node.clock.lap_id & 0xFFFF,
+            ms_since_lap & 0xFFFFFFFF, node.pass_timestamp, read_ms,
+            node.peak_rssi & 0xFFFF, node.peak_rssi_raw & 0xFFFF))
+
+    def lap_deleted(self, node_index, lap_id):
+        self.append(JournalRecord(RECORD_DELETE, node_index, lap_id))
+
+    def race_stop(self):
+        self.append(JournalRecord(RECORD_STOP))
+
+    def truncate(self):
+        '''Empties the journal once the race is saved or cleared.'''
+        os.ftruncate(self.fd, 0)
+        self.dirty = True
+
+    def flush(self):
+        '''Fsyncs on a pool thread, the hub keeps running greenlets meanwhile.'''
+        if self.dirty:
+            self.dirty = False
+            gevent.get_hub().threadpool.apply(os.fsync, (self.fd,))
+
+    def flush_loop(self):
+        while True:
+            gevent.sleep(JOURNAL_FSYNC_INTERVAL)
+            self.flush()
+
+    def replay(self):
+        '''Returns the records of the journal, up to the first torn or corrupt one.'''
+        records = []
+        size = os.path.getsize(self.path)
+        if size < RECORD.size:
+            return records # mmap can't map an empty file
+        with open(self.path, 'rb') as journal_file:
+            data = mmap.mmap(journal_file.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                for offset in xrange(0, size - RECORD.size + 1, RECORD.size):
+                    fields = RECORD.unpack_from(data, offset)
+                    crc = zlib.crc32(data[offset:offset + RECORD_DATA_SIZE]) & 0xFFFFFFFF
+                    if crc != fields[-1]:
+                        break
+                    records.append(JournalRecord(*fields[:-1]))
+            finally:
+                data.close()
+        return records
+
+def get_journal(path=JOURNAL_FILE):
+    '''Returns the delta 5 journal object.'''
+    return Delta5Journal(path)
@@ -0,0 +1,70 @@
+'''Class to hold the race leaderboard, updated as each lap is added.'''
+
+import bisect
+
+class NodeStats():
+    '''Running lap statistics for one node.'''
+    def __init__(self, node_index):
+        self.node_index = node_index
+        self.laps = 0 # Completed laps, lap zero is not counted
+        self.total_time = 0 # Time stamp of the last completed lap
+        self.last_lap = 0
+        self.lap_time_sum = 0
+        self.fastest_lap = 0
+
+    def average_lap(self):
+        '''Returns the average lap time.'''
+        if self.laps == 0:
+            return 0
+        return self.lap_time_sum / float(self.laps)
+
+    def sort_key(self):
+        '''Most laps first, then lowest total time, node index keeps ties stable.'''
+        return (-self.laps, self.total_time, self.node_index)
+
+    def add_lap(self, lap):
+        '''Adds a completed lap to the running statistics.'''
+        self.laps = lap['lap_id']
+        self.total_time = lap['lap_time_stamp']
+        self.last_lap = lap['lap_time']
+        self.lap_time_sum = self.lap_time_sum + lap['lap_time']
+        if self.fastest_lap == 0 or lap['lap_time'] < self.fastest_lap:
+            self.fastest_lap = lap['lap_time']
+
+class Delta5Leaderboard():
+    '''Per node running statistics kept in leaderboard order.'''
+    def __init__(self, num_nodes=0):
+        self.stats = []
+        self.order = [] # Sorted node sort keys
+        self.reset(num_nodes)
+
+    def reset(self, num_nodes):
+        '''Clears the statistics for all nodes.'''
+        self.stats = [NodeStats(node) for node in range(num_nodes)]
+        self.order = sorted([stats.sort_key() for stats in self.stats])
+
+    def add_lap(self, node_index, lap):
+        '''Updates a node with a new lap and moves it to its new position.'''
+        if lap['lap_id'] == 0: # Launch pad to first gate pass, not a completed lap
+            return
+        stats = self.stats[node_index]
+        self._remove(stats)
+        stats.add_lap(lap)
+        bisect.insort(self.order, stats.sort_key())
+
+    def rebuild_node(self, node_index, laps):
+        '''Recalculates a node from its laps, used after a lap is deleted.'''
+        stats = self.stats[node_index]
+        self._remove(stats)
+        self.stats[node_index] = stats = NodeStats(node_index)
+        for lap in laps:
+            if lap['lap_id'] != 0:
+                stats.add_lap(lap)
+        bisect.insort(self.order, stats.sort_key())
+
+    def get_sorted(self):
+        '''Returns the node statistics in leaderboard order.'''
+        return [self.stats[key[2]] for key in self.order]
+
+    def _remove(self, stats):
+        del self.order[bisect.bisect_left(self.order, stats.sort_key())]
@@ -1,5 +1,7 @@
 '''Class to hold race management variables.'''
 
+from Delta5Leaderboard import Delta5Leaderboard
+
 class Delta5Race():
     '''Class to hold race management variables.'''
     def __init__(self):
@@ -7,6 +9,84 @@ class Delta5Race():
         self.current_heat = 1
         self.race_status = 0
         self.lang_id = 2
+        self.node_laps = [] # Current laps per node, served from memory
+        self.leaderboard = Delta5Leaderboard() # Updated as each lap is added
+        self.lap_sequence = 0 # Incremented on every change to the current laps
+        self.heat_pilots = {} # Pilot id per node for each heat id
+        self.pilot_callsigns = {} # Callsign per pilot id
+        self.pilot_phonetics = {} # Phonetic name per pilot id
+
+    #
+    # Current laps
+    #
+
+    def reset_laps(self):
+        '''Clears the current laps for all nodes.'''
+        self.node_laps = [[] for node in range(self.num_nodes)]
+        self.leaderboard.reset(self.num_nodes)
+        self.lap_sequence = self.lap_sequence + 1
+
+    def get_laps(self, node_index):
+        '''Returns the current laps for a node.'''
+        return self.node_laps[node_index]
+
+    def add_lap(self, node_index, pilot_id, lap_time_stamp):
+        '''Adds a pass to a node, lap zero is the launch pad to the first gate pass.'''
+        laps = self.node_laps[node_index]
+        if laps:
+            lap_id = laps[-1]['lap_id'] + 1
+            lap_time = lap_time_stamp - laps[-1]['lap_time_stamp']
+        else:
+            lap_id = 0
+            lap_time = lap_time_stamp
+        lap = {
+            'lap_id': lap_id,
+            'pilot_id': pilot_id,
+            'lap_time_stamp': lap_time_stamp,
+            'lap_time': lap_time
+        }
+        laps.append(lap)
+        self.leaderboard.add_lap(node_index, lap)
+        self.lap_sequence = self.lap_sequence + 1
+        return lap
+
+    def delete_lap(self, node_index, lap_id):
+        '''Removes a false lap, merges its time into the next lap and renumbers.
+        Returns the next lap if one was updated.'''
+        laps = self.node_laps[node_index]
+        if lap_id < 0 or lap_id >= len(laps):
+            return None
+        next_lap = None
+        if lap_id + 1 < len(laps):
+            next_lap = laps[lap_id + 1]
+            if lap_id > 0:
+                next_lap['lap_time'] = next_lap['lap_time_stamp'] \
+                    - laps[lap_id - 1]['lap_time_stamp']
+            else:
+                next_lap['lap_time'] = next_lap['lap_time_stamp']
+        del laps[lap_id]
+        for lap in laps[lap_id:]:
+            lap['lap_id'] = lap['lap_id'] - 1
+        self.leaderboard.rebuild_node(node_index, laps)
+        self.lap_sequence = self.lap_sequence + 1
+        return next_lap
+
+    #
+    # Heat and pilot lookups
+    #
+
+    def get_pilot_id(self, node_index, heat_id=None):
+        '''Returns the pilot id on a node for a heat, defaults to the current heat.'''
+        if heat_id is None:
+            heat_id = self.current_heat
+        pilots = self.heat_pilots.get(heat_id)
+        if pilots is None or node_index >= len(pilots):
+            return 0
+        return pilots[node_index]
+
+    def get_callsign(self, node_index, heat_id=None):
+        '''Returns the callsign of the pilot on a node for a heat.'''
+        return self.pilot_callsigns.get(self.get_pilot_id(node_index, heat_id), '-')
 
 def get_race_state():
     '''Returns the delta 5 race object.'''
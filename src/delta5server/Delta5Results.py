@@ -0,0 +1,83 @@
+'''Class to hold the saved round summary, served to the rounds page from memory.'''
+
+import bisect
+
+CONSECUTIVE_LAPS = 3 # Laps in the best consecutive laps statistic
+
+def get_race_stats(laps):
+    '''Returns (laps, lap time sum, best lap, best consecutive laps) for one node in a saved
+    race, lap zero is the launch pad to the first gate pass and is not counted.'''
+    lap_times = [lap['lap_time'] for lap in laps if lap['lap_id'] > 0]
+    best_consecutive = 0
+    if len(lap_times) >= CONSECUTIVE_LAPS:
+        window = sum(lap_times[:CONSECUTIVE_LAPS])
+        best_consecutive = window
+        for index in range(CONSECUTIVE_LAPS, len(lap_times)):
+            window = window + lap_times[index] - lap_times[index - CONSECUTIVE_LAPS]
+            best_consecutive = min(best_consecutive, window)
+    best_lap = min(lap_times) if lap_times else 0
+    return len(lap_times), sum(lap_times), best_lap, best_consecutive
+
+class Delta5Results():
+    '''Saved laps grouped by heat, round and node.
+
+    Built once from the saved races table, then each saved round is added
+    as it is saved. Resets of the saved races invalidate it so the next
+    page load rebuilds it with a single query.'''
+    def __init__(self):
+        self.valid = False
+        self.heats = {} # Rounds by round id for each heat id
+        self.heat_order = [] # Sorted heat ids
+
+    def invalidate(self):
+        self.valid = False
+        self.heats = {}
+        self.heat_order = []
+
+    def load(self, saved_laps, num_nodes):
+        '''Rebuilds the summary from saved race rows.'''
+        self.invalidate()
+        for lap in saved_laps:
+            nodes = self.get_round(lap.heat_id, lap.round_id, num_nodes)
+            if lap.node_index < num_nodes:
+                nodes[lap.node_index].append((lap.lap_id, lap.lap_time_formatted))
+        for heat in self.heats.values():
+            for nodes in heat['rounds'].values():
+                for laps in nodes:
+                    laps.sort()
+        self.valid = True
+
+    def add_round(self, heat_id, round_id, node_laps, time_format):
+        '''Adds a newly saved round, node_laps are the race state laps of each node.'''
+        if not self.valid:
+            return # Rebuilt from the database on the next page load
+        nodes = self.get_round(heat_id, round_id, len(node_laps))
+        for node_index, laps in enumerate(node_laps):
+            nodes[node_index] = [(lap['lap_id'], time_format(lap['lap_time'])) for lap in laps]
+
+    def get_round(self, heat_id, round_id, num_nodes):
+        '''Returns the lap lists of each node in a round, adding the heat and round if new.'''
+        heat = self.heats.get(heat_id)
+        if heat is None:
+            heat = {'heat_id': heat_id, 'rounds': {}, 'round_order': []}
+            self.heats[heat_id] = heat
+            bisect.insort(self.heat_order, heat_id)
+        nodes = heat['rounds'].get(round_id)
+        if nodes is None:
+            nodes = [[] for node in range(num_nodes)]
+            heat['rounds'][round_id] = nodes
+            bisect.insort(heat['round_order'], round_id)
+        return nodes
+
+    def get_heats(self):
+        '''Returns [(heat_id, [(round_id, node laps)])] in heat and round order.'''
+        summary = []
+        for heat_id in self.heat_order:
+            heat = self.heats[heat_id]
+            summary.append((heat_id, [(round_id, heat['rounds'][round_id]) \
+                for round_id in heat['round_order']]))
+        return summary
+
+def get_results():
+    '''Returns the delta 5 results object.'''
+    return Delta5Results()
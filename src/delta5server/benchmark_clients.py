@@ -0,0 +1,168 @@
+'''Spectator load benchmark of a running server with simulated socket.io clients.
+
+Connects growing numbers of clients to the spectator, heartbeat and load
+probe topics, replays a synthetic race through the server and asks it for
+numbered, time stamped probes. Reports emit to receive latency of the
+probes, probes and laps each client missed by sequence number, the
+heartbeat rate each client received, leaderboards missed against the
+client that got the most, and the server cpu and memory from /proc. Run
+against a server on simulated nodes with the load probe enabled:
+    python server.py --simulate 8 --load-probe
+    python benchmark_clients.py --clients 50,100,200,400 --pid <server pid>
+Needs the python-socketio client (pip install "python-socketio[client]").
+'''
+
+import gevent
+import gevent.monkey
+gevent.monkey.patch_all()
+import gevent.pool
+
+import argparse
+import os
+import sys
+import time
+
+import socketio
+
+sys.path.append('../delta5interface')
+from Delta5Stats import report
+
+CLIENT_TOPICS = ['spectator', 'heartbeat', 'load_probe']
+CONNECT_CONCURRENCY = 20 # Clients connecting at once
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+
+class LoadClient():
+    '''One spectator page, records what it receives.'''
+    def __init__(self, url):
+        self.url = url
+        self.sio = socketio.Client(reconnection=False)
+        self.probe_latencies = []
+        self.probe_sequences = set()
+        self.lap_sequences = set()
+        self.heartbeats = 0
+        self.leaderboards = 0
+        self.sio.on('load_probe', self.on_load_probe)
+        self.sio.on('lap_added', self.on_lap_added)
+        self.sio.on('heartbeat', self.on_heartbeat)
+        self.sio.on('leaderboard', self.on_leaderboard)
+
+    def connect(self):
+        try:
+            self.sio.connect(self.url, transports=['websocket'])
+            self.sio.emit('join_topics', {'topics': CLIENT_TOPICS})
+            return True
+        except socketio.exceptions.ConnectionError:
+            return False
+
+    def disconnect(self):
+        if self.sio.connected:
+            self.sio.disconnect()
+
+    def on_load_probe(self, data):
+        self.probe_latencies.append(time.time() - data['time'])
+        self.probe_sequences.add(data['sequence'])
+
+    def on_lap_added(self, data):
+        self.lap_sequences.add(data['sequence'])
+
+    def on_heartbeat(self, data):
+        self.heartbeats = self.heartbeats + 1
+
+    def on_leaderboard(self, data):
+        self.leaderboards = self.leaderboards + 1
+
+    def reset_counts(self):
+        '''Starts counting heartbeats and leaderboards for a step.'''
+        self.heartbeats = 0
+        self.leaderboards = 0
+
+def get_process_stats(pid):
+    '''Returns (cpu seconds, rss megabytes) of a process, None without a pid.'''
+    if pid is None:
+        return None
+    with open('/proc/{0}/stat'.format(pid)) as stat_file:
+        fields = stat_file.read().rsplit(')', 1)[1].split()
+    cpu = (int(fields[11]) + int(fields[12])) / float(CLOCK_TICKS) # utime, stime
+    rss = 0
+    with open('/proc/{0}/status'.format(pid)) as status_file:
+        for line in status_file:
+            if line.startswith('VmRSS:'):
+                rss = int(line.split()[1]) / 1024.0
+    return cpu, rss
+
+def connect_clients(url, count):
+    clients = [LoadClient(url) for client in range(count)]
+    pool = gevent.pool.Pool(CONNECT_CONCURRENCY)
+    connected = pool.map(lambda client: client.connect(), clients)
+    return [client for client, ok in zip(clients, connected) if ok]
+
+def benchmark_step(args, count):
+    start = time.time()
+    clients = connect_clients(args.url, count)
+    connect_time = time.time() - start
+    control = socketio.Client(reconnection=False)
+    control.connect(args.url, transports=['websocket'])
+    control.emit('clear_laps')
+    gevent.sleep(1) # Snapshots and the cleared laps settle before measuring
+    for client in clients:
+        client.reset_counts()
+
+    before = get_process_stats(args.pid)
+    probes = int(args.duration / args.probe_interval)
+    control.emit('replay_race', {'source': 'synthetic', 'speed': args.speed})
+    control.emit('start_load_probe', {'interval': args.probe_interval, 'count': probes})
+    gevent.sleep(args.duration + args.grace)
+    after = get_process_stats(args.pid)
+
+    latencies = []
+    laps = set()
+    for client in clients:
+        latencies.extend(client.probe_latencies)
+        laps.update(client.lap_sequences)
+    missed_probes = sum(probes - len(client.probe_sequences) for client in clients)
+    missed_laps = sum(len(laps - client.lap_sequences) for client in clients)
+    window = args.duration + args.grace
+    heartbeat_rates = [client.heartbeats / window for client in clients] or [0]
+    leaderboards = max([client.leaderboards for client in clients] or [0])
+    missed_leaderboards = sum(leaderboards - client.leaderboards for client in clients)
+    report('{0} clients, probe latency'.format(len(clients)), latencies or [0])
+    line = '{0} clients: connect {1:.1f} s ({2} failed), {3} laps, missed probes {4} of {5}, ' \
+        'missed laps {6} of {7}'.format(len(clients), connect_time, count - len(clients),
+        len(laps), missed_probes, probes * len(clients), missed_laps,
+        len(laps) * len(clients))
+    line = line + ', heartbeats/sec mean {0:.2f} min {1:.2f}, missed leaderboards {2} of {3}' \
+        .format(sum(heartbeat_rates) / len(heartbeat_rates), min(heartbeat_rates),
+        missed_leaderboards, leaderboards * len(clients))
+    if before is not None:
+        line = line + ', server cpu {0:.0f}%, rss {1:.1f} MB'.format(
+            (after[0] - before[0]) * 100 / window, after[1])
+    print line
+
+    control.disconnect()
+    for client in clients:
+        client.disconnect()
+    gevent.sleep(1) # Disconnects reach the server before the next step
+
+def main():
+    parser = argparse.ArgumentParser(description='Delta 5 client load benchmark')
+    parser.add_argument('--url', default='http://localhost:5000',
+        help='server to connect the clients to')
+    parser.add_argument('--clients', default='10,50,100,200',
+        help='comma separated client counts, one step each')
+    parser.add_argument('--pid', type=int, default=None,
+        help='server process id, for cpu and memory from /proc')
+    parser.add_argument('--duration', type=float, default=15.0,
+        help='seconds of probes and replayed passes in each step')
+    parser.add_argument('--grace', type=float, default=2.0,
+        help='seconds to wait for late messages after each step')
+    parser.add_argument('--probe-interval', type=float, default=0.1,
+        help='seconds between load probes')
+    parser.add_argument('--speed', type=float, default=10.0,
+        help='replay speed of the synthetic race, 0 for max speed')
+    args = parser.parse_args()
+
+    for count in [int(count) for count in args.clients.split(',')]:
+        benchmark_step(args, count)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+'''Commit latency and lookup benchmark of the race database settings.
+
+Compares SQLite's default rollback journal against the WAL journal and
+synchronous mode the server sets, saving a race row by row against one
+multi row insert, and the saved race lookups with and without the
+composite index, and the race journal appends and replay. Run on the pi
+to measure the SD card:
+    python benchmark_database.py --commits 200
+'''
+
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.append('../delta5interface')
+from Delta5Stats import report
+from Delta5Journal import get_journal, JournalRecord, RECORD_PASS
+
+CURRENT_LAP_TABLE = '''CREATE TABLE current_lap (id INTEGER PRIMARY KEY,
+    node_index INTEGER, pilot_id INTEGER, lap_id INTEGER, lap_time_stamp INTEGER,
+    lap_time INTEGER, lap_time_formatted INTEGER)'''
+SAVED_RACE_TABLE = '''CREATE TABLE saved_race (id INTEGER PRIMARY KEY, round_id INTEGER,
+    heat_id INTEGER, node_index INTEGER, pilot_id INTEGER, lap_id INTEGER,
+    lap_time_stamp INTEGER, lap_time INTEGER, lap_time_formatted INTEGER)'''
+SAVED_RACE_INDEX = '''CREATE INDEX ix_saved_race_heat_round_node
+    ON saved_race (heat_id, round_id, node_index)'''
+
+def open_database(path, journal_mode, synchronous):
+    connection = sqlite3.connect(path)
+    connection.execute('PRAGMA journal_mode={0}'.format(journal_mode))
+    connection.execute('PRAGMA synchronous={0}'.format(synchronous))
+    return connection
+
+def benchmark_commits(args, journal_mode, synchronous):
+    '''One lap insert and commit at a time, as the pass path writes them.'''
+    path = os.path.join(args.directory, 'benchmark_commits.db')
+    connection = open_database(path, journal_mode, synchronous)
+    connection.execute(CURRENT_LAP_TABLE)
+    connection.commit()
+    durations = []
+    for lap in range(args.commits):
+        start = time.time()
+        connection.execute('INSERT INTO current_lap (node_index, pilot_id, lap_id, '
+            'lap_time_stamp, lap_time, lap_time_formatted) VALUES (?, ?, ?, ?, ?, ?)',
+            (lap % 8, lap % 8 + 1, lap / 8, lap * 1000, 1000, '00:01.000'))
+        connection.commit()
+        durations.append(time.time() - start)
+    connection.close()
+    remove_database(path)
+    report('commit, journal {0}, synchronous {1}'.format(journal_mode, synchronous),
+        durations)
+
+def benchmark_save(args, bulk):
+    '''Saving an 8 pilot, 20 lap race into saved races in one transaction.'''
+    path = os.path.join(args.directory, 'benchmark_save.db')
+    connection = open_database(path, 'WAL', 'NORMAL')
+    connection.execute(SAVED_RACE_TABLE)
+    connection.commit()
+    insert = 'INSERT INTO saved_race (round_id, heat_id, node_index, pilot_id, lap_id, ' \
+        'lap_time_stamp, lap_time, lap_time_formatted) VALUES (?, ?, ?, ?, ?, ?, ?, ?)'
+    durations = []
+    for round_id in range(1, args.saves + 1):
+        rows = [(round_id, 1, node_index, node_index + 1, lap_id, lap_id * 1000, 1000,
+            '00:01.000') for node_index in range(8) for lap_id in range(21)]
+        start = time.time()
+        if bulk:
+            connection.executemany(insert, rows)
+        else:
+            for row in rows:
+                connection.execute(insert, row)
+        connection.commit()
+        durations.append(time.time() - start)
+    connection.close()
+    remove_database(path)
+    report('race save, {0}'.format('multi row insert' if bulk else 'row by row'), durations)
+
+def benchmark_lookups(args, indexed):
+    '''Laps of one node in one round, the rounds page access pattern.'''
+    path = os.path.join(args.directory, 'benchmark_lookups.db')
+    connection = open_database(path, 'WAL', 'NORMAL')
+    connection.execute(SAVED_RACE_TABLE)
+    rows = []
+    for heat_id in range(1, args.heats + 1):
+        for round_id in range(1, args.rounds + 1):
+            for node_index in range(8):
+                for lap_id in range(20):
+                    rows.append((round_id, heat_id, node_index, node_index + 1, lap_id,
+                        lap_id * 1000, 1000, '00:01.000'))
+    connection.executemany('INSERT INTO saved_race (round_id, heat_id, node_index, '
+        'pilot_id, lap_id, lap_time_stamp, lap_time, lap_time_formatted) '
+        'VALUES (?, ?, ?, ?, ?, ?, ?, ?)', rows)
+    if indexed:
+        connection.execute(SAVED_RACE_INDEX)
+    connection.commit()
+    durations = []
+    for lookup in range(args.commits):
+        start = time.time()
+        connection.execute('SELECT lap_id, lap_time_formatted FROM saved_race '
+            'WHERE heat_id = ? AND round_id = ? AND node_index = ?',
+            (lookup % args.heats + 1, lookup % args.rounds + 1, lookup % 8)).fetchall()
+        durations.append(time.time() - start)
+    connection.close()
+    remove_database(path)
+    report('saved race lookup, {0} laps, {1}'.format(len(rows),
+        'indexed' if indexed else 'no index'), durations)
+
+def benchmark_journal(args):
+    '''Pass appends to the race journal with batched fsyncs, then the restart replay.'''
+    path = os.path.join(args.directory, 'benchmark_journal.bin')
+    journal = get_journal(path)
+    journal.flush_thread.kill()
+    durations = []
+    for lap in range(args.commits):
+        start = time.time()
+        journal.append(JournalRecord(RECORD_PASS, lap % 8, lap / 8, 1000, lap * 1000.0,
+            lap * 1000.0 + 1, 200, 210))
+        durations.append(time.time() - start)
+    report('journal pass append', durations)
+    start = time.time()
+    journal.flush()
+    report('journal fsync of {0} passes'.format(args.commits), [time.time() - start])
+    start = time.time()
+    records = journal.replay()
+    report('journal replay of {0} records'.format(len(records)), [time.time() - start])
+    os.close(journal.fd)
+    os.remove(path)
+
+def remove_database(path):
+    for suffix in ['', '-wal', '-shm', '-journal']:
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+def main():
+    parser = argparse.ArgumentParser(description='Delta 5 database benchmark')
+    parser.add_argument('--commits', type=int, default=200,
+        help='number of commits or lookups to time')
+    parser.add_argument('--saves', type=int, default=50,
+        help='number of race saves to time')
+    parser.add_argument('--heats', type=int, default=10,
+        help='heats of saved races for the lookup benchmark')
+    parser.add_argument('--rounds', type=int, default=10,
+        help='rounds per heat for the lookup benchmark')
+    parser.add_argument('--directory', default=tempfile.gettempdir(),
+        help='directory for the benchmark database, use the SD card for real numbers')
+    args = parser.parse_args()
+
+    benchmark_commits(args, 'DELETE', 'FULL') # SQLite defaults
+    benchmark_commits(args, 'WAL', 'NORMAL') # Server settings
+    benchmark_save(args, False)
+    benchmark_save(args, True)
+    benchmark_lookups(args, False)
+    benchmark_lookups(args, True)
+    benchmark_journal(args)
+
+if __name__ == '__main__':
+    main()
@@ -1,44 +1,114 @@
 '''Delta5 race timer server script'''
 
+import argparse
+import json
 import os
 import sys
 from datetime import datetime
 from functools import wraps
 
 from flask import Flask, render_template, request, Response
-from flask_socketio import SocketIO, emit
+from flask_socketio import SocketIO, emit, join_room, leave_room
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, text
+from sqlalchemy.engine import Engine
 
 import gevent
 import gevent.monkey
 gevent.monkey.patch_all()
+from gevent.queue import Queue
 
 sys.path.append('../delta5interface')
 sys.path.append('/home/pi/delta5_race_timer/src/delta5interface')  # Needed to run on startup
-from Delta5Interface import get_hardware_interface
+from Delta5Interface import get_hardware_interface, I2C_ADDRS
+from Delta5Replay import get_synthetic_passes
+from Delta5Monitor import get_monitor
 
 from Delta5Race import get_race_state
+from Delta5Results import get_results, get_race_stats
+from Delta5Journal import get_journal, RECORD_START, RECORD_PASS, RECORD_DELETE, \
+    RECORD_STOP
 
 APP = Flask(__name__, static_url_path='/static')
 APP.config['SECRET_KEY'] = 'secret!'
 SOCKET_IO = SocketIO(APP, async_mode='gevent')
 
 HEARTBEAT_THREAD = None
+HEARTBEAT_INTERVAL = 0.5 # Seconds between rssi heartbeats
+LOAD_PROBE_THREAD = None
+LOAD_PROBE_MIN_INTERVAL = 0.01 # Seconds, limits a probe request to 100 emits a second
+LOAD_PROBE_MAX_COUNT = 10000 # Probes per request
+REPLAY_THREAD = None
+DB_WRITER_THREAD = None
+DB_WRITE_QUEUE = Queue() # Database writes applied behind the in-memory race state
 
 BASEDIR = os.path.abspath(os.path.dirname(__file__))
 APP.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(BASEDIR, 'database.db')
 APP.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 DB = SQLAlchemy(APP)
 
-INTERFACE = get_hardware_interface()
+DB_JOURNAL_MODE = 'WAL' # Commits append to the write ahead log, readers don't block the writer
+DB_SYNCHRONOUS = 'NORMAL' # Fsync at checkpoints only, safe against corruption in WAL mode
+
+@event.listens_for(Engine, 'connect')
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    '''Sets the journal and sync modes on each new database connection.'''
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode={0}'.format(DB_JOURNAL_MODE))
+    cursor.execute('PRAGMA synchronous={0}'.format(DB_SYNCHRONOUS))
+    cursor.close()
+
+PARSER = argparse.ArgumentParser(description='Delta 5 race timer server')
+PARSER.add_argument('--simulate', type=int, default=0, metavar='NODES',
+    help='run on simulated nodes instead of the i2c bus, up to 8')
+PARSER.add_argument('--scenario', default='race',
+    help='simulated race: practice, race, close_finish or crashes')
+PARSER.add_argument('--seed', type=int, default=None,
+    help='simulated race seed, the same seed flies the same race')
+PARSER.add_argument('--load-probe', action='store_true',
+    help='accept load probe requests from benchmark_clients.py')
+ARGS = PARSER.parse_args()
+
+if ARGS.simulate:
+    # The real interface polling simulated nodes, passes come from the simulated pilots
+    from SimulatedI2CBus import SimulatedI2CBus
+    from SimulatedRace import get_simulated_race
+    SIMULATED_RACE = get_simulated_race(ARGS.simulate, ARGS.scenario, ARGS.seed)
+    INTERFACE = get_hardware_interface(SimulatedI2CBus(I2C_ADDRS[:ARGS.simulate], \
+        seed=ARGS.seed, race=SIMULATED_RACE), node_map_path=None)
+else:
+    INTERFACE = get_hardware_interface()
 RACE = get_race_state() # For storing race management variables
+RESULTS = get_results() # Saved round summary for the rounds page
+JOURNAL = get_journal() # Race in progress, rebuilt from it on restart
+METRICS = INTERFACE.metrics # Interface and server metrics, served on /metrics
+METRICS_INTERVAL = 2 # Seconds between metrics updates to the settings page
+METRICS.define('delta5_db_commit_ms', 'histogram', 'Milliseconds each database commit took')
+METRICS.define('delta5_clients', 'gauge', 'Connected socket.io clients')
+CLIENT_COUNT = 0
+MONITOR = get_monitor(METRICS) # Event loop blocks and the on demand profiler
+
+@event.listens_for(DB.session, 'before_commit')
+def time_commit_start(session):
+    session.info['commit_start'] = INTERFACE.milliseconds()
+
+@event.listens_for(DB.session, 'after_commit')
+def time_commit_end(session):
+    '''Times every commit, the flush and the fsync the writes wait on.'''
+    start = session.info.pop('commit_start', None)
+    if start is not None:
+        METRICS.observe('delta5_db_commit_ms', INTERFACE.milliseconds() - start)
 
 PROGRAM_START = datetime.now()
 RACE_START = datetime.now() # Updated on race start commands
+RACE_START_MS = 0 # Race start on the interface monotonic clock, for lap time stamps
+RACE_TIMER = 'start_timer' # Timer event of the race in progress, sent again to pages joining it
 
 # LED Code
 import time
 from neopixel import *
+from Delta5LED import LEDRenderer, onoff, theaterChase, rainbow, rainbowCycle, \
+    theaterChaseRainbow
 
 import signal
 def signal_handler(signal, frame):
@@ -56,65 +126,13 @@ LED_INVERT     = False   # True to invert the signal (when using NPN transistor
 LED_CHANNEL    = 0       # set to '1' for GPIOs 13, 19, 41, 45 or 53
 LED_STRIP      = ws.WS2811_STRIP_GRB   # Strip type and colour ordering
 
-# LED one color ON/OFF
-def onoff(strip, color):
-	for i in range(strip.numPixels()):
-		strip.setPixelColor(i, color)
-	strip.show()
-
-def theaterChase(strip, color, wait_ms=50, iterations=5):
-    """Movie theater light style chaser animation."""
-    for j in range(iterations):
-        for q in range(3):
-            for i in range(0, strip.numPixels(), 3):
-                strip.setPixelColor(i+q, color)
-            strip.show()
-            time.sleep(wait_ms/1000.0)
-            for i in range(0, strip.numPixels(), 3):
-                strip.setPixelColor(i+q, 0)
-
-def wheel(pos):
-    """Generate rainbow colors across 0-255 positions."""
-    if pos < 85:
-        return Color(pos * 3, 255 - pos * 3, 0)
-    elif pos < 170:
-        pos -= 85
-        return Color(255 - pos * 3, 0, pos * 3)
-    else:
-        pos -= 170
-        return Color(0, pos * 3, 255 - pos * 3)
-		
-def rainbow(strip, wait_ms=2, iterations=1):
-    """Draw rainbow that fades across all pixels at once."""
-    for j in range(256*iterations):
-        for i in range(strip.numPixels()):
-            strip.setPixelColor(i, wheel((i+j) & 255))
-        strip.show()
-        time.sleep(wait_ms/1000.0)
-
-def rainbowCycle(strip, wait_ms=2, iterations=1):
-    """Draw rainbow that uniformly distributes itself across all pixels."""
-    for j in range(256*iterations):
-        for i in range(strip.numPixels()):
-            strip.setPixelColor(i, wheel((int(i * 256 / strip.numPixels()) + j) & 255))
-        strip.show()
-        time.sleep(wait_ms/1000.0)
-
-def theaterChaseRainbow(strip, wait_ms=25):
-    """Rainbow movie theater light style chaser animation."""
-    for j in range(256):
-        for q in range(3):
-            for i in range(0, strip.numPixels(), 3):
-                strip.setPixelColor(i+q, wheel((i+j) % 255))
-            strip.show()
-            time.sleep(wait_ms/1000.0)
-            for i in range(0, strip.numPixels(), 3):
-                strip.setPixelColor(i+q, 0)
-
 # Create NeoPixel object with appropriate configuration.
 strip = Adafruit_NeoPixel(LED_COUNT, LED_PIN, LED_FREQ_HZ, LED_DMA, LED_INVERT, LED_BRIGHTNESS, LED_CHANNEL, LED_STRIP)
 # Intialize the library (must be called once before other functions).
 strip.begin()
+# Effects are played by the renderer greenlet, handlers only queue them
+LED = LEDRenderer(strip)
+LED.precompile([(rainbow, ()), (rainbowCycle, ()), (theaterChaseRainbow, ())])
 
 
 #
@@ -136,6 +154,7 @@ class Heat(DB.Model):
     heat_id = DB.Column(DB.Integer, nullable=False)
     node_index = DB.Column(DB.Integer, nullable=False)
     pilot_id = DB.Column(DB.Integer, nullable=False)
+    __table_args__ = (DB.Index('ix_heat_heat_node', 'heat_id', 'node_index'),)
 
     def __repr__(self):
         return '<Heat %r>' % self.heat_id
@@ -148,6 +167,7 @@ class CurrentLap(DB.Model):
     lap_time_stamp = DB.Column(DB.Integer, nullable=False)
     lap_time = DB.Column(DB.Integer, nullable=False)
     lap_time_formatted = DB.Column(DB.Integer, nullable=False)
+    __table_args__ = (DB.Index('ix_current_lap_node_lap', 'node_index', 'lap_id'),)
 
     def __repr__(self):
         return '<CurrentLap %r>' % self.pilot_id
@@ -162,15 +182,31 @@ class SavedRace(DB.Model):
     lap_time_stamp = DB.Column(DB.Integer, nullable=False)
     lap_time = DB.Column(DB.Integer, nullable=False)
     lap_time_formatted = DB.Column(DB.Integer, nullable=False)
+    __table_args__ = (DB.Index('ix_saved_race_heat_round_node', 'heat_id', 'round_id', \
+        'node_index'),)
 
     def __repr__(self):
         return '<SavedRace %r>' % self.round_id
 
+class PilotStats(DB.Model):
+    '''Totals over all saved races for each pilot, updated as races are saved.'''
+    id = DB.Column(DB.Integer, primary_key=True)
+    pilot_id = DB.Column(DB.Integer, unique=True, nullable=False)
+    rounds = DB.Column(DB.Integer, nullable=False)
+    laps = DB.Column(DB.Integer, nullable=False)
+    lap_time_sum = DB.Column(DB.Integer, nullable=False)
+    best_lap = DB.Column(DB.Integer, nullable=False) # Zero until a lap is completed
+    best_consecutive = DB.Column(DB.Integer, nullable=False)
+
+    def __repr__(self):
+        return '<PilotStats %r>' % self.pilot_id
+
 class Frequency(DB.Model):
     id = DB.Column(DB.Integer, primary_key=True)
     band = DB.Column(DB.Integer, nullable=False)
     channel = DB.Column(DB.Integer, nullable=False)
     frequency = DB.Column(DB.Integer, nullable=False)
+    __table_args__ = (DB.Index('ix_frequency_frequency', 'frequency'),)
 
     def __repr__(self):
         return '<Frequency %r>' % self.frequency
@@ -265,17 +301,29 @@ def index():
     #     heat_fast_laps.append(fast_laps)
     # print heat_max_laps
     # print heat_fast_laps
-    return render_template('rounds.html', num_nodes=RACE.num_nodes, rounds=SavedRace, \
-        pilots=Pilot, heats=Heat)
+    if not RESULTS.valid:
+        RESULTS.load(SavedRace.query.order_by(SavedRace.heat_id, SavedRace.round_id).all(), \
+            RACE.num_nodes)
+    return render_template('rounds.html', num_nodes=RACE.num_nodes, \
+        results=RESULTS.get_heats(), callsign=RACE.get_callsign)
         #, heat_max_laps=heat_max_laps, heat_fast_laps=heat_fast_laps
 
+@APP.route('/standings')
+def standings():
+    '''Route to pilot standings page.'''
+    def best(value):
+        return value if value > 0 else sys.maxint # Pilots without a time sort last
+    pilot_stats = sorted(PilotStats.query.all(), \
+        key=lambda stats: (best(stats.best_consecutive), best(stats.best_lap), -stats.laps))
+    return render_template('standings.html', pilot_stats=pilot_stats, \
+        callsigns=RACE.pilot_callsigns, time_format=time_format)
+
 @APP.route('/heats')
 def heats():
     '''Route to heat summary page.'''
     return render_template('heats.html', num_nodes=RACE.num_nodes, heats=Heat, pilots=Pilot, \
         frequencies=[node.frequency for node in INTERFACE.nodes], \
-        channels=[Frequency.query.filter_by(frequency=node.frequency).first().channel \
-            for node in INTERFACE.nodes])
+        channels=[get_channel(node.frequency) for node in INTERFACE.nodes])
 
 @APP.route('/race')
 @requires_auth
@@ -287,8 +335,7 @@ def race():
                            fix_race_time=FixTimeRace.query.get(1).race_time_sec,
 						   lang_id=RACE.lang_id,
         frequencies=[node.frequency for node in INTERFACE.nodes],
-        channels=[Frequency.query.filter_by(frequency=node.frequency).first().channel
-            for node in INTERFACE.nodes])
+        channels=[get_channel(node.frequency) for node in INTERFACE.nodes])
 
 @APP.route('/settings')
 @requires_auth
@@ -319,6 +366,27 @@ def database():
     return render_template('database.html', pilots=Pilot, heats=Heat, currentlaps=CurrentLap, \
         savedraces=SavedRace, frequencies=Frequency, )
 
+@APP.route('/traces')
+@requires_auth
+def traces():
+    '''Route to download the spans of recent passes, with percentiles of each stage.'''
+    return Response(json.dumps(INTERFACE.traces.get_json(), indent=1), \
+        mimetype='application/json', \
+        headers={'Content-Disposition': 'attachment; filename=pass_traces.json'})
+
+@APP.route('/loop_blocks')
+@requires_auth
+def loop_blocks():
+    '''Route to download the recent event loop blocks with the stack holding the loop.'''
+    return Response(json.dumps(MONITOR.get_json(), indent=1), \
+        mimetype='application/json', \
+        headers={'Content-Disposition': 'attachment; filename=loop_blocks.json'})
+
+@APP.route('/metrics')
+def metrics():
+    '''Route to the metrics in the prometheus text format, for scrapers.'''
+    return Response(METRICS.get_text(), mimetype='text/plain; version=0.0.4')
+
 #
 # Socket IO Events
 #
@@ -326,21 +394,41 @@ def database():
 @SOCKET_IO.on('connect')
 def connect_handler():
     '''Starts the delta 5 interface and a heartbeat thread for rssi.'''
+    global CLIENT_COUNT
+    CLIENT_COUNT = CLIENT_COUNT + 1
+    METRICS.set_gauge('delta5_clients', CLIENT_COUNT)
     server_log('Client connected')
     INTERFACE.start()
     global HEARTBEAT_THREAD
     if HEARTBEAT_THREAD is None:
         HEARTBEAT_THREAD = gevent.spawn(heartbeat_thread_function)
         server_log('Heartbeat thread started')
-    emit_node_data() # Settings page, node channel and triggers
-    emit_node_tuning() # Settings page, node tuning values
-    emit_race_status() # Race page, to set race button states
-    emit_current_laps() # Race page, load and current laps
-    emit_leaderboard() # Race page, load leaderboard for current laps
+
+@SOCKET_IO.on('join_topics')
+def on_join_topics(data):
+    '''Joins the topic rooms a page uses, clients get no events until they join.'''
+    topics = [topic for topic in data['topics'] if topic in TOPICS]
+    for topic in topics:
+        join_room(topic)
+        snapshot = get_snapshot(topic)
+        if snapshot is not None:
+            emit('snapshot', snapshot) # Only to this client
+    if RACE.race_status == 1 and any(topic in EVENT_TOPICS[RACE_TIMER] for topic in topics):
+        emit(RACE_TIMER, get_race_timer_json()) # Start the timer of a page joining mid race
+
+@SOCKET_IO.on('leave_topics')
+def on_leave_topics(data):
+    '''Leaves topic rooms, for pages that switch views.'''
+    for topic in data['topics']:
+        if topic in TOPICS:
+            leave_room(topic)
 
 @SOCKET_IO.on('disconnect')
 def disconnect_handler():
     '''Emit disconnect event.'''
+    global CLIENT_COUNT
+    CLIENT_COUNT = CLIENT_COUNT - 1
+    METRICS.set_gauge('delta5_clients', CLIENT_COUNT)
     server_log('Client disconnected')
 
 # Settings socket io events
@@ -368,6 +456,7 @@ def on_add_heat():
     for node in range(RACE.num_nodes): # Add next heat with pilots 1 thru 5
         DB.session.add(Heat(heat_id=max_heat_id+1, node_index=node, pilot_id=node+1))
     DB.session.commit()
+    RACE.heat_pilots[max_heat_id+1] = [node+1 for node in range(RACE.num_nodes)]
     server_log('Heat added: Heat {0}'.format(max_heat_id+1))
 
 @SOCKET_IO.on('set_pilot_position')
@@ -379,6 +468,8 @@ def on_set_pilot_position(data):
     db_update = Heat.query.filter_by(heat_id=heat, node_index=node_index).first()
     db_update.pilot_id = pilot
     DB.session.commit()
+    RACE.heat_pilots[heat][node_index] = pilot
+    snapshot_changed() # Leaderboard callsigns
     server_log('Pilot position set: Heat {0} Node {1} Pilot {2}'.format(heat, node_index+1, pilot))
     emit_heat_data() # Settings page, new pilot position in heats
 
@@ -389,6 +480,8 @@ def on_add_pilot():
     DB.session.add(Pilot(pilot_id=max_pilot_id+1, callsign='callsign{0}'.format(max_pilot_id+1), \
         phonetic='callsign{0}'.format(max_pilot_id+1), name='Pilot Name'))
     DB.session.commit()
+    RACE.pilot_callsigns[max_pilot_id+1] = 'callsign{0}'.format(max_pilot_id+1)
+    RACE.pilot_phonetics[max_pilot_id+1] = 'callsign{0}'.format(max_pilot_id+1)
     server_log('Pilot added: Pilot {0}'.format(max_pilot_id+1))
 
 @SOCKET_IO.on('set_pilot_callsign')
@@ -399,6 +492,8 @@ def on_set_pilot_callsign(data):
     db_update = Pilot.query.filter_by(pilot_id=pilot_id).first()
     db_update.callsign = callsign
     DB.session.commit()
+    RACE.pilot_callsigns[pilot_id] = callsign
+    snapshot_changed() # Leaderboard callsigns
     server_log('Pilot callsign set: Pilot {0} Callsign {1}'.format(pilot_id, callsign))
     emit_pilot_data() # Settings page, new pilot callsign
     emit_heat_data() # Settings page, new pilot callsign in heats
@@ -411,6 +506,7 @@ def on_set_pilot_phonetic(data):
     db_update = Pilot.query.filter_by(pilot_id=pilot_id).first()
     db_update.phonetic = phonetic
     DB.session.commit()
+    RACE.pilot_phonetics[pilot_id] = phonetic
     server_log('Pilot phonetic set: Pilot {0} Phonetic {1}'.format(pilot_id, phonetic))
     emit_pilot_data() # Settings page, new pilot phonetic
     emit_heat_data() # Settings page, new pilot phonetic in heats. Needed?
@@ -430,7 +526,7 @@ def on_set_pilot_name(data):
 def on_speak_pilot(data):
     '''Speaks the phonetic name of the pilot.'''
     pilot_id = data['pilot_id']
-    phtext = Pilot.query.filter_by(pilot_id=pilot_id).first().phonetic
+    phtext = RACE.pilot_phonetics.get(pilot_id, '-')
     emit_phonetic_text(phtext)
     server_log('Speak pilot: {0}'.format(phtext))
 
@@ -459,9 +555,11 @@ def on_delete_profile():
      last_profile.profile_id = first_profile_id
      DB.session.commit()
      profile =Profiles.query.get(first_profile_id)
-     INTERFACE.set_calibration_threshold_global(profile.c_threshold)
-     INTERFACE.set_calibration_offset_global(profile.c_offset)
-     INTERFACE.set_trigger_threshold_global(profile.t_threshold)
+     INTERFACE.set_config_global({ # One push, unchanged values are skipped
+         'calibration_threshold': profile.c_threshold,
+         'calibration_offset': profile.c_offset,
+         'trigger_threshold': profile.t_threshold
+     })
      emit_node_tuning()
 
 @SOCKET_IO.on('set_profile_name')
@@ -551,9 +649,11 @@ def on_set_profile(data):
     last_profile = LastProfile.query.get(1)
     last_profile.profile_id = profile.id
     DB.session.commit()
-    INTERFACE.set_calibration_threshold_global(profile.c_threshold)
-    INTERFACE.set_calibration_offset_global(profile.c_offset)
-    INTERFACE.set_trigger_threshold_global(profile.t_threshold)
+    INTERFACE.set_config_global({ # One push, unchanged values are skipped
+        'calibration_threshold': profile.c_threshold,
+        'calibration_offset': profile.c_offset,
+        'trigger_threshold': profile.t_threshold
+    })
     emit_node_tuning()
     server_log("set tune paramas for profile '%s'" % profile_val)
 
@@ -601,17 +701,15 @@ def on_set_fix_race_time(data):
 def on_start_race():
     '''Starts the race and the timer counting up, no defined finish.'''
     start_race()
-    SOCKET_IO.emit('start_timer') # Loop back to race page to start the timer counting up
-    time.sleep(1)
-    onoff(strip, Color(0,255,0)) #GREEN ON
+    emit_race_timer('start_timer') # Loop back to race page to start the timer counting up
+    LED.play(onoff, (Color(0,255,0), 1000), key='race') #GREEN ON after 1 second
 
 @SOCKET_IO.on('start_race_2min')
 def on_start_race_2min():
     '''Starts the race with a two minute countdown clock.'''
     start_race()
-    SOCKET_IO.emit('start_timer_2min') # Loop back to race page to start a 2 min countdown
-    time.sleep(1)
-    onoff(strip, Color(0,255,0)) #GREEN ON
+    emit_race_timer('start_timer_2min') # Loop back to race page to start a 2 min countdown
+    LED.play(onoff, (Color(0,255,0), 1000), key='race') #GREEN ON after 1 second
 
 def start_race():
     '''Common race start events.'''
@@ -622,7 +720,10 @@ def start_race():
     gevent.sleep(0.500) # Make this random 2 to 5 seconds
     RACE.race_status = 1 # To enable registering passed laps
     global RACE_START # To redefine main program variable
+    global RACE_START_MS
     RACE_START = datetime.now() # Update the race start time stamp
+    RACE_START_MS = INTERFACE.milliseconds()
+    JOURNAL.race_start(RACE.current_heat, time.time(), RACE_START_MS)
     server_log('Race started at {0}'.format(RACE_START))
     emit_node_data() # Settings page, node channel and triggers on the launch pads
     emit_race_status() # Race page, to set race button states
@@ -631,10 +732,11 @@ def start_race():
 def on_race_status():
     '''Stops the race and stops registering laps.'''
     RACE.race_status = 2 # To stop registering passed laps, waiting for laps to be cleared
-    SOCKET_IO.emit('stop_timer') # Loop back to race page to start the timer counting up
+    JOURNAL.race_stop()
+    emit_topic('stop_timer') # Loop back to race page to start the timer counting up
     server_log('Race stopped')
     emit_race_status() # Race page, to set race button states
-    onoff(strip, Color(255,0,0)) #RED ON
+    LED.play(onoff, (Color(255,0,0),), key='race') #RED ON
 
 @SOCKET_IO.on('save_laps')
 def on_save_laps():
@@ -644,14 +746,18 @@ def on_save_laps():
             .filter_by(heat_id=RACE.current_heat).scalar()
     if max_round is None:
         max_round = 0
-    # Loop through laps to copy to saved races
-    for node in range(RACE.num_nodes):
-        for lap in CurrentLap.query.filter_by(node_index=node).all():
-            DB.session.add(SavedRace(round_id=max_round+1, heat_id=RACE.current_heat, \
-                node_index=node, pilot_id=lap.pilot_id, lap_id=lap.lap_id, \
-                lap_time_stamp=lap.lap_time_stamp, lap_time=lap.lap_time, \
-                lap_time_formatted=lap.lap_time_formatted))
+    # Copy the in-memory laps to saved races with one multi row insert
+    saved_laps = [{'round_id': max_round+1, 'heat_id': RACE.current_heat, \
+        'node_index': node, 'pilot_id': lap['pilot_id'], 'lap_id': lap['lap_id'], \
+        'lap_time_stamp': lap['lap_time_stamp'], 'lap_time': lap['lap_time'], \
+        'lap_time_formatted': time_format(lap['lap_time'])} \
+        for node in range(RACE.num_nodes) for lap in RACE.get_laps(node)]
+    if saved_laps:
+        DB.session.execute(SavedRace.__table__.insert(), saved_laps)
+    db_add_pilot_stats([RACE.get_laps(node) for node in range(RACE.num_nodes)])
     DB.session.commit()
+    RESULTS.add_round(RACE.current_heat, max_round+1, \
+        [RACE.get_laps(node) for node in range(RACE.num_nodes)], time_format)
     server_log('Current laps saved: Heat {0} Round {1}'.format(RACE.current_heat, max_round+1))
     on_clear_laps() # Also clear the current laps
 
@@ -659,8 +765,9 @@ def on_save_laps():
 def on_clear_laps():
     '''Clear the current laps due to false start or practice.'''
     RACE.race_status = 0 # Laps cleared, ready to start next race
-    DB.session.query(CurrentLap).delete() # Clear out the current laps table
-    DB.session.commit()
+    RACE.reset_laps()
+    JOURNAL.truncate() # Nothing left to recover
+    db_write_behind(db_clear_current_laps) # Clear out the current laps table
     server_log('Current laps cleared')
     emit_current_laps() # Race page, blank laps to the web client
     emit_leaderboard() # Race page, blank leaderboard to the web client
@@ -680,28 +787,20 @@ def on_delete_lap(data):
     '''Delete a false lap.'''
     node_index = data['node']
     lap_id = data['lapid']
-    max_lap = DB.session.query(DB.func.max(CurrentLap.lap_id)) \
-        .filter_by(node_index=node_index).scalar()
-    if lap_id is not max_lap:
-        # Update the lap_time for the next lap
-        previous_lap = CurrentLap.query.filter_by(node_index=node_index, lap_id=lap_id-1).first()
-        next_lap = CurrentLap.query.filter_by(node_index=node_index, lap_id=lap_id+1).first()
-        next_lap.lap_time = next_lap.lap_time_stamp - previous_lap.lap_time_stamp
-        next_lap.lap_time_formatted = time_format(next_lap.lap_time)
-        # Delete the false lap
-        CurrentLap.query.filter_by(node_index=node_index, lap_id=lap_id).delete()
-        # Update lap numbers
-        for lap in CurrentLap.query.filter_by(node_index=node_index).all():
-            if lap.lap_id > lap_id:
-                lap.lap_id = lap.lap_id - 1
-    else:
-        # Delete the false lap
-        CurrentLap.query.filter_by(node_index=node_index, lap_id=lap_id).delete()
-    DB.session.commit()
+    next_lap = RACE.delete_lap(node_index, lap_id)
+    lap_sequence = RACE.lap_sequence
+    JOURNAL.lap_deleted(node_index, lap_id)
+    db_write_behind(db_delete_current_lap, node_index, lap_id, \
+        None if next_lap is None else next_lap['lap_time'])
     server_log('Lap deleted: Node {0} Lap {1}'.format(node_index, lap_id))
-    emit_current_laps() # Race page, update web client
+    emit_lap_deleted(node_index, lap_id, next_lap, lap_sequence) # Race page, update web client
     emit_leaderboard() # Race page, update web client
 
+@SOCKET_IO.on('get_current_laps')
+def on_get_current_laps():
+    '''Sends all current laps to a client that missed a lap sequence number.'''
+    emit('current_laps', get_current_laps_json())
+
 @SOCKET_IO.on('simulate_lap')
 def on_simulate_lap(data):
     '''Simulates a lap (for debug testing).'''
@@ -709,13 +808,81 @@ def on_simulate_lap(data):
     server_log('Simulated lap: Node {0}'.format(node_index))
     INTERFACE.intf_simulate_lap(node_index)
 
+@SOCKET_IO.on('replay_race')
+def on_replay_race(data):
+    '''Replays the last saved round of the current heat or a synthetic close finish race
+    through the pass pipeline, at a multiple of real time or at max speed (0).'''
+    global REPLAY_THREAD
+    if RACE.race_status != 0 or replay_running():
+        # Starting a race clears the laps, and passes must not mix into a live race
+        server_log('Replay: stop and save or clear the current race first')
+        return
+    speed = float(data['speed'])
+    if data['source'] == 'round':
+        round_id = DB.session.query(DB.func.max(SavedRace.round_id)) \
+            .filter_by(heat_id=RACE.current_heat).scalar()
+        passes = sorted((lap.lap_time_stamp, lap.node_index) for lap in \
+            SavedRace.query.filter_by(heat_id=RACE.current_heat, round_id=round_id))
+    else:
+        passes = get_synthetic_passes(RACE.num_nodes)
+    if not passes:
+        server_log('Replay: no saved round for heat {0}'.format(RACE.current_heat))
+        return
+    REPLAY_THREAD = gevent.spawn(replay_race, passes, speed)
+
+def replay_race(passes, speed):
+    '''Starts a race and sends the passes through it, the replayed race is not journaled
+    so a restart doesn't recover it.'''
+    start_race()
+    JOURNAL.truncate()
+    emit_race_timer('start_timer')
+    server_log('Replay started: {0} passes'.format(len(passes)))
+    replay = INTERFACE.replay_passes(passes, speed)
+    server_log(replay.get_report())
+    if RACE.race_status == 1: # Unless stopped or cleared from the race page meanwhile
+        on_race_status()
+
+def replay_running():
+    return REPLAY_THREAD is not None and not REPLAY_THREAD.dead
+
+@SOCKET_IO.on('start_profiler')
+def on_start_profiler():
+    '''Starts sampling the stack of the event loop.'''
+    MONITOR.start_profiler()
+    server_log('Profiler started')
+
+@SOCKET_IO.on('stop_profiler')
+def on_stop_profiler():
+    '''Stops the profiler and logs the time spent in each handler and function.'''
+    for line in MONITOR.stop_profiler():
+        server_log(line)
+
+@SOCKET_IO.on('start_load_probe')
+def on_start_load_probe(data):
+    '''Starts numbered, time stamped probes to the load probe topic, for benchmark_clients.py
+    to measure emit to receive latency and dropped messages.'''
+    global LOAD_PROBE_THREAD
+    if not ARGS.load_probe: # Benchmark only
+        server_log('Load probe refused, start the server with --load-probe')
+        return
+    if LOAD_PROBE_THREAD is not None:
+        LOAD_PROBE_THREAD.kill()
+    LOAD_PROBE_THREAD = gevent.spawn(load_probe_thread_function, \
+        max(LOAD_PROBE_MIN_INTERVAL, float(data['interval'])), \
+        min(LOAD_PROBE_MAX_COUNT, int(data['count'])))
+
+def load_probe_thread_function(interval, count):
+    for sequence in range(count):
+        emit_topic('load_probe', {'sequence': sequence, 'time': time.time()})
+        gevent.sleep(interval)
+
 @SOCKET_IO.on('LED_solid')
 def on_LED_solid(data):
     '''LED Solid Color'''
     led_red = data['red']
     led_green = data['green']
     led_blue = data['blue']
-    onoff(strip, Color(led_red,led_green,led_blue))
+    LED.play(onoff, (Color(led_red,led_green,led_blue),), key='manual')
 
 @SOCKET_IO.on('LED_chase')
 def on_LED_chase(data):
@@ -723,40 +890,120 @@ def on_LED_chase(data):
     led_red = data['red']
     led_green = data['green']
     led_blue = data['blue']
-    theaterChase(strip, Color(led_red,led_green,led_blue))
+    LED.play(theaterChase, (Color(led_red,led_green,led_blue),), key='manual')
 
 @SOCKET_IO.on('LED_RB')
 def on_LED_RB():
-    rainbow(strip) #Rainbow
+    LED.play(rainbow, key='manual') #Rainbow
 
 @SOCKET_IO.on('LED_RBCYCLE')
 def on_LED_RBCYCLE():
-    rainbowCycle(strip) #Rainbow Cycle
+    LED.play(rainbowCycle, key='manual') #Rainbow Cycle
 
 @SOCKET_IO.on('LED_RBCHASE')
 def on_LED_RBCHASE():
-    theaterChaseRainbow(strip) #Rainbow Chase
+    LED.play(theaterChaseRainbow, key='manual') #Rainbow Chase
 
 # Socket io emit functions
 
+TOPICS = ['race', 'settings', 'log', 'spectator', 'heartbeat', 'heartbeat_binary', \
+    'load_probe']
+EVENT_TOPICS = { # Rooms each event is sent to, a page joins race or spectator, not both
+    'start_timer': ['race', 'spectator'],
+    'start_timer_2min': ['race', 'spectator'],
+    'stop_timer': ['race', 'spectator'],
+    'race_status': ['race', 'spectator'],
+    'node_data': ['race', 'settings'],
+    'node_tuning': ['settings'],
+    'current_laps': ['race', 'spectator'],
+    'lap_added': ['race', 'spectator'],
+    'lap_deleted': ['race', 'spectator'],
+    'leaderboard': ['race', 'spectator'],
+    'heat_data': ['settings'],
+    'pilot_data': ['settings'],
+    'current_heat': ['race', 'spectator'],
+    'phonetic_data': ['race'],
+    'language_data': ['race', 'settings'],
+    'set_fix_race_time': ['settings'],
+    'speak_phonetic_text': ['settings'],
+    'hardware_log': ['log'],
+    'load_probe': ['load_probe'],
+    'metrics': ['settings']
+}
+
+SNAPSHOT_CACHE = {} # Serialized snapshot of each topic, cleared when its state changes
+SNAPSHOT_CHANGED_BY = set(['race_status', 'node_data', 'node_tuning', 'current_laps', \
+    'lap_added', 'lap_deleted', 'leaderboard'])
+
+def get_snapshot(topic):
+    '''Returns the json state a page needs when it joins a topic, built once per change
+    so reconnecting clients don't query the database or disturb other clients.'''
+    snapshot = SNAPSHOT_CACHE.get(topic)
+    if snapshot is None:
+        state = {}
+        for event, get_json in SNAPSHOT_EVENTS:
+            if topic in EVENT_TOPICS[event]:
+                state[event] = get_json()
+        if not state:
+            return None
+        snapshot = json.dumps(state)
+        SNAPSHOT_CACHE[topic] = snapshot
+    return snapshot
+
+def snapshot_changed():
+    '''Drops the cached snapshots, for state written without emitting an event that
+    changes them, such as callsigns in the leaderboard or a database reset.'''
+    SNAPSHOT_CACHE.clear()
+
+def emit_topic(event, data=None):
+    '''Emits an event to the rooms of the topics that use it.'''
+    if event in SNAPSHOT_CHANGED_BY:
+        snapshot_changed()
+    args = () if data is None else (data,)
+    for topic in EVENT_TOPICS[event]:
+        SOCKET_IO.emit(event, *args, room=topic)
+
+def room_has_members(room):
+    '''Returns whether any client is in a room, to skip building data nobody receives.'''
+    return bool(SOCKET_IO.server.manager.rooms.get('/', {}).get(room))
+
+def get_race_status_json():
+    return {'race_status': RACE.race_status}
+
 def emit_race_status():
     '''Emits race status.'''
-    SOCKET_IO.emit('race_status', {'race_status': RACE.race_status})
+    emit_topic('race_status', get_race_status_json())
 
-def emit_node_data():
-    '''Emits node data.'''
-    SOCKET_IO.emit('node_data', {
+def get_race_timer_json():
+    return {'elapsed': int((INTERFACE.milliseconds() - RACE_START_MS) / 1000)}
+
+def emit_race_timer(event):
+    '''Starts the race page timers with the seconds since the race start.'''
+    global RACE_TIMER
+    RACE_TIMER = event
+    emit_topic(event, get_race_timer_json())
+
+def get_channel(frequency):
+    '''Returns the channel name of a frequency, blank for a node without a known one.'''
+    channel = Frequency.query.filter_by(frequency=frequency).first()
+    return channel.channel if channel is not None else ''
+
+def get_node_data_json():
+    return {
         'frequency': [node.frequency for node in INTERFACE.nodes],
-        'channel': [Frequency.query.filter_by(frequency=node.frequency).first().channel \
-            for node in INTERFACE.nodes],
+        'channel': [get_channel(node.frequency) for node in INTERFACE.nodes],
         'trigger_rssi': [node.trigger_rssi for node in INTERFACE.nodes],
         'peak_rssi': [node.peak_rssi for node in INTERFACE.nodes]
-    })
-def emit_node_tuning():
-    '''Emits node tuning values.'''
+    }
+
+def emit_node_data():
+    '''Emits node data.'''
+    emit_topic('node_data', get_node_data_json())
+
+def get_node_tuning_json():
     last_profile = LastProfile.query.get(1)
     tune_val = Profiles.query.get(last_profile.profile_id)
-    SOCKET_IO.emit('node_tuning', {
+    return {
         'calibration_threshold': \
             tune_val.c_threshold,
         'calibration_offset': \
@@ -767,118 +1014,99 @@ def emit_node_tuning():
             tune_val.name,
         'profile_description':
             tune_val.description
-    })
+    }
 
+def emit_node_tuning():
+    '''Emits node tuning values.'''
+    emit_topic('node_tuning', get_node_tuning_json())
 
-def emit_current_laps():
-    '''Emits current laps.'''
+
+def get_current_laps_json():
+    '''Returns all current laps with the lap sequence number they are valid for.'''
     current_laps = []
     # for node in DB.session.query(CurrentLap.node_index).distinct():
     for node in range(RACE.num_nodes):
         node_laps = []
         node_lap_times = []
-        for lap in CurrentLap.query.filter_by(node_index=node).all():
-            node_laps.append(lap.lap_id)
-            node_lap_times.append(lap.lap_time_formatted)
+        for lap in RACE.get_laps(node):
+            node_laps.append(lap['lap_id'])
+            node_lap_times.append(time_format(lap['lap_time']))
         current_laps.append({'lap_id': node_laps, 'lap_time': node_lap_times})
-    current_laps = {'node_index': current_laps}
-    SOCKET_IO.emit('current_laps', current_laps)
+    return {'sequence': RACE.lap_sequence, 'node_index': current_laps}
+
+def emit_current_laps():
+    '''Emits current laps, a full snapshot for when laps are cleared.'''
+    emit_topic('current_laps', get_current_laps_json())
+
+def emit_lap_added(node_index, lap, lap_sequence):
+    '''Emits a single new lap, clients request a snapshot if a sequence number is missed.'''
+    emit_topic('lap_added', {
+        'sequence': lap_sequence,
+        'node': node_index,
+        'lap_id': lap['lap_id'],
+        'lap_time': time_format(lap['lap_time'])
+    })
+
+def emit_lap_deleted(node_index, lap_id, next_lap, lap_sequence):
+    '''Emits a deleted lap and the new time of the lap after it.'''
+    emit_topic('lap_deleted', {
+        'sequence': lap_sequence,
+        'node': node_index,
+        'lap_id': lap_id,
+        'next_lap_time': None if next_lap is None else time_format(next_lap['lap_time'])
+    })
+
+def get_leaderboard_json():
+    leaderboard = RACE.leaderboard.get_sorted()
+    leader_laps = leaderboard[0].laps if leaderboard else 0
+
+    return {
+        'position': [i+1 for i in range(len(leaderboard))],
+        'callsign': [RACE.get_callsign(stats.node_index) for stats in leaderboard],
+        'laps': [stats.laps for stats in leaderboard],
+        'total_time': [time_format(stats.total_time) for stats in leaderboard],
+        'last_lap': [time_format(stats.last_lap) for stats in leaderboard],
+        'behind': [(leader_laps - stats.laps) for stats in leaderboard],
+        'average_lap': [time_format(stats.average_lap()) for stats in leaderboard],
+        'fastest_lap': [time_format(stats.fastest_lap) for stats in leaderboard]
+    }
 
 def emit_leaderboard():
     '''Emits leaderboard.'''
-    # Get the max laps for each pilot
-    max_laps = []
-    for node in range(RACE.num_nodes):
-        max_lap = DB.session.query(DB.func.max(CurrentLap.lap_id)) \
-            .filter_by(node_index=node).scalar()
-        if max_lap is None:
-            max_lap = 0
-        max_laps.append(max_lap)
-    # Get the total race time for each pilot
-    total_time = []
-    for node in range(RACE.num_nodes):
-        if max_laps[node] is 0:
-            total_time.append(0) # Add zero if no laps completed
-        else:
-            total_time.append(CurrentLap.query.filter_by(node_index=node, \
-                lap_id=max_laps[node]).first().lap_time_stamp)
-    # Get the last lap for each pilot
-    last_lap = []
-    for node in range(RACE.num_nodes):
-        if max_laps[node] is 0:
-            last_lap.append(0) # Add zero if no laps completed
-        else:
-            last_lap.append(CurrentLap.query.filter_by(node_index=node, \
-                lap_id=max_laps[node]).first().lap_time)
-    # Get the average lap time for each pilot
-    average_lap = []
-    for node in range(RACE.num_nodes):
-        if max_laps[node] is 0:
-            average_lap.append(0) # Add zero if no laps completed
-        else:
-            avg_lap = DB.session.query(DB.func.avg(CurrentLap.lap_time)) \
-                .filter(CurrentLap.node_index == node, CurrentLap.lap_id != 0).scalar()
-            average_lap.append(avg_lap)
-    # Get the fastest lap time for each pilot
-    fastest_lap = []
-    for node in range(RACE.num_nodes):
-        if max_laps[node] is 0:
-            fastest_lap.append(0) # Add zero if no laps completed
-        else:
-            fast_lap = DB.session.query(DB.func.min(CurrentLap.lap_time)) \
-                .filter(CurrentLap.node_index == node, CurrentLap.lap_id != 0).scalar()
-            fastest_lap.append(fast_lap)
-    # Get the pilot callsigns to add to sort
-    callsigns = []
-    for node in range(RACE.num_nodes):
-        pilot_id = Heat.query.filter_by( \
-            heat_id=RACE.current_heat, node_index=node).first().pilot_id
-        callsigns.append(Pilot.query.filter_by(pilot_id=pilot_id).first().callsign)
-    # Combine for sorting
-    leaderboard = zip(callsigns, max_laps, total_time, last_lap, average_lap, fastest_lap)
-    # Reverse sort max_laps x[1], then sort on total time x[2]
-    leaderboard_sorted = sorted(leaderboard, key = lambda x: (-x[1], x[2]))
-
-    SOCKET_IO.emit('leaderboard', {
-        'position': [i+1 for i in range(RACE.num_nodes)],
-        'callsign': [leaderboard_sorted[i][0] for i in range(RACE.num_nodes)],
-        'laps': [leaderboard_sorted[i][1] for i in range(RACE.num_nodes)],
-        'total_time': [time_format(leaderboard_sorted[i][2]) for i in range(RACE.num_nodes)],
-        'last_lap': [time_format(leaderboard_sorted[i][3]) for i in range(RACE.num_nodes)],
-        'behind': [(leaderboard_sorted[0][1] - leaderboard_sorted[i][1]) \
-            for i in range(RACE.num_nodes)],
-        'average_lap': [time_format(leaderboard_sorted[i][4]) for i in range(RACE.num_nodes)],
-        'fastest_lap': [time_format(leaderboard_sorted[i][5]) for i in range(RACE.num_nodes)]
-    })
-	
+    emit_topic('leaderboard', get_leaderboard_json())
+
+# State sent to a client as one snapshot when it joins a topic using these events
+SNAPSHOT_EVENTS = [
+    ('node_data', get_node_data_json),
+    ('node_tuning', get_node_tuning_json),
+    ('race_status', get_race_status_json),
+    ('current_laps', get_current_laps_json),
+    ('leaderboard', get_leaderboard_json)
+]
+
 def emit_heat_data():
     '''Emits heat data.'''
     current_heats = []
-    for heat in Heat.query.with_entities(Heat.heat_id).distinct():
+    for heat_id in sorted(RACE.heat_pilots):
         pilots = []
         for node in range(RACE.num_nodes):
-            pilot_id = Heat.query.filter_by(heat_id=heat.heat_id, node_index=node).first().pilot_id
-            pilots.append(Pilot.query.filter_by(pilot_id=pilot_id).first().callsign)
+            pilots.append(RACE.get_callsign(node, heat_id))
         current_heats.append({'callsign': pilots})
     current_heats = {'heat_id': current_heats}
-    SOCKET_IO.emit('heat_data', current_heats)
+    emit_topic('heat_data', current_heats)
 
 def emit_pilot_data():
     '''Emits pilot data.'''
-    SOCKET_IO.emit('pilot_data', {
+    emit_topic('pilot_data', {
         'callsign': [pilot.callsign for pilot in Pilot.query.all()],
         'name': [pilot.name for pilot in Pilot.query.all()]
     })
 
 def emit_current_heat():
     '''Emits the current heat.'''
-    callsigns = []
-    for node in range(RACE.num_nodes):
-        pilot_id = Heat.query.filter_by( \
-            heat_id=RACE.current_heat, node_index=node).first().pilot_id
-        callsigns.append(Pilot.query.filter_by(pilot_id=pilot_id).first().callsign)
+    callsigns = [RACE.get_callsign(node) for node in range(RACE.num_nodes)]
 
-    SOCKET_IO.emit('current_heat', {
+    emit_topic('current_heat', {
         'current_heat': RACE.current_heat,
         'callsign': callsigns
     })
@@ -886,38 +1114,47 @@ def emit_current_heat():
 def emit_phonetic_data(pilot_id, lap_id, lap_time):
     '''Emits phonetic data.'''
     phonetic_time = phonetictime_format(lap_time)
-    phonetic_name = Pilot.query.filter_by(pilot_id=pilot_id).first().phonetic
-    SOCKET_IO.emit('phonetic_data', {'pilot': phonetic_name, 'lap': lap_id, 'phonetic': phonetic_time})
+    phonetic_name = RACE.pilot_phonetics.get(pilot_id, '-')
+    emit_topic('phonetic_data', {'pilot': phonetic_name, 'lap': lap_id, 'phonetic': phonetic_time})
 
 def emit_language_data():
     '''Emits language.'''
-    SOCKET_IO.emit('language_data', {'language': RACE.lang_id})
+    emit_topic('language_data', {'language': RACE.lang_id})
 
 def emit_current_fix_race_time():
     ''' Emit current fixed time race time '''
     race_time_sec = FixTimeRace.query.get(1).race_time_sec
-    SOCKET_IO.emit('set_fix_race_time',{ fix_race_time: race_time_sec})
+    emit_topic('set_fix_race_time',{ fix_race_time: race_time_sec})
 
 def emit_phonetic_text(phtext):
     '''Emits given phonetic text.'''
-    SOCKET_IO.emit('speak_phonetic_text', {'text': phtext})
+    emit_topic('speak_phonetic_text', {'text': phtext})
 
 #
 # Program Functions
 #
 
 def heartbeat_thread_function():
-    '''Emits current rssi data.'''
+    '''Emits current rssi data, and the metrics every METRICS_INTERVAL.'''
+    heartbeats = 0
     while True:
-        SOCKET_IO.emit('heartbeat', INTERFACE.get_heartbeat_json())
-        gevent.sleep(0.500)
+        try:
+            # Payloads are only built for rooms with clients in them
+            if room_has_members('heartbeat'):
+                SOCKET_IO.emit('heartbeat', INTERFACE.get_heartbeat_json(), room='heartbeat')
+            if room_has_members('heartbeat_binary'):
+                SOCKET_IO.emit('heartbeat_binary', INTERFACE.get_heartbeat_binary(),
+                    room='heartbeat_binary')
+            heartbeats = heartbeats + 1
+            if heartbeats % int(METRICS_INTERVAL / HEARTBEAT_INTERVAL) == 0:
+                emit_topic('metrics', METRICS.get_json()) # Settings page panel
+        except Exception as err: # One bad emit must not stop the heartbeat
+            server_log('Heartbeat failed: {0}'.format(err))
+        gevent.sleep(HEARTBEAT_INTERVAL)
 
 def ms_from_race_start():
     '''Return milliseconds since race start.'''
-    delta_time = datetime.now() - RACE_START
-    milli_sec = (delta_time.days * 24 * 60 * 60 + delta_time.seconds) \
-        * 1000 + delta_time.microseconds / 1000.0
-    return milli_sec
+    return INTERFACE.milliseconds() - RACE_START_MS
 
 def ms_from_program_start():
     '''Returns the elapsed milliseconds since the start of the program.'''
@@ -946,75 +1183,76 @@ def phonetictime_format(millis):
 	
 def pass_record_callback(node, ms_since_lap):
     '''Handles pass records from the nodes.'''
+    trace = node.trace # Started by the interface, each checkpoint ends a stage
+    if replay_running() and trace.source != 'replay':
+        # Node and simulated passes must not mix into a replayed race
+        server_log('Pass ignored during replay: Node: {0}'.format(node.index))
+        return
+    if trace.source != 'replay': # Replayed passes are not recovered after a restart
+        JOURNAL.race_pass(node, ms_since_lap, INTERFACE.milliseconds())
+    trace.checkpoint('journal')
     server_log('Raw pass record: Node: {0}, MS Since Lap: {1}'.format(node.index, ms_since_lap))
     emit_node_data() # For updated triggers and peaks
+    trace.checkpoint('emit_node_data')
 
     if RACE.race_status is 1:
         # Get the current pilot id on the node
-        pilot_id = Heat.query.filter_by( \
-            heat_id=RACE.current_heat, node_index=node.index).first().pilot_id
-
-        # Calculate the lap time stamp, milliseconds since start of race
-        lap_time_stamp = ms_from_race_start() - ms_since_lap
-
-        # Get the last completed lap from the database
-        last_lap_id = DB.session.query(DB.func.max(CurrentLap.lap_id)) \
-            .filter_by(node_index=node.index).scalar()
-
-        if last_lap_id is None: # No previous laps, this is the first pass
-            # Lap zero represents the time from the launch pad to flying through the gate
-            lap_time = lap_time_stamp
-            lap_id = 0
-        else: # This is a normal completed lap
-            # Find the time stamp of the last lap completed
-            last_lap_time_stamp = CurrentLap.query.filter_by( \
-                node_index=node.index, lap_id=last_lap_id).first().lap_time_stamp
-            # New lap time is the difference between the current time stamp and the last
-            lap_time = lap_time_stamp - last_lap_time_stamp
-            lap_id = last_lap_id + 1
-
-        # Add the new lap to the database
-        DB.session.add(CurrentLap(node_index=node.index, pilot_id=pilot_id, lap_id=lap_id, \
-            lap_time_stamp=lap_time_stamp, lap_time=lap_time, \
-            lap_time_formatted=time_format(lap_time)))
-        DB.session.commit()
+        pilot_id = RACE.get_pilot_id(node.index)
+
+        # Calculate the lap time stamp, milliseconds since start of race, from the pass
+        # time the interface reconciled with the node clock
+        lap_time_stamp = node.pass_timestamp - RACE_START_MS
+
+        # Add the new lap to the race state, lap zero is the launch pad to the first gate pass
+        lap = RACE.add_lap(node.index, pilot_id, lap_time_stamp)
+        lap_sequence = RACE.lap_sequence
+        lap_id = lap['lap_id']
+        lap_time = lap['lap_time']
+        trace.checkpoint('race_state')
+
+        # Persist the lap behind the race state
+        db_write_behind(db_add_current_lap, node.index, lap, trace=trace)
 
         server_log('Pass record: Node: {0}, Lap: {1}, Lap time: {2}' \
             .format(node.index, lap_id, time_format(lap_time)))
-        emit_current_laps() # Updates all laps on the race page
+        emit_lap_added(node.index, lap, lap_sequence) # Adds the lap on the race page
+        trace.checkpoint('emit_lap_added')
         emit_leaderboard() # Updates leaderboard
+        trace.checkpoint('emit_leaderboard')
         if lap_id > 0: 
             emit_phonetic_data(pilot_id, lap_id, lap_time) # Sends phonetic data to be spoken
         if node.index==0:
-            theaterChase(strip, Color(0,0,255))  #BLUE theater chase
+            LED.play(theaterChase, (Color(0,0,255),), key=('pass', node.index))  #BLUE theater chase
         elif node.index==1:
-            theaterChase(strip, Color(255,50,0)) #ORANGE theater chase
+            LED.play(theaterChase, (Color(255,50,0),), key=('pass', node.index)) #ORANGE theater chase
         elif node.index==2:
-            theaterChase(strip, Color(255,0,60)) #PINK theater chase
+            LED.play(theaterChase, (Color(255,0,60),), key=('pass', node.index)) #PINK theater chase
         elif node.index==3:
-            theaterChase(strip, Color(150,0,255)) #PURPLE theater chase
+            LED.play(theaterChase, (Color(150,0,255),), key=('pass', node.index)) #PURPLE theater chase
         elif node.index==4:
-            theaterChase(strip, Color(250,210,0)) #YELLOW theater chase
+            LED.play(theaterChase, (Color(250,210,0),), key=('pass', node.index)) #YELLOW theater chase
         elif node.index==5:
-            theaterChase(strip, Color(0,255,255)) #CYAN theater chase
+            LED.play(theaterChase, (Color(0,255,255),), key=('pass', node.index)) #CYAN theater chase
         elif node.index==6:
-            theaterChase(strip, Color(0,255,0)) #GREEN theater chase
+            LED.play(theaterChase, (Color(0,255,0),), key=('pass', node.index)) #GREEN theater chase
         elif node.index==7:
-            theaterChase(strip, Color(255,0,0)) #RED theater chase
+            LED.play(theaterChase, (Color(255,0,0),), key=('pass', node.index)) #RED theater chase
+        trace.checkpoint('phonetic_and_led')
 
 INTERFACE.pass_record_callback = pass_record_callback
 
 def server_log(message):
     '''Messages emitted from the server script.'''
     print message
-    SOCKET_IO.emit('hardware_log', message)
+    emit_topic('hardware_log', message)
 
 def hardware_log_callback(message):
     '''Message emitted from the delta 5 interface class.'''
     print message
-    SOCKET_IO.emit('hardware_log', message)
+    emit_topic('hardware_log', message)
 
 INTERFACE.hardware_log_callback = hardware_log_callback
+MONITOR.log_callback = server_log
 
 def default_frequencies():
     '''Set node frequencies, IMD for 6 or less and race band for 7 or 8.'''
@@ -1040,8 +1278,20 @@ def db_init():
     db_reset_profile()
     db_reset_default_profile()
     db_reset_fix_race_time()
+    DB.session.commit() # All tables are seeded in one transaction
     server_log('Database initialized')
 
+def db_migrate():
+    '''Adds tables and indexes missing from databases created by older versions.'''
+    DB.create_all() # Only creates tables that don't exist
+    if PilotStats.query.first() is None:
+        db_rebuild_pilot_stats()
+    for table in DB.metadata.sorted_tables:
+        for index in table.indexes:
+            DB.session.execute(text('CREATE INDEX IF NOT EXISTS {0} ON {1} ({2})'.format( \
+                index.name, table.name, ', '.join(column.name for column in index.columns))))
+    DB.session.commit()
+
 def db_reset():
     '''Resets database.'''
     db_reset_pilots()
@@ -1052,6 +1302,8 @@ def db_reset():
     db_reset_profile()
     db_reset_default_profile()
     db_reset_fix_race_time()
+    DB.session.commit()
+    snapshot_changed() # Frequencies, tuning, laps and callsigns
     server_log('Database reset')
 
 def db_reset_keep_pilots():
@@ -1061,103 +1313,267 @@ def db_reset_keep_pilots():
     db_reset_current_laps()
     db_reset_saved_races()
     db_reset_fix_race_time()
+    DB.session.commit()
+    snapshot_changed() # Frequencies, laps and callsigns
     server_log('Database reset, pilots kept')
 
 def db_reset_pilots():
     '''Resets database pilots to default.'''
     DB.session.query(Pilot).delete()
-    DB.session.add(Pilot(pilot_id='0', callsign='-', name='-', phonetic="-"))
+    pilots = [{'pilot_id': 0, 'callsign': '-', 'name': '-', 'phonetic': '-'}]
     for node in range(RACE.num_nodes):
-        DB.session.add(Pilot(pilot_id=node+1, callsign='callsign{0}'.format(node+1), \
-            name='Pilot Name', phonetic='callsign{0}'.format(node+1)))
-    DB.session.commit()
+        pilots.append({'pilot_id': node+1, 'callsign': 'callsign{0}'.format(node+1), \
+            'name': 'Pilot Name', 'phonetic': 'callsign{0}'.format(node+1)})
+    DB.session.execute(Pilot.__table__.insert(), pilots)
+    load_pilots()
     server_log('Database pilots reset')
 def db_reset_heats():
     '''Resets database heats to default.'''
     DB.session.query(Heat).delete()
-    for node in range(RACE.num_nodes):
-        DB.session.add(Heat(heat_id=1, node_index=node, pilot_id=node+1))
-    DB.session.commit()
+    if RACE.num_nodes > 0:
+        DB.session.execute(Heat.__table__.insert(), [ \
+            {'heat_id': 1, 'node_index': node, 'pilot_id': node+1} \
+            for node in range(RACE.num_nodes)])
+    load_heat_pilots()
     server_log('Database heats reset')
-def db_reset_frequencies():
-    '''Resets database frequencies to default.'''
-    DB.session.query(Frequency).delete()
+DEFAULT_FREQUENCIES = [ # (band, channel, frequency)
     # IMD Channels
-    DB.session.add(Frequency(band='IMD', channel='E2', frequency='5685'))
-    DB.session.add(Frequency(band='IMD', channel='F2', frequency='5760'))
-    DB.session.add(Frequency(band='IMD', channel='F4', frequency='5800'))
-    DB.session.add(Frequency(band='IMD', channel='F7', frequency='5860'))
-    DB.session.add(Frequency(band='IMD', channel='E6', frequency='5905'))
-    DB.session.add(Frequency(band='IMD', channel='E4', frequency='5645'))
+    ('IMD', 'E2', 5685),
+    ('IMD', 'F2', 5760),
+    ('IMD', 'F4', 5800),
+    ('IMD', 'F7', 5860),
+    ('IMD', 'E6', 5905),
+    ('IMD', 'E4', 5645),
     # Band R - Raceband
-    DB.session.add(Frequency(band='R', channel='R1', frequency='5658'))
-    DB.session.add(Frequency(band='R', channel='R2', frequency='5695'))
-    DB.session.add(Frequency(band='R', channel='R3', frequency='5732'))
-    DB.session.add(Frequency(band='R', channel='R4', frequency='5769'))
-    DB.session.add(Frequency(band='R', channel='R5', frequency='5806'))
-    DB.session.add(Frequency(band='R', channel='R6', frequency='5843'))
-    DB.session.add(Frequency(band='R', channel='R7', frequency='5880'))
-    DB.session.add(Frequency(band='R', channel='R8', frequency='5917'))
+    ('R', 'R1', 5658),
+    ('R', 'R2', 5695),
+    ('R', 'R3', 5732),
+    ('R', 'R4', 5769),
+    ('R', 'R5', 5806),
+    ('R', 'R6', 5843),
+    ('R', 'R7', 5880),
+    ('R', 'R8', 5917),
     # Band F - ImmersionRC, Iftron
-    DB.session.add(Frequency(band='F', channel='F1', frequency='5740'))
-    DB.session.add(Frequency(band='F', channel='F2', frequency='5760'))
-    DB.session.add(Frequency(band='F', channel='F3', frequency='5780'))
-    DB.session.add(Frequency(band='F', channel='F4', frequency='5800'))
-    DB.session.add(Frequency(band='F', channel='F5', frequency='5820'))
-    DB.session.add(Frequency(band='F', channel='F6', frequency='5840'))
-    DB.session.add(Frequency(band='F', channel='F7', frequency='5860'))
-    DB.session.add(Frequency(band='F', channel='F8', frequency='5880'))
+    ('F', 'F1', 5740),
+    ('F', 'F2', 5760),
+    ('F', 'F3', 5780),
+    ('F', 'F4', 5800),
+    ('F', 'F5', 5820),
+    ('F', 'F6', 5840),
+    ('F', 'F7', 5860),
+    ('F', 'F8', 5880),
     # Band E - HobbyKing, Foxtech
-    DB.session.add(Frequency(band='E', channel='E1', frequency='5705'))
-    DB.session.add(Frequency(band='E', channel='E2', frequency='5685'))
-    DB.session.add(Frequency(band='E', channel='E3', frequency='5665'))
-    DB.session.add(Frequency(band='E', channel='E4', frequency='5645'))
-    DB.session.add(Frequency(band='E', channel='E5', frequency='5885'))
-    DB.session.add(Frequency(band='E', channel='E6', frequency='5905'))
-    DB.session.add(Frequency(band='E', channel='E7', frequency='5925'))
-    DB.session.add(Frequency(band='E', channel='E8', frequency='5945'))
+    ('E', 'E1', 5705),
+    ('E', 'E2', 5685),
+    ('E', 'E3', 5665),
+    ('E', 'E4', 5645),
+    ('E', 'E5', 5885),
+    ('E', 'E6', 5905),
+    ('E', 'E7', 5925),
+    ('E', 'E8', 5945),
     # Band B - FlyCamOne Europe
-    DB.session.add(Frequency(band='B', channel='B1', frequency='5733'))
-    DB.session.add(Frequency(band='B', channel='B2', frequency='5752'))
-    DB.session.add(Frequency(band='B', channel='B3', frequency='5771'))
-    DB.session.add(Frequency(band='B', channel='B4', frequency='5790'))
-    DB.session.add(Frequency(band='B', channel='B5', frequency='5809'))
-    DB.session.add(Frequency(band='B', channel='B6', frequency='5828'))
-    DB.session.add(Frequency(band='B', channel='B7', frequency='5847'))
-    DB.session.add(Frequency(band='B', channel='B8', frequency='5866'))
+    ('B', 'B1', 5733),
+    ('B', 'B2', 5752),
+    ('B', 'B3', 5771),
+    ('B', 'B4', 5790),
+    ('B', 'B5', 5809),
+    ('B', 'B6', 5828),
+    ('B', 'B7', 5847),
+    ('B', 'B8', 5866),
     # Band A - Team BlackSheep, RangeVideo, SpyHawk, FlyCamOne USA
-    DB.session.add(Frequency(band='A', channel='A1', frequency='5865'))
-    DB.session.add(Frequency(band='A', channel='A2', frequency='5845'))
-    DB.session.add(Frequency(band='A', channel='A3', frequency='5825'))
-    DB.session.add(Frequency(band='A', channel='A4', frequency='5805'))
-    DB.session.add(Frequency(band='A', channel='A5', frequency='5785'))
-    DB.session.add(Frequency(band='A', channel='A6', frequency='5765'))
-    DB.session.add(Frequency(band='A', channel='A7', frequency='5745'))
-    DB.session.add(Frequency(band='A', channel='A8', frequency='5725'))
+    ('A', 'A1', 5865),
+    ('A', 'A2', 5845),
+    ('A', 'A3', 5825),
+    ('A', 'A4', 5805),
+    ('A', 'A5', 5785),
+    ('A', 'A6', 5765),
+    ('A', 'A7', 5745),
+    ('A', 'A8', 5725),
     # Band L - Lowband
-    DB.session.add(Frequency(band='L', channel='L1', frequency='5362'))
-    DB.session.add(Frequency(band='L', channel='L2', frequency='5399'))
-    DB.session.add(Frequency(band='L', channel='L3', frequency='5436'))
-    DB.session.add(Frequency(band='L', channel='L4', frequency='5473'))
-    DB.session.add(Frequency(band='L', channel='L5', frequency='5510'))
-    DB.session.add(Frequency(band='L', channel='L6', frequency='5547'))
-    DB.session.add(Frequency(band='L', channel='L7', frequency='5584'))
-    DB.session.add(Frequency(band='L', channel='L8', frequency='5621'))
-    DB.session.commit()
+    ('L', 'L1', 5362),
+    ('L', 'L2', 5399),
+    ('L', 'L3', 5436),
+    ('L', 'L4', 5473),
+    ('L', 'L5', 5510),
+    ('L', 'L6', 5547),
+    ('L', 'L7', 5584),
+    ('L', 'L8', 5621),
+]
+
+def db_reset_frequencies():
+    '''Resets database frequencies to default.'''
+    DB.session.query(Frequency).delete()
+    DB.session.execute(Frequency.__table__.insert(), [ \
+        {'band': band, 'channel': channel, 'frequency': frequency} \
+        for band, channel, frequency in DEFAULT_FREQUENCIES])
     server_log('Database frequencies reset')
 
 def db_reset_current_laps():
     '''Resets database current laps to default.'''
     DB.session.query(CurrentLap).delete()
-    DB.session.commit()
+    RACE.reset_laps()
     server_log('Database current laps reset')
 
+def load_heat_pilots():
+    '''Loads the heat pilot assignments into the race state.'''
+    RACE.heat_pilots = {}
+    for heat in Heat.query.all():
+        pilots = RACE.heat_pilots.setdefault(heat.heat_id, [0] * RACE.num_nodes)
+        if heat.node_index < RACE.num_nodes:
+            pilots[heat.node_index] = heat.pilot_id
+
+def load_pilots():
+    '''Loads the pilot callsigns and phonetics into the race state.'''
+    RACE.pilot_callsigns = {}
+    RACE.pilot_phonetics = {}
+    for pilot in Pilot.query.all():
+        RACE.pilot_callsigns[pilot.pilot_id] = pilot.callsign
+        RACE.pilot_phonetics[pilot.pilot_id] = pilot.phonetic
+
+#
+# Database write behind, the race state in memory is the source of truth during a race
+#
+
+def db_write_behind(function, *args, **kwargs):
+    '''Queues a database write to be applied by the database writer thread, a pass trace
+    given as trace gets a span from queueing to the commit.'''
+    DB_WRITE_QUEUE.put((function, args, kwargs.get('trace'), INTERFACE.milliseconds()))
+
+def db_writer_thread_function():
+    '''Applies queued database writes, all writes waiting are batched into one commit.'''
+    while True:
+        writes = [DB_WRITE_QUEUE.get()]
+        while not DB_WRITE_QUEUE.empty():
+            writes.append(DB_WRITE_QUEUE.get_nowait())
+        try:
+            for function, args, trace, queued in writes:
+                function(*args)
+            DB.session.commit()
+        except Exception as err:
+            # One bad write must not lose the batch or stop the writer, retry them alone
+            DB.session.rollback()
+            server_log('Database write batch failed, retrying each: {0}'.format(err))
+            writes = [write for write in writes if db_write_alone(*write[:2])]
+        committed = INTERFACE.milliseconds()
+        for function, args, trace, queued in writes:
+            if trace is not None:
+                trace.add_span('db_write_behind', queued, committed)
+
+def db_write_alone(function, args):
+    '''Applies and commits one queued write, logs and drops it on failure.'''
+    try:
+        function(*args)
+        DB.session.commit()
+        return True
+    except Exception as err:
+        DB.session.rollback()
+        server_log('Database write failed: {0}{1}: {2}'.format(function.__name__, args, err))
+        return False
+
+def db_add_current_lap(node_index, lap):
+    '''Writes a lap from the race state to the current laps table.'''
+    DB.session.add(CurrentLap(node_index=node_index, pilot_id=lap['pilot_id'], \
+        lap_id=lap['lap_id'], lap_time_stamp=lap['lap_time_stamp'], \
+        lap_time=lap['lap_time'], lap_time_formatted=time_format(lap['lap_time'])))
+
+def db_delete_current_lap(node_index, lap_id, next_lap_time):
+    '''Mirrors a race state lap deletion in the current laps table.'''
+    if next_lap_time is not None:
+        next_lap = CurrentLap.query.filter_by(node_index=node_index, lap_id=lap_id+1).first()
+        if next_lap is not None:
+            next_lap.lap_time = next_lap_time
+            next_lap.lap_time_formatted = time_format(next_lap_time)
+    CurrentLap.query.filter_by(node_index=node_index, lap_id=lap_id).delete()
+    CurrentLap.query.filter(CurrentLap.node_index == node_index, CurrentLap.lap_id > lap_id) \
+        .update({CurrentLap.lap_id: CurrentLap.lap_id - 1}, synchronize_session=False)
+
+def recover_race():
+    '''Rebuilds the race in progress from the journal, the laps of a crashed server.'''
+    global RACE_START
+    global RACE_START_MS
+    records = JOURNAL.replay()
+    starts = [index for index, record in enumerate(records) \
+        if record.record_type == RECORD_START]
+    if not starts:
+        return
+    start = records[starts[-1]]
+    RACE.current_heat = start.lap_id
+    RACE.reset_laps()
+    RACE.race_status = 1
+    for record in records[starts[-1]+1:]:
+        if record.record_type == RECORD_PASS and RACE.race_status == 1 \
+            and record.node_index < RACE.num_nodes:
+            RACE.add_lap(record.node_index, RACE.get_pilot_id(record.node_index), \
+                record.time_a - start.time_b)
+        elif record.record_type == RECORD_DELETE and record.node_index < RACE.num_nodes:
+            RACE.delete_lap(record.node_index, record.lap_id)
+        elif record.record_type == RECORD_STOP:
+            RACE.race_status = 2
+    # Interface milliseconds restart with the program, carry the race start across by wall clock
+    RACE_START = datetime.fromtimestamp(start.time_a)
+    RACE_START_MS = INTERFACE.milliseconds() - (time.time() - start.time_a) * 1000
+    current_laps = [{'node_index': node, 'pilot_id': lap['pilot_id'], \
+        'lap_id': lap['lap_id'], 'lap_time_stamp': lap['lap_time_stamp'], \
+        'lap_time': lap['lap_time'], 'lap_time_formatted': time_format(lap['lap_time'])} \
+        for node in range(RACE.num_nodes) for lap in RACE.get_laps(node)]
+    if current_laps:
+        DB.session.execute(CurrentLap.__table__.insert(), current_laps)
+    DB.session.commit()
+    server_log('Race recovered from the journal: Heat {0}, {1} laps, {2} records' \
+        .format(RACE.current_heat, len(current_laps), len(records)))
+    emit_race_status() # Also drops snapshots cached before the recovery
+    if RACE.race_status == 1:
+        # The journal has no timer mode, a recovered race counts up
+        emit_race_timer('start_timer')
+        server_log('Recovered race is running, passes are registered')
+
+def db_clear_current_laps():
+    '''Clears the current laps table.'''
+    DB.session.query(CurrentLap).delete()
+
 def db_reset_saved_races():
     '''Resets database saved races to default.'''
     DB.session.query(SavedRace).delete()
-    DB.session.commit()
+    DB.session.query(PilotStats).delete()
+    RESULTS.invalidate()
     server_log('Database saved races reset')
 
+def db_add_pilot_stats(node_laps):
+    '''Adds the laps of each node in a saved race to the pilot statistics.'''
+    for laps in node_laps:
+        if not laps or laps[0]['pilot_id'] == 0:
+            continue # No pilot on this node
+        lap_count, lap_time_sum, best_lap, best_consecutive = get_race_stats(laps)
+        stats = PilotStats.query.filter_by(pilot_id=laps[0]['pilot_id']).first()
+        if stats is None:
+            stats = PilotStats(pilot_id=laps[0]['pilot_id'], rounds=0, laps=0, \
+                lap_time_sum=0, best_lap=0, best_consecutive=0)
+            DB.session.add(stats)
+        stats.rounds = stats.rounds + 1
+        stats.laps = stats.laps + lap_count
+        stats.lap_time_sum = stats.lap_time_sum + lap_time_sum
+        if best_lap > 0 and (stats.best_lap == 0 or best_lap < stats.best_lap):
+            stats.best_lap = best_lap
+        if best_consecutive > 0 and (stats.best_consecutive == 0 \
+            or best_consecutive < stats.best_consecutive):
+            stats.best_consecutive = best_consecutive
+
+def db_rebuild_pilot_stats():
+    '''Rebuilds the pilot statistics from all saved races.'''
+    DB.session.query(PilotStats).delete()
+    DB.session.flush()
+    node_laps = []
+    race = None
+    for lap in SavedRace.query.order_by(SavedRace.heat_id, SavedRace.round_id, \
+        SavedRace.node_index, SavedRace.lap_id):
+        if (lap.heat_id, lap.round_id, lap.node_index) != race:
+            race = (lap.heat_id, lap.round_id, lap.node_index)
+            node_laps.append([])
+        node_laps[-1].append({'lap_id': lap.lap_id, 'pilot_id': lap.pilot_id, \
+            'lap_time': lap.lap_time})
+    db_add_pilot_stats(node_laps)
+    DB.session.commit()
+
 def db_reset_profile():
     '''Set default profile'''
     DB.session.query(Profiles).delete()
@@ -1176,20 +1592,17 @@ def db_reset_profile():
                              c_offset=8,
                              c_threshold=100,
                              t_threshold=40))
-    DB.session.commit()
     server_log("Database set default profiles for 25,200,600 mW races")
 
 def db_reset_default_profile():
     DB.session.query(LastProfile).delete()
     DB.session.add(LastProfile(profile_id=1))
-    DB.session.commit()
     server_log("Database set default profile on default 25mW race")
 
 
 def db_reset_fix_race_time():
     DB.session.query(FixTimeRace).delete()
     DB.session.add(FixTimeRace(race_time_sec=120))
-    DB.session.commit()
     server_log("Database set fixed time race to 120 sec (2 minutes)")
 #
 # Program Initialize
@@ -1207,17 +1620,33 @@ default_frequencies()
 # Create database if it doesn't exist
 if not os.path.exists('database.db'):
     db_init()
+else:
+    db_migrate()
 
 # Clear any current laps from the database on each program start
 # DB session commit needed to prevent 'application context' errors
 db_reset_current_laps()
+DB.session.commit()
+
+# Load heat and pilot lookups used during the race into memory
+load_heat_pilots()
+load_pilots()
+
+# Rebuild a race that was in progress when the server stopped
+recover_race()
+DB_WRITER_THREAD = gevent.spawn(db_writer_thread_function)
+
+# Watch for handlers holding the event loop, after the blocking startup work
+MONITOR.start()
 
 # Send initial profile values to nodes
 last_profile = LastProfile.query.get(1)
 tune_val = Profiles.query.get(last_profile.profile_id)
-INTERFACE.set_calibration_threshold_global(tune_val.c_threshold)
-INTERFACE.set_calibration_offset_global(tune_val.c_offset)
-INTERFACE.set_trigger_threshold_global(tune_val.t_threshold)
+INTERFACE.set_config_global({
+    'calibration_threshold': tune_val.c_threshold,
+    'calibration_offset': tune_val.c_offset,
+    'trigger_threshold': tune_val.t_threshold
+})
 
 
 # Test data - Current laps
@@ -1,44 +1,66 @@
 import gevent
-from random import randint
 
 import sys
 
 sys.path.append('../delta5interface')
 from Node import Node
 from BaseHardwareInterface import BaseHardwareInterface
+from Delta5Clock import monotonic
+from SimulatedRace import get_simulated_race
+
+MOCK_UPDATE_PERIOD = 0.05 # Seconds between polls, as the i2c interface polls the nodes
 
 class MockInterface(BaseHardwareInterface):
-    def __init__(self):
+    '''Nodes following the pilots of a simulated race, see SimulatedRace.py.
+    The race starts with the interface, the same seed flies the same race.'''
+    def __init__(self, num_nodes=8, scenario='race', seed=None):
         BaseHardwareInterface.__init__(self)
         self.update_thread = None
+        self.pass_record_callback = None
+        self.hardware_log_callback = None
+        self.race = get_simulated_race(num_nodes, scenario, seed)
         self.nodes = []
         self.calibration_threshold = 20
 
-        frequencies = [5685, 5760, 5800, 5860, 5905, 5645]
-        for index, frequency in enumerate(frequencies):
+        for index, pilot in enumerate(self.race.pilots):
             node = Node()
-            node.frequency = frequency
+            node.frequency = pilot.frequency
             node.index = index
+            node.last_lap_id = pilot.lap
             self.nodes.append(node)
 
     def update_loop(self):
         while True:
             self.update()
-            gevent.sleep(0.1)
+            gevent.sleep(MOCK_UPDATE_PERIOD)
 
     def update(self):
-        for node in self.nodes:
-            node.current_rssi = randint(0,255);
-            gevent.sleep(0.01)
+        now = monotonic()
+        self.race.update(now)
+        timestamp = self.milliseconds()
+        for node, pilot in zip(self.nodes, self.race.pilots):
+            node.current_rssi = pilot.rssi
+            node.trigger_rssi = pilot.trigger_rssi
+            node.history.add(timestamp, node.current_rssi)
+            if pilot.lap != node.last_lap_id:
+                node.last_lap_id = pilot.lap
+                node.peak_rssi_raw = node.peak_rssi = pilot.peak_rssi
+                node.pass_timestamp = (pilot.pass_time - self.start_time) * 1000.0
+                if callable(self.pass_record_callback):
+                    self.start_pass_trace(node, pilot.lap)
+                    self.pass_record_callback(node, int((now - pilot.pass_time) * 1000))
+                    self.metrics.count('delta5_passes_total', node=node.index)
 
     def start(self):
         if self.update_thread is None:
             self.log('starting background thread')
+            self.race.start(monotonic())
             self.update_thread = gevent.spawn(self.update_loop)
 
     def set_frequency(self, node_index, frequency):
         node = self.nodes[node_index]
         node.frequency = frequency
+        self.race.pilots[node_index].frequency = frequency
 
     def set_calibration_threshold_global(self, calibration_threshold):
         self.calibration_threshold = calibration_threshold
@@ -48,6 +70,7 @@ class MockInterface(BaseHardwareInterface):
 
     def set_trigger_threshold_global(self, trigger_threshold):
         self.trigger_threshold = trigger_threshold
+        self.race.trigger_threshold = trigger_threshold
 
     def set_filter_ratio_global(self, filter_ratio):
         self.filter_ratio = filter_ratio
@@ -63,5 +86,5 @@ class MockInterface(BaseHardwareInterface):
         print(string)
 
 
-def get_hardware_interface():
-    return MockInterface()
+def get_hardware_interface(num_nodes=8, scenario='race', seed=None):
+    return MockInterface(num_nodes, scenario, seed)
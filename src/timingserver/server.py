@@ -15,15 +15,19 @@ import argparse
 
 parser = argparse.ArgumentParser(description='Timing Server')
 parser.add_argument('--mock', dest='mock', action='store_true', default=False, help="use mock data for testing")
+parser.add_argument('--nodes', type=int, default=8, help="number of mock nodes, 8 to 64")
+parser.add_argument('--scenario', default='race', help="mock race: practice, race, close_finish or crashes")
+parser.add_argument('--seed', type=int, default=None, help="mock race seed, the same seed flies the same race")
 args = parser.parse_args()
 
 sys.path.append('../delta5interface')
 if args.mock or sys.platform.lower().startswith('win'):
     from MockInterface import get_hardware_interface
+    hardwareInterface = get_hardware_interface(args.nodes, args.scenario, args.seed)
 elif sys.platform.lower().startswith('linux'):
     from Delta5Interface import get_hardware_interface
-
-hardwareInterface = get_hardware_interface()
+    hardwareInterface = get_hardware_interface()
+from Delta5Monitor import get_monitor
 
 # Set this variable to "threading", "eventlet" or "gevent" to test the
 # different async modes, or leave it set to None for the application to choose
@@ -34,6 +38,11 @@ app = Flask(__name__, static_url_path='/static')
 app.config['SECRET_KEY'] = 'secret!'
 socketio = SocketIO(app, async_mode=async_mode, cors_allowed_origins='*')
 heartbeat_thread = None
+rssi_history_thread = None
+
+RSSI_HISTORY_INTERVAL = 0.5 # Seconds between rssi history chunks
+RSSI_HISTORY_DECIMATION = 2 # Poll samples per streamed sample, peaks are kept
+RSSI_HISTORY_JOIN_SAMPLES = 400 # Poll samples sent on join, the 200 points the graph shows
 
 firmware_version = {'major': 0, 'minor': 1}
 
@@ -41,6 +50,8 @@ firmware_version = {'major': 0, 'minor': 1}
 # LED Code
 import time
 from neopixel import *
+from Delta5LED import LEDRenderer, onoff, theaterChase, rainbow, rainbowCycle, \
+    theaterChaseRainbow
 
 import signal
 def signal_handler(signal, frame):
@@ -58,65 +69,13 @@ LED_INVERT     = False   # True to invert the signal (when using NPN transistor
 LED_CHANNEL    = 0       # set to '1' for GPIOs 13, 19, 41, 45 or 53
 LED_STRIP      = ws.WS2811_STRIP_GRB   # Strip type and colour ordering
 
-# LED one color ON/OFF
-def onoff(strip, color):
-	for i in range(strip.numPixels()):
-		strip.setPixelColor(i, color)
-	strip.show()
-
-def theaterChase(strip, color, wait_ms=50, iterations=5):
-    """Movie theater light style chaser animation."""
-    for j in range(iterations):
-        for q in range(3):
-            for i in range(0, strip.numPixels(), 3):
-                strip.setPixelColor(i+q, color)
-            strip.show()
-            time.sleep(wait_ms/1000.0)
-            for i in range(0, strip.numPixels(), 3):
-                strip.setPixelColor(i+q, 0)
-
-def wheel(pos):
-    """Generate rainbow colors across 0-255 positions."""
-    if pos < 85:
-        return Color(pos * 3, 255 - pos * 3, 0)
-    elif pos < 170:
-        pos -= 85
-        return Color(255 - pos * 3, 0, pos * 3)
-    else:
-        pos -= 170
-        return Color(0, pos * 3, 255 - pos * 3)
-		
-def rainbow(strip, wait_ms=2, iterations=1):
-    """Draw rainbow that fades across all pixels at once."""
-    for j in range(256*iterations):
-        for i in range(strip.numPixels()):
-            strip.setPixelColor(i, wheel((i+j) & 255))
-        strip.show()
-        time.sleep(wait_ms/1000.0)
-
-def rainbowCycle(strip, wait_ms=2, iterations=1):
-    """Draw rainbow that uniformly distributes itself across all pixels."""
-    for j in range(256*iterations):
-        for i in range(strip.numPixels()):
-            strip.setPixelColor(i, wheel((int(i * 256 / strip.numPixels()) + j) & 255))
-        strip.show()
-        time.sleep(wait_ms/1000.0)
-
-def theaterChaseRainbow(strip, wait_ms=25):
-    """Rainbow movie theater light style chaser animation."""
-    for j in range(256):
-        for q in range(3):
-            for i in range(0, strip.numPixels(), 3):
-                strip.setPixelColor(i+q, wheel((i+j) % 255))
-            strip.show()
-            time.sleep(wait_ms/1000.0)
-            for i in range(0, strip.numPixels(), 3):
-                strip.setPixelColor(i+q, 0)
-
 # Create NeoPixel object with appropriate configuration.
 strip = Adafruit_NeoPixel(LED_COUNT, LED_PIN, LED_FREQ_HZ, LED_DMA, LED_INVERT, LED_BRIGHTNESS, LED_CHANNEL, LED_STRIP)
 # Intialize the library (must be called once before other functions).
 strip.begin()
+# Effects are played by the renderer greenlet, handlers only queue them
+LED = LEDRenderer(strip)
+LED.precompile([(rainbow, ()), (rainbowCycle, ()), (theaterChaseRainbow, ())])
 
 
 
@@ -145,6 +104,9 @@ def connect_handler():
     global heartbeat_thread
     if (heartbeat_thread is None):
         heartbeat_thread = gevent.spawn(heartbeat_thread_function)
+    global rssi_history_thread
+    if (rssi_history_thread is None):
+        rssi_history_thread = gevent.spawn(rssi_history_thread_function)
 
 @socketio.on('disconnect')
 def disconnect_handler():
@@ -159,6 +121,18 @@ def on_get_timestamp():
     print('get_timestamp')
     return {'timestamp': hardwareInterface.milliseconds()}
 
+@socketio.on('join_rssi_history')
+def on_join_rssi_history():
+    '''Streams rssi history chunks to this client, returns the recent history.'''
+    join_room('rssi_history')
+    starts = [max(node.history.oldest(), node.history.count - RSSI_HISTORY_JOIN_SAMPLES) \
+        for node in hardwareInterface.nodes]
+    return hardwareInterface.get_rssi_history_json(starts, RSSI_HISTORY_DECIMATION)
+
+@socketio.on('leave_rssi_history')
+def on_leave_rssi_history():
+    leave_room('rssi_history')
+
 @socketio.on('get_settings')
 def on_get_settings():
     print('get_settings')
@@ -233,7 +207,7 @@ def on_reset_auto_calibration(data):
     else:
         print('reset_auto_calibration {0}'.format(index))
         hardwareInterface.set_calibration_mode(index, True)
-    onoff(strip, Color(0,255,0)) #GREEN ON
+    LED.play(onoff, (Color(0,255,0),), key='race') #GREEN ON
 
 @socketio.on('simulate_pass')
 def on_simulate_pass(data):
@@ -248,7 +222,7 @@ def on_LED_solid(data):
     led_red = data['red']
     led_green = data['green']
     led_blue = data['blue']
-    onoff(strip, Color(led_red,led_green,led_blue))
+    LED.play(onoff, (Color(led_red,led_green,led_blue),), key='manual')
 
 @socketio.on('LED_chase')
 def on_LED_chase(data):
@@ -256,46 +230,46 @@ def on_LED_chase(data):
     led_red = data['red']
     led_green = data['green']
     led_blue = data['blue']
-    theaterChase(strip, Color(led_red,led_green,led_blue))
+    LED.play(theaterChase, (Color(led_red,led_green,led_blue),), key='manual')
 
 @socketio.on('LED_RB')
 def on_LED_RB():
-    rainbow(strip) #Rainbow
+    LED.play(rainbow, key='manual') #Rainbow
 
 @socketio.on('LED_RBCYCLE')
 def on_LED_RBCYCLE():
-    rainbowCycle(strip) #Rainbow Cycle
+    LED.play(rainbowCycle, key='manual') #Rainbow Cycle
 
 @socketio.on('LED_RBCHASE')
 def on_LED_RBCHASE():
-    theaterChaseRainbow(strip) #Rainbow Chase
+    LED.play(theaterChaseRainbow, key='manual') #Rainbow Chase
 
 def pass_record_callback(node, ms_since_lap):
-    print('Pass record from {0}{1}: {2}, {3}'.format(node.index, node.frequency, ms_since_lap, hardwareInterface.milliseconds() - ms_since_lap))
+    print('Pass record from {0}{1}: {2}, {3}'.format(node.index, node.frequency, ms_since_lap, node.pass_timestamp))
     #TODO: clean this up
     socketio.emit('pass_record', {
         'node': node.index,
         'frequency': node.frequency,
-        'timestamp': hardwareInterface.milliseconds() - ms_since_lap,
+        'timestamp': node.pass_timestamp,
         'trigger_rssi': node.trigger_rssi,
         'peak_rssi_raw': node.peak_rssi_raw,
         'peak_rssi': node.peak_rssi})
     if node.index==0:
-        theaterChase(strip, Color(0,0,255))  #BLUE theater chase
+        LED.play(theaterChase, (Color(0,0,255),), key=('pass', node.index))  #BLUE theater chase
     elif node.index==1:
-        theaterChase(strip, Color(255,50,0)) #ORANGE theater chase
+        LED.play(theaterChase, (Color(255,50,0),), key=('pass', node.index)) #ORANGE theater chase
     elif node.index==2:
-        theaterChase(strip, Color(255,0,60)) #PINK theater chase
+        LED.play(theaterChase, (Color(255,0,60),), key=('pass', node.index)) #PINK theater chase
     elif node.index==3:
-        theaterChase(strip, Color(255,0,150)) #PURPLE theater chase
+        LED.play(theaterChase, (Color(255,0,150),), key=('pass', node.index)) #PURPLE theater chase
     elif node.index==4:
-        theaterChase(strip, Color(255,255,0)) #YELLOW theater chase
+        LED.play(theaterChase, (Color(255,255,0),), key=('pass', node.index)) #YELLOW theater chase
     elif node.index==5:
-        theaterChase(strip, Color(0,255,255)) #CYAN theater chase
+        LED.play(theaterChase, (Color(0,255,255),), key=('pass', node.index)) #CYAN theater chase
     elif node.index==6:
-        theaterChase(strip, Color(0,255,0)) #GREEN theater chase
+        LED.play(theaterChase, (Color(0,255,0),), key=('pass', node.index)) #GREEN theater chase
     elif node.index==7:
-        theaterChase(strip, Color(255,0,0)) #RED theater chase
+        LED.play(theaterChase, (Color(255,0,0),), key=('pass', node.index)) #RED theater chase
 
 hardwareInterface.pass_record_callback = pass_record_callback
 
@@ -305,10 +279,30 @@ def hardware_log_callback(message):
 
 hardwareInterface.hardware_log_callback = hardware_log_callback
 
+monitor = get_monitor(hardwareInterface.metrics) # Logs handlers holding the event loop
+monitor.log_callback = hardware_log_callback
+monitor.start()
+
+def room_has_members(room):
+    '''Returns whether any client is in a room, to skip building data nobody receives.'''
+    return bool(socketio.server.manager.rooms.get('/', {}).get(room))
+
 def heartbeat_thread_function():
     while True:
         socketio.emit('heartbeat', hardwareInterface.get_heartbeat_json())
         gevent.sleep(0.5)
 
+def rssi_history_thread_function():
+    '''Emits the rssi samples polled since the last chunk to subscribed clients.'''
+    starts = [node.history.count for node in hardwareInterface.nodes]
+    while True:
+        gevent.sleep(RSSI_HISTORY_INTERVAL)
+        if not room_has_members('rssi_history'): # Joining clients get the recent history
+            starts = [node.history.count for node in hardwareInterface.nodes]
+            continue
+        chunk = hardwareInterface.get_rssi_history_json(starts, RSSI_HISTORY_DECIMATION)
+        starts = [node['next'] for node in chunk['nodes']]
+        socketio.emit('rssi_history', chunk, room='rssi_history')
+
 if __name__ == '__main__':
     socketio.run(app, host='0.0.0.0', debug=True)